@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from database import Database, db
+
+logger = logging.getLogger(__name__)
+
+
+def _round(value: float, digits: int = 3) -> Optional[float]:
+    return None if value is None or not np.isfinite(value) else round(float(value), digits)
+
+
+def cronbach_alpha(matrix: np.ndarray) -> Optional[float]:
+    """Cronbach's alpha of a respondents x items matrix without gaps"""
+    n, k = matrix.shape
+    if n < 2 or k < 2:
+        return None
+    item_variances = matrix.var(axis=0, ddof=1)
+    total_variance = matrix.sum(axis=1).var(ddof=1)
+    if total_variance == 0:
+        return None
+    return k / (k - 1) * (1 - item_variances.sum() / total_variance)
+
+
+def item_statistics(matrix: np.ndarray) -> Dict[str, np.ndarray]:
+    """Per-item corrected item-total correlation and alpha-if-deleted
+
+    Each item is correlated with the total of the other items, which
+    avoids the inflation of correlating an item with a total containing it.
+    """
+    n, k = matrix.shape
+    nan = np.full(k, np.nan)
+    if n < 2:
+        return {"item_total_correlation": nan, "alpha_if_deleted": nan}
+
+    totals = matrix.sum(axis=1)
+    rest = totals[:, None] - matrix
+
+    items_centered = matrix - matrix.mean(axis=0)
+    rest_centered = rest - rest.mean(axis=0)
+    covariance = (items_centered * rest_centered).sum(axis=0)
+    norms = np.sqrt((items_centered ** 2).sum(axis=0) * (rest_centered ** 2).sum(axis=0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlation = np.where(norms > 0, covariance / norms, np.nan)
+
+    if k > 2:
+        item_variances = matrix.var(axis=0, ddof=1)
+        rest_variances = rest.var(axis=0, ddof=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            alpha_if_deleted = np.where(
+                rest_variances > 0,
+                (k - 1) / (k - 2) * (1 - (item_variances.sum() - item_variances) / rest_variances),
+                np.nan
+            )
+    else:
+        alpha_if_deleted = nan
+
+    return {"item_total_correlation": correlation, "alpha_if_deleted": alpha_if_deleted}
+
+
+class ItemAnalyzer:
+    """Vectorized item analysis of a category's user_responses
+
+    Responses are streamed from SQLite in chunks into NumPy arrays. Results
+    are cached per category and recomputed only when the number of stored
+    responses or the catalog version changes.
+    """
+
+    def __init__(self, database: Database, chunk_size: int = 50000):
+        self.database = database
+        self.chunk_size = chunk_size
+        self._cache: Dict[int, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+
+    async def _load(self, category_id: int) -> np.ndarray:
+        """All responses of a category as an (n, 5) int64 array in id order"""
+        chunks: List[np.ndarray] = []
+        async for rows in self.database.iter_user_responses(category_id, self.chunk_size):
+            chunks.append(np.array(rows, dtype=np.int64))
+        if not chunks:
+            return np.empty((0, 5), dtype=np.int64)
+        return np.concatenate(chunks)
+
+    async def analyze(self, category_id: int) -> Dict[str, Any]:
+        row_count = await self.database.count_user_responses(category_id)
+        catalog_version = await self.database.get_catalog_version()
+        cache_key = (row_count, catalog_version)
+        cached = self._cache.get(category_id)
+        if cached and cached[0] == cache_key:
+            # No new responses and no catalog edits since the last run
+            return cached[1]
+
+        started = time.perf_counter()
+        questions = await self.database.get_questions_by_category(category_id)
+        answer_texts = await self._answer_texts(questions)
+        responses = await self._load(category_id)
+        # Keep the event loop free while NumPy crunches large categories
+        result = await asyncio.to_thread(self._compute, questions, answer_texts, responses)
+        result["category_id"] = category_id
+        result["rows"] = int(len(responses))
+        logger.info(
+            f"Item analysis for category {category_id}: {len(responses)} rows "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+        self._cache[category_id] = (cache_key, result)
+        return result
+
+    async def _answer_texts(self, questions: List[Dict]) -> Dict[int, str]:
+        texts = {}
+        for question in questions:
+            for answer in await self.database.get_answers_by_question(question['id']):
+                texts[answer['id']] = answer['answer_text']
+        return texts
+
+    def _compute(self, questions: List[Dict], answer_texts: Dict[int, str],
+                 responses: np.ndarray) -> Dict[str, Any]:
+        question_ids = np.array([q['id'] for q in questions], dtype=np.int64)
+        k = len(question_ids)
+        result: Dict[str, Any] = {
+            "respondents": 0,
+            "complete_respondents": 0,
+            "cronbach_alpha": None,
+            "questions": [],
+        }
+        if k == 0:
+            return result
+
+        # Keep responses to current questions only, mapped to column indexes
+        order = np.argsort(question_ids)
+        sorted_ids = question_ids[order]
+        positions = np.searchsorted(sorted_ids, responses[:, 2]).clip(0, k - 1)
+        known = sorted_ids[positions] == responses[:, 2]
+        responses = responses[known]
+        columns = order[positions[known]]
+
+        # Respondent rows; a re-answered question keeps the latest answer
+        respondents, rows = np.unique(responses[:, 1], return_inverse=True)
+        cells = rows.astype(np.int64) * k + columns
+        _, last = np.unique(cells[::-1], return_index=True)
+        latest = len(cells) - 1 - last
+
+        matrix = np.full((len(respondents), k), np.nan)
+        matrix[rows[latest], columns[latest]] = responses[latest, 4]
+        complete = matrix[~np.isnan(matrix).any(axis=1)]
+
+        answered = (~np.isnan(matrix)).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.nansum(matrix, axis=0) / answered
+        stats = item_statistics(complete)
+
+        # Answer distributions from the latest answers, per (column, answer_id)
+        pair_keys, pair_counts = np.unique(
+            np.stack([columns[latest], responses[latest, 3]], axis=1), axis=0, return_counts=True
+        )
+
+        result["respondents"] = int(len(respondents))
+        result["complete_respondents"] = int(len(complete))
+        result["cronbach_alpha"] = _round(cronbach_alpha(complete)) if len(complete) else None
+
+        distributions: Dict[int, List[Dict[str, Any]]] = {}
+        for (column, answer_id), count in zip(pair_keys.tolist(), pair_counts.tolist()):
+            distributions.setdefault(column, []).append({
+                "answer_id": answer_id,
+                "answer_text": answer_texts.get(answer_id),
+                "count": count
+            })
+
+        for column, question in enumerate(questions):
+            result["questions"].append({
+                "question_id": question['id'],
+                "question_text": question['question_text'],
+                "responses": int(answered[column]),
+                "mean": _round(means[column]) if answered[column] else None,
+                "item_total_correlation": _round(stats["item_total_correlation"][column]),
+                "alpha_if_deleted": _round(stats["alpha_if_deleted"][column]),
+                "answer_distribution": distributions.get(column, []),
+            })
+        return result
+
+
+# Global analyzer instance
+item_analyzer = ItemAnalyzer(db)
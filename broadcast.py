@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callback_codec import encode_callback
+from config import get_settings
+from database import Database, db
+from rate_limiter import bulk_priority
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+SENT, FAILED, BLOCKED = "sent", "failed", "blocked"
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours} soat {minutes} daqiqa"
+    if minutes:
+        return f"{minutes} daqiqa {seconds} soniya"
+    return f"{seconds} soniya"
+
+
+class Broadcaster:
+    """Sends broadcast jobs to all registered users
+
+    Recipients are read page by page in chat_id order and each page is
+    sent by up to `workers` concurrent senders under bulk_priority(), so
+    the rate-limited session keeps them within Telegram's limits and
+    behind interactive replies. After a page the job's last_chat_id is
+    checkpointed; running jobs are resumed on startup, which may resend
+    at most the page that was in flight when the process died. Users who
+    blocked the bot are marked and skipped by later broadcasts. The
+    admin's status message is edited with progress every
+    status_interval seconds.
+
+    With several workers on one database, a job is only sent by the
+    worker holding its claim, renewed after every page. Every worker
+    looks for unclaimed running jobs on startup and then every
+    lease_seconds, so a job whose worker died is picked up once its
+    lease runs out. A job cancelled in the database stops at the next
+    renewal, whichever worker sends it.
+    """
+
+    def __init__(self, database: Database, page_size: int = 200, workers: int = 20,
+                 status_interval: float = 5.0, lease_seconds: float = 120.0):
+        self.database = database
+        self.page_size = max(1, page_size)
+        self.workers = max(1, workers)
+        self.status_interval = status_interval
+        self.lease_seconds = lease_seconds
+        self.owner = uuid.uuid4().hex
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancelled: set = set()
+        self._stopping = False
+        self._watcher: Optional[asyncio.Task] = None
+
+    def start(self, bot: Bot, broadcast_id: int):
+        if broadcast_id in self._tasks:
+            return
+        self._stopping = False
+        task = asyncio.create_task(self._run(bot, broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def resume(self, bot: Bot):
+        """Start running jobs that no worker holds a claim on"""
+        now = time.time()
+        for job in await self.database.get_running_broadcasts():
+            if job['id'] in self._tasks or (job['claimed_until'] or 0) >= now:
+                continue
+            logger.info(f"Resuming broadcast {job['id']} after chat {job['last_chat_id']}")
+            self.start(bot, job['id'])
+
+    def watch(self, bot: Bot):
+        """Resume now and then every lease_seconds, until close()"""
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch(bot))
+
+    async def _watch(self, bot: Bot):
+        while not self._stopping:
+            try:
+                await self.resume(bot)
+            except Exception as e:
+                logger.error(f"Failed to resume broadcasts: {e}")
+            await asyncio.sleep(self.lease_seconds)
+
+    def cancel(self, broadcast_id: int) -> bool:
+        """Stop a job after its current page; returns False if it is not running here"""
+        if broadcast_id not in self._tasks:
+            return False
+        self._cancelled.add(broadcast_id)
+        return True
+
+    async def close(self, timeout: float = 10.0):
+        """Let running jobs checkpoint their current page, then stop them"""
+        self._stopping = True
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _send(self, bot: Bot, chat_id: int, text: str, semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            try:
+                with bulk_priority():
+                    await bot.send_message(chat_id, text)
+                return SENT
+            except TelegramForbiddenError:
+                # Blocked the bot or deleted the account
+                return BLOCKED
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return BLOCKED
+                logger.warning(f"Broadcast to {chat_id} failed: {e}")
+                return FAILED
+            except Exception as e:
+                logger.warning(f"Broadcast to {chat_id} failed: {e}")
+                return FAILED
+
+    async def _run(self, bot: Bot, broadcast_id: int):
+        job = await self.database.get_broadcast(broadcast_id)
+        if job is None or job['status'] != 'running':
+            return
+        if not await self.database.claim_broadcast(broadcast_id, self.owner, self.lease_seconds):
+            # Sent by another worker
+            return
+
+        semaphore = asyncio.Semaphore(self.workers)
+        last_chat_id = job['last_chat_id']
+        started = time.monotonic()
+        processed_here = 0
+        last_status = started
+        try:
+            while not self._stopping and broadcast_id not in self._cancelled:
+                page = await self.database.get_broadcast_recipients(last_chat_id, self.page_size)
+                if not page:
+                    await self.database.finish_broadcast(broadcast_id, 'done')
+                    break
+
+                results = await asyncio.gather(*(
+                    self._send(bot, chat_id, job['text'], semaphore) for chat_id in page
+                ))
+                blocked = [chat_id for chat_id, result in zip(page, results) if result == BLOCKED]
+                sent = results.count(SENT)
+                failed = results.count(FAILED)
+                last_chat_id = page[-1]
+                await self.database.save_broadcast_progress(broadcast_id, last_chat_id, sent, failed, blocked)
+                processed_here += len(page)
+                if not await self.database.claim_broadcast(broadcast_id, self.owner, self.lease_seconds):
+                    # Cancelled elsewhere, or the lease ran out and another worker took over
+                    logger.info(f"Broadcast {broadcast_id} is no longer claimed by this worker")
+                    break
+
+                if time.monotonic() - last_status >= self.status_interval:
+                    last_status = time.monotonic()
+                    rate = processed_here / (last_status - started)
+                    await self._report(bot, broadcast_id, rate)
+
+            if broadcast_id in self._cancelled:
+                await self.database.finish_broadcast(broadcast_id, 'cancelled')
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast_id} stopped: {e}")
+        finally:
+            self._cancelled.discard(broadcast_id)
+            try:
+                await self.database.release_broadcast(broadcast_id, self.owner)
+            except Exception as e:
+                logger.error(f"Failed to release broadcast {broadcast_id}: {e}")
+
+        elapsed = time.monotonic() - started
+        await self._report(bot, broadcast_id, processed_here / elapsed if elapsed else 0.0)
+
+    async def _report(self, bot: Bot, broadcast_id: int, rate: float):
+        job = await self.database.get_broadcast(broadcast_id)
+        if job is None or not job['status_message_id']:
+            return
+        try:
+            await bot.edit_message_text(
+                format_status(job, rate),
+                chat_id=job['admin_chat_id'],
+                message_id=job['status_message_id'],
+                reply_markup=status_keyboard(job)
+            )
+        except TelegramBadRequest as e:
+            # "message is not modified" when nothing changed since the last edit
+            if "not modified" not in str(e):
+                logger.warning(f"Failed to update broadcast {broadcast_id} status: {e}")
+        except Exception as e:
+            logger.warning(f"Failed to update broadcast {broadcast_id} status: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": sorted(self._tasks)}
+
+
+def format_status(job: Dict, rate: Optional[float] = None) -> str:
+    processed = job['sent'] + job['failed'] + job['blocked']
+    total = max(job['total'], processed)
+    percent = processed * 100 // total if total else 100
+    titles = {'running': "⏳ Yuborilmoqda", 'done': "✅ Yakunlandi", 'cancelled': "⛔️ To'xtatildi"}
+    text = (
+        f"📣 Xabar #{job['id']}: {titles.get(job['status'], job['status'])}\n\n"
+        f"Jarayon: {processed}/{total} ({percent}%)\n"
+        f"✅ Yuborildi: {job['sent']}\n"
+        f"🚫 Bloklagan: {job['blocked']}\n"
+        f"⚠️ Xatolik: {job['failed']}\n"
+    )
+    if rate:
+        text += f"Tezlik: {rate:.1f} xabar/s\n"
+        if job['status'] == 'running':
+            text += f"Qolgan vaqt: ~{_format_duration((total - processed) / rate)}\n"
+    return text
+
+
+def status_keyboard(job: Dict) -> Optional[InlineKeyboardMarkup]:
+    if job['status'] != 'running':
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="⛔️ To'xtatish", callback_data=encode_callback("broadcast_cancel", job['id']))
+    ]])
+
+
+# Global broadcaster instance
+broadcaster = Broadcaster(
+    db,
+    page_size=settings.BROADCAST_PAGE_SIZE,
+    workers=settings.BROADCAST_WORKERS,
+    status_interval=settings.BROADCAST_STATUS_SECONDS,
+    lease_seconds=settings.BROADCAST_LEASE_SECONDS
+)
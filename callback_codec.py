@@ -0,0 +1,157 @@
+import base64
+import hashlib
+import hmac
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Tuple
+
+from config import get_settings
+
+# Telegram rejects callback_data longer than 64 bytes
+MAX_CALLBACK_DATA = 64
+VERSION = 1
+TAG_SIZE = 4
+# Buttons are the same for every user taking a test, so recent results are cached
+CODEC_CACHE_SIZE = 8192
+
+# Action ids used on the wire. Append only: ids of shipped actions must never change.
+ACTIONS: Tuple[str, ...] = (
+    "select_category",
+    "start_test",
+    "answer",
+    "back_to_categories",
+    "cancel_action",
+    "delete_category",
+    "add_question_category",
+    "delete_q_category",
+    "delete_question",
+    "add_response_category",
+    "list_responses_category",
+    "analysis_category",
+    "broadcast_confirm",
+    "broadcast_cancel",
+)
+ACTION_IDS = {name: action_id for action_id, name in enumerate(ACTIONS)}
+
+# Trailing legacy arguments that are no longer trusted from the client
+LEGACY_DROPPED_ARGS = {
+    "answer": 1,  # the answer value, now looked up from the loaded test
+}
+
+
+class CallbackDataError(ValueError):
+    """Callback data that is malformed, of an unknown version or fails the integrity check"""
+
+
+@dataclass(frozen=True)
+class CallbackAction:
+    """Callback data parsed once: the action name and its integer arguments"""
+    name: str
+    args: Tuple[int, ...] = ()
+
+
+@lru_cache()
+def _key() -> bytes:
+    settings = get_settings()
+    # Derived from the bot token unless set explicitly; changing it invalidates shown buttons
+    secret = settings.CALLBACK_SECRET or f"callback-data:{settings.BOT_TOKEN}"
+    return hashlib.sha256(secret.encode()).digest()
+
+
+def _tag(body: bytes) -> bytes:
+    return hmac.digest(_key(), body, "sha256")[:TAG_SIZE]
+
+
+def _legacy_accepted() -> bool:
+    until = get_settings().CALLBACK_LEGACY_UNTIL
+    if until is None:
+        return False
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) < until
+
+
+@lru_cache(maxsize=CODEC_CACHE_SIZE)
+def encode_callback(name: str, *args: int) -> str:
+    """Encode an action and its non-negative integer arguments
+
+    Layout: the version digit, then base64url (unpadded) of the action id
+    and the arguments as LEB128 varints followed by a truncated
+    HMAC-SHA256 tag over version and body.
+    """
+    body = bytearray((VERSION,))
+    for value in (ACTION_IDS[name], *args):
+        if value < 0:
+            raise ValueError(f"Callback arguments must be non-negative: {args}")
+        while value > 0x7F:
+            body.append((value & 0x7F) | 0x80)
+            value >>= 7
+        body.append(value)
+    payload = bytes(body[1:]) + _tag(bytes(body))
+    data = f"{VERSION}{base64.urlsafe_b64encode(payload).rstrip(b'=').decode()}"
+    if len(data) > MAX_CALLBACK_DATA:
+        raise ValueError(f"Encoded callback data is {len(data)} bytes, Telegram allows {MAX_CALLBACK_DATA}")
+    return data
+
+
+def _decode_v1(encoded: str) -> CallbackAction:
+    try:
+        payload = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+    except ValueError:
+        raise CallbackDataError("Callback data is not base64url")
+    body, tag = payload[:-TAG_SIZE], payload[-TAG_SIZE:]
+    if not body or not hmac.compare_digest(tag, _tag(bytes((VERSION,)) + body)):
+        raise CallbackDataError("Callback data failed the integrity check")
+
+    values = []
+    value = shift = 0
+    for byte in body:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    if shift:
+        raise CallbackDataError("Truncated varint in callback data")
+    if values[0] >= len(ACTIONS):
+        raise CallbackDataError(f"Unknown callback action id {values[0]}")
+    return CallbackAction(ACTIONS[values[0]], tuple(values[1:]))
+
+
+def parse_legacy(data: str) -> CallbackAction:
+    """Split "select_category_5" into ("select_category", (5,)) and "cancel_action" into ("cancel_action", ())"""
+    parts = data.split("_")
+    end = len(parts)
+    while end > 1 and parts[end - 1].isdigit():
+        end -= 1
+    name = "_".join(parts[:end])
+    args = tuple(int(part) for part in parts[end:])
+    dropped = LEGACY_DROPPED_ARGS.get(name)
+    if dropped and len(args) > dropped:
+        args = args[:-dropped]
+    return CallbackAction(name, args)
+
+
+@lru_cache(maxsize=CODEC_CACHE_SIZE)
+def decode_signed(data: str) -> CallbackAction:
+    """Decode data made by encode_callback; failures raise and are not cached"""
+    if data[:1] != str(VERSION):
+        raise CallbackDataError(f"Unsupported callback data version {data[:1]}")
+    return _decode_v1(data[1:])
+
+
+def decode_callback(data: str) -> CallbackAction:
+    """Decode encoded callback data, or parse the legacy "<name>_<int>_..." format
+
+    Legacy data always starts with a letter, encoded data with its version
+    digit. Legacy data is unsigned, so it is only accepted until
+    CALLBACK_LEGACY_UNTIL, to keep keyboards sent before the codec existed
+    working through a transition window.
+    """
+    if data[:1].isdigit():
+        return decode_signed(data)
+    if not _legacy_accepted():
+        raise CallbackDataError("Unsigned legacy callback data is no longer accepted")
+    return parse_legacy(data)
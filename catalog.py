@@ -0,0 +1,147 @@
+import aiosqlite
+from bisect import bisect_right
+from typing import List, Optional, Dict, Tuple
+
+
+class ScoreBandIndex:
+    """Sorted interval index over one category's score-based responses
+
+    Bands are flattened into disjoint segments at build time, so a lookup is
+    a single bisect. Where bands overlap, the earliest created band (lowest
+    id) owns the overlapping scores, which keeps results deterministic.
+    """
+
+    def __init__(self, responses: List[Dict]):
+        self.bands = sorted(responses, key=lambda r: r['id'])
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._owners: List[Dict] = []
+
+        points = sorted(
+            {r['min_score'] for r in self.bands} | {r['max_score'] + 1 for r in self.bands}
+        )
+        for start, next_start in zip(points, points[1:]):
+            end = next_start - 1
+            owner = next(
+                (r for r in self.bands if r['min_score'] <= start and end <= r['max_score']),
+                None
+            )
+            if owner is None:
+                continue
+            if self._owners and self._owners[-1] is owner and self._ends[-1] == start - 1:
+                self._ends[-1] = end
+            else:
+                self._starts.append(start)
+                self._ends.append(end)
+                self._owners.append(owner)
+
+    def lookup(self, score: int) -> Optional[Dict]:
+        idx = bisect_right(self._starts, score) - 1
+        if idx >= 0 and score <= self._ends[idx]:
+            return self._owners[idx]
+        return None
+
+    def check(self, min_score: int, max_score: int) -> Dict:
+        """Overlaps and coverage gaps if a band [min_score, max_score] were added"""
+        overlaps = [
+            r for r in self.bands
+            if r['min_score'] <= max_score and min_score <= r['max_score']
+        ]
+
+        intervals = sorted(
+            [(r['min_score'], r['max_score']) for r in self.bands] + [(min_score, max_score)]
+        )
+        gaps: List[Tuple[int, int]] = []
+        covered_to = intervals[0][1]
+        for start, end in intervals[1:]:
+            if start > covered_to + 1:
+                gaps.append((covered_to + 1, start - 1))
+            covered_to = max(covered_to, end)
+
+        return {"overlaps": overlaps, "gaps": gaps}
+
+
+class Catalog:
+    """Immutable in-memory snapshot of the quiz catalog
+
+    Holds categories, questions, answers and score-based responses, which
+    only change through the admin handlers. A new snapshot is built after
+    every catalog write and swapped in as a whole, so readers never see a
+    half-applied change.
+    """
+
+    def __init__(self, version: int, categories: List[Dict], questions: List[Dict],
+                 answers: List[Dict], responses: List[Dict]):
+        self.version = version
+
+        self.categories = sorted(categories, key=lambda c: (c['created_at'] or '', c['id']))
+        self.categories_by_id = {c['id']: c for c in self.categories}
+
+        self.questions_by_id: Dict[int, Dict] = {}
+        self.questions_by_category: Dict[int, List[Dict]] = {}
+        for question in sorted(questions, key=lambda q: (q['order_num'] or 0, q['id'])):
+            self.questions_by_id[question['id']] = question
+            self.questions_by_category.setdefault(question['category_id'], []).append(question)
+
+        self.answers_by_question: Dict[int, List[Dict]] = {}
+        for answer in sorted(answers, key=lambda a: (a['value'], a['id'])):
+            self.answers_by_question.setdefault(answer['question_id'], []).append(answer)
+
+        self.responses_by_category: Dict[int, List[Dict]] = {}
+        for response in sorted(responses, key=lambda r: (r['min_score'], r['id'])):
+            self.responses_by_category.setdefault(response['category_id'], []).append(response)
+        self.bands_by_category = {
+            category_id: ScoreBandIndex(category_responses)
+            for category_id, category_responses in self.responses_by_category.items()
+        }
+
+    def get_category(self, category_id: int) -> Optional[Dict]:
+        return self.categories_by_id.get(category_id)
+
+    def get_questions(self, category_id: int) -> List[Dict]:
+        return self.questions_by_category.get(category_id, [])
+
+    def get_question(self, question_id: int) -> Optional[Dict]:
+        return self.questions_by_id.get(question_id)
+
+    def get_answers(self, question_id: int) -> List[Dict]:
+        return self.answers_by_question.get(question_id, [])
+
+    def get_responses(self, category_id: int) -> List[Dict]:
+        return self.responses_by_category.get(category_id, [])
+
+    def get_bands(self, category_id: int) -> ScoreBandIndex:
+        return self.bands_by_category.get(category_id) or ScoreBandIndex([])
+
+
+async def _fetch_all(conn: aiosqlite.Connection, query: str) -> List[Dict]:
+    async with conn.execute(query) as cursor:
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+
+async def get_catalog_version(conn: aiosqlite.Connection) -> int:
+    """Version of the catalog in the database, bumped by every catalog write"""
+    async with conn.execute("SELECT version FROM catalog_version WHERE id = 1") as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+
+async def load_catalog(conn: aiosqlite.Connection) -> Catalog:
+    """Read the whole catalog from the database into a new snapshot"""
+    # Version first: a write landing mid-load only makes the snapshot look older
+    version = await get_catalog_version(conn)
+    # Deleted rows are kept for test history but never shown
+    categories = await _fetch_all(conn, "SELECT * FROM categories WHERE deleted_at IS NULL")
+    questions = await _fetch_all(conn, "SELECT * FROM questions WHERE deleted_at IS NULL")
+    answers = await _fetch_all(conn, "SELECT * FROM answers WHERE deleted_at IS NULL")
+    responses = await _fetch_all(conn, "SELECT * FROM category_responses")
+
+    # Children of deleted rows are dropped here; orphans can also exist in
+    # databases written before foreign keys were enforced
+    category_ids = {c['id'] for c in categories}
+    questions = [q for q in questions if q['category_id'] in category_ids]
+    question_ids = {q['id'] for q in questions}
+    answers = [a for a in answers if a['question_id'] in question_ids]
+
+    return Catalog(version, categories, questions, answers, responses)
@@ -1,241 +1,417 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
 import aiosqlite
+from contextlib import asynccontextmanager
 from typing import List, Optional, Dict, Any
 from config import get_settings
+from catalog import Catalog, get_catalog_version, load_catalog
+from metrics import instrument_methods
+from migrations import SCORE_ROLLUPS_VERSION, check_query_plans, get_schema_version, migrate
+from write_buffer import WriteBehindBuffer
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
 
+@instrument_methods
 class Database:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, read_pool_size: int = 4, busy_timeout_ms: int = 5000,
+                 response_flush_rows: int = 50, response_flush_interval_ms: int = 200,
+                 response_queue_size: int = 1000, score_bucket_width: int = 5,
+                 catalog_check_seconds: float = 1.0):
         self.db_path = db_path
+        self.score_bucket_width = max(1, score_bucket_width)
+        self.read_pool_size = max(1, read_pool_size)
+        self.busy_timeout_ms = busy_timeout_ms
+
+        # One writer connection (SQLite allows a single writer anyway) and a
+        # small pool of reader connections, all opened once in init_db
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_connections: List[aiosqlite.Connection] = []
+
+        # Catalog snapshot served to all catalog reads; rebuilt on admin writes
+        # here and reloaded when the shared version shows another worker's write
+        self._catalog: Optional[Catalog] = None
+        self._catalog_lock = asyncio.Lock()
+        self.catalog_check_seconds = catalog_check_seconds
+        self._catalog_checked_at = 0.0
+        self._catalog_stats = {"hits": 0, "misses": 0, "checks": 0, "reloads": 0}
+
+        # Answer taps and queued FSM records are written in batches off the latency path
+        self._write_behind = WriteBehindBuffer(
+            self._write_queued,
+            flush_rows=response_flush_rows,
+            flush_interval_ms=response_flush_interval_ms,
+            max_pending=response_queue_size
+        )
+
+        self._pool_stats = {
+            "read": {"acquisitions": 0, "wait_total": 0.0, "wait_max": 0.0},
+            "write": {"acquisitions": 0, "wait_total": 0.0, "wait_max": 0.0},
+        }
+
+    # Connection pool
+    async def _connect(self) -> aiosqlite.Connection:
+        """Open a connection and apply per-connection pragmas"""
+        conn = await aiosqlite.connect(self.db_path)
+        conn.row_factory = aiosqlite.Row
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        await conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    async def open(self):
+        """Open the writer and reader connections (idempotent)"""
+        if self._writer is not None:
+            return
+
+        # Writer first so WAL mode is set before readers attach
+        self._writer = await self._connect()
+        self._readers = asyncio.Queue()
+        for _ in range(self.read_pool_size):
+            conn = await self._connect()
+            self._reader_connections.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        """Flush queued writes and close all pooled connections"""
+        if self._writer is None:
+            return
+
+        await self._write_behind.close()
+        async with self._write_lock:
+            for conn in self._reader_connections:
+                await conn.close()
+            self._reader_connections = []
+            self._readers = None
+            await self._writer.close()
+            self._writer = None
+
+    def _record_wait(self, kind: str, started: float):
+        waited = time.perf_counter() - started
+        stats = self._pool_stats[kind]
+        stats["acquisitions"] += 1
+        stats["wait_total"] += waited
+        if waited > stats["wait_max"]:
+            stats["wait_max"] = waited
+
+    @asynccontextmanager
+    async def _read(self):
+        """Borrow a reader connection from the pool"""
+        if self._readers is None:
+            await self.open()
+        started = time.perf_counter()
+        conn = await self._readers.get()
+        self._record_wait("read", started)
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def _write(self, catalog: bool = False):
+        """Hold the writer connection for one transaction
+
+        With catalog=True the shared catalog version is bumped in the same
+        transaction, and the snapshot is rebuilt from the writer connection
+        after commit, before the lock is released.
+        """
+        if self._writer is None:
+            await self.open()
+        started = time.perf_counter()
+        async with self._write_lock:
+            self._record_wait("write", started)
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                if catalog:
+                    await self._writer.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+                await self._writer.commit()
+            if catalog:
+                await self._refresh_catalog()
+
+    # Catalog cache
+    async def _refresh_catalog(self):
+        """Rebuild the catalog snapshot (caller holds the write lock)"""
+        try:
+            self._catalog = await load_catalog(self._writer)
+            self._catalog_checked_at = time.monotonic()
+            self._catalog_stats["reloads"] += 1
+        except Exception as e:
+            # The write itself is committed; readers reload on their next access
+            self._catalog = None
+            logger.error(f"Failed to rebuild catalog cache: {e}")
+
+    def _catalog_fresh(self) -> bool:
+        return time.monotonic() - self._catalog_checked_at < self.catalog_check_seconds
+
+    async def _get_catalog(self) -> Catalog:
+        catalog = self._catalog
+        if catalog is not None and self._catalog_fresh():
+            self._catalog_stats["hits"] += 1
+            return catalog
+
+        async with self._catalog_lock:
+            catalog = self._catalog
+            if catalog is not None and self._catalog_fresh():
+                self._catalog_stats["hits"] += 1
+                return catalog
+            async with self._read() as db:
+                # Other workers' writes only show up in the shared version row
+                self._catalog_stats["checks"] += 1
+                if catalog is not None and catalog.version == await get_catalog_version(db):
+                    self._catalog_checked_at = time.monotonic()
+                    self._catalog_stats["hits"] += 1
+                    return catalog
+                self._catalog_stats["misses"] += 1
+                catalog = await load_catalog(db)
+            # A write that committed meanwhile has already installed a newer snapshot
+            if self._catalog is None or self._catalog.version < catalog.version:
+                self._catalog = catalog
+                self._catalog_checked_at = time.monotonic()
+                self._catalog_stats["reloads"] += 1
+            return self._catalog
+
+    async def get_catalog_version(self) -> int:
+        """Version of the catalog snapshot reads are served from, shared by all workers"""
+        catalog = await self._get_catalog()
+        return catalog.version
+
+    def catalog_stats(self) -> Dict[str, Any]:
+        """Catalog cache counters"""
+        version = self._catalog.version if self._catalog is not None else 0
+        return {"version": version, **self._catalog_stats}
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool wait statistics in milliseconds"""
+        result = {"read_pool_size": self.read_pool_size}
+        for kind, stats in self._pool_stats.items():
+            count = stats["acquisitions"]
+            result[kind] = {
+                "acquisitions": count,
+                "wait_avg_ms": round(stats["wait_total"] / count * 1000, 3) if count else 0.0,
+                "wait_max_ms": round(stats["wait_max"] * 1000, 3),
+            }
+        if self._readers is not None:
+            result["read"]["idle"] = self._readers.qsize()
+        return result
 
     async def init_db(self):
-        """Initialize database with required tables"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Users table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    chat_id INTEGER PRIMARY KEY,
-                    phone_number TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    username TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Categories table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS categories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Questions table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS questions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    category_id INTEGER NOT NULL,
-                    question_text TEXT NOT NULL,
-                    order_num INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (category_id) REFERENCES categories (id) ON DELETE CASCADE
-                )
-            """)
-
-            # Answers table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS answers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    question_id INTEGER NOT NULL,
-                    answer_text TEXT NOT NULL,
-                    value INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (question_id) REFERENCES questions (id) ON DELETE CASCADE
-                )
-            """)
-
-            # User responses table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_responses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_chat_id INTEGER NOT NULL,
-                    category_id INTEGER NOT NULL,
-                    question_id INTEGER NOT NULL,
-                    answer_id INTEGER NOT NULL,
-                    value INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_chat_id) REFERENCES users (chat_id),
-                    FOREIGN KEY (category_id) REFERENCES categories (id),
-                    FOREIGN KEY (question_id) REFERENCES questions (id),
-                    FOREIGN KEY (answer_id) REFERENCES answers (id)
-                )
-            """)
-
-            # Test sessions table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS test_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_chat_id INTEGER NOT NULL,
-                    category_id INTEGER NOT NULL,
-                    total_score INTEGER DEFAULT 0,
-                    completed BOOLEAN DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    completed_at TIMESTAMP,
-                    FOREIGN KEY (user_chat_id) REFERENCES users (chat_id),
-                    FOREIGN KEY (category_id) REFERENCES categories (id)
-                )
-            """)
-
-            # Category responses table (score-based responses)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS category_responses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    category_id INTEGER NOT NULL,
-                    min_score INTEGER NOT NULL,
-                    max_score INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    response_text TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (category_id) REFERENCES categories (id) ON DELETE CASCADE
-                )
-            """)
-
-            await db.commit()
+        """Open the pool, apply pending schema migrations and warm caches"""
+        await self.open()
+        try:
+            async with self._write_lock:
+                previous_version = await get_schema_version(self._writer)
+                version = await migrate(self._writer)
+                await check_query_plans(self._writer)
+                logger.info(f"Database schema at version {version}")
+        except BaseException:
+            # Open connection threads would keep a failed startup from exiting
+            await self.close()
+            raise
+
+        if previous_version < SCORE_ROLLUPS_VERSION:
+            # Backfill rollups from sessions completed before they existed
+            counted = await self.rebuild_score_rollups()
+            logger.info(f"Score rollups backfilled from {counted} sessions")
+
+        # Warm the catalog cache so client reads never hit disk
+        async with self._write_lock:
+            await self._refresh_catalog()
+
+        self._write_behind.start()
 
     # User operations
-    async def add_user(self, chat_id: int, phone_number: str, first_name: str = None, 
+    async def add_user(self, chat_id: int, phone_number: str, first_name: str = None,
                       last_name: str = None, username: str = None):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
+            # Registering again also makes a user who had blocked the bot a broadcast recipient
             await db.execute("""
-                INSERT OR REPLACE INTO users (chat_id, phone_number, first_name, last_name, username)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT OR REPLACE INTO users (chat_id, phone_number, first_name, last_name, username, blocked_at)
+                VALUES (?, ?, ?, ?, ?, NULL)
             """, (chat_id, phone_number, first_name, last_name, username))
-            await db.commit()
+
+    async def clear_user_blocked(self, chat_id: int):
+        """The user wrote to the bot again, so they no longer block it"""
+        async with self._write() as db:
+            await db.execute(
+                "UPDATE users SET blocked_at = NULL WHERE chat_id = ? AND blocked_at IS NOT NULL", (chat_id,)
+            )
 
     async def get_user(self, chat_id: int) -> Optional[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._read() as db:
             async with db.execute("SELECT * FROM users WHERE chat_id = ?", (chat_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
     # Category operations
     async def create_category(self, name: str, description: str = None) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write(catalog=True) as db:
             cursor = await db.execute("""
                 INSERT INTO categories (name, description) VALUES (?, ?)
             """, (name, description))
-            await db.commit()
             return cursor.lastrowid
 
     async def get_all_categories(self) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM categories ORDER BY created_at") as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        catalog = await self._get_catalog()
+        return [dict(category) for category in catalog.categories]
 
     async def get_category(self, category_id: int) -> Optional[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM categories WHERE id = ?", (category_id,)) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+        catalog = await self._get_catalog()
+        category = catalog.get_category(category_id)
+        return dict(category) if category else None
 
     async def delete_category(self, category_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("DELETE FROM categories WHERE id = ?", (category_id,))
-            await db.commit()
+        """Hide a category with its questions; sessions and responses keep referencing it"""
+        async with self._write(catalog=True) as db:
+            await db.execute("""
+                UPDATE categories SET deleted_at = ? WHERE id = ? AND deleted_at IS NULL
+            """, (time.time(), category_id))
 
     # Question operations
     async def create_question(self, category_id: int, question_text: str, order_num: int = 0) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write(catalog=True) as db:
             cursor = await db.execute("""
                 INSERT INTO questions (category_id, question_text, order_num) VALUES (?, ?, ?)
             """, (category_id, question_text, order_num))
-            await db.commit()
             return cursor.lastrowid
 
     async def get_questions_by_category(self, category_id: int) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM questions WHERE category_id = ? ORDER BY order_num, id
-            """, (category_id,)) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        catalog = await self._get_catalog()
+        return [dict(question) for question in catalog.get_questions(category_id)]
 
     async def get_question(self, question_id: int) -> Optional[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM questions WHERE id = ?", (question_id,)) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+        catalog = await self._get_catalog()
+        question = catalog.get_question(question_id)
+        return dict(question) if question else None
+
+    async def get_test_snapshot(self, category_id: int) -> List[List]:
+        """Compact snapshot of a test for FSM state
+
+        Returns [[question_id, question_text, [[answer_id, answer_text, value], ...]], ...]
+        in question order, keeping only questions that have answers.
+        """
+        catalog = await self._get_catalog()
+        snapshot = []
+        for question in catalog.get_questions(category_id):
+            answers = catalog.get_answers(question['id'])
+            if answers:
+                snapshot.append([
+                    question['id'],
+                    question['question_text'],
+                    [[answer['id'], answer['answer_text'], answer['value']] for answer in answers]
+                ])
+        return snapshot
 
     async def delete_question(self, question_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("DELETE FROM questions WHERE id = ?", (question_id,))
-            await db.commit()
+        """Hide a question with its answers; recorded responses are kept"""
+        async with self._write(catalog=True) as db:
+            await db.execute("""
+                UPDATE questions SET deleted_at = ? WHERE id = ? AND deleted_at IS NULL
+            """, (time.time(), question_id))
 
     # Answer operations
     async def create_answer(self, question_id: int, answer_text: str, value: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write(catalog=True) as db:
             cursor = await db.execute("""
                 INSERT INTO answers (question_id, answer_text, value) VALUES (?, ?, ?)
             """, (question_id, answer_text, value))
-            await db.commit()
             return cursor.lastrowid
 
     async def get_answers_by_question(self, question_id: int) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM answers WHERE question_id = ? ORDER BY value
-            """, (question_id,)) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        catalog = await self._get_catalog()
+        return [dict(answer) for answer in catalog.get_answers(question_id)]
 
     async def delete_answer(self, answer_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("DELETE FROM answers WHERE id = ?", (answer_id,))
-            await db.commit()
+        """Hide an answer; recorded responses are kept"""
+        async with self._write(catalog=True) as db:
+            await db.execute("""
+                UPDATE answers SET deleted_at = ? WHERE id = ? AND deleted_at IS NULL
+            """, (time.time(), answer_id))
 
     # Test session operations
     async def create_test_session(self, user_chat_id: int, category_id: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             cursor = await db.execute("""
                 INSERT INTO test_sessions (user_chat_id, category_id) VALUES (?, ?)
             """, (user_chat_id, category_id))
-            await db.commit()
             return cursor.lastrowid
 
-    async def save_user_response(self, user_chat_id: int, category_id: int, 
-                                 question_id: int, answer_id: int, value: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO user_responses (user_chat_id, category_id, question_id, answer_id, value)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_chat_id, category_id, question_id, answer_id, value))
-            await db.commit()
-
-    async def complete_test_session(self, session_id: int, total_score: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                UPDATE test_sessions 
+    async def save_user_response(self, user_chat_id: int, category_id: int,
+                                 question_id: int, answer_id: int, value: int,
+                                 session_id: Optional[int] = None):
+        """Queue a response; it is inserted with the next batch"""
+        await self._write_behind.put((user_chat_id, category_id, question_id, answer_id, value, session_id))
+
+    async def _write_queued(self, rows: List[tuple], fsm_records: Dict[str, tuple]):
+        """Insert a batch of responses and the queued FSM records in one transaction"""
+        query = """
+            INSERT INTO user_responses (user_chat_id, category_id, question_id, answer_id, value, session_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+        try:
+            async with self._write() as db:
+                await db.executemany(query, rows)
+                await self._write_fsm_records(db, fsm_records)
+        except sqlite3.IntegrityError:
+            # One stale row (e.g. an answer deleted mid-test) must not sink the batch
+            async with self._write() as db:
+                for row in rows:
+                    try:
+                        await db.execute(query, row)
+                    except sqlite3.IntegrityError as e:
+                        logger.warning(f"Dropping user response {row}: {e}")
+                await self._write_fsm_records(db, fsm_records)
+
+    async def flush_user_responses(self):
+        """Write all queued responses (and queued FSM records) now"""
+        await self._write_behind.flush()
+
+    def response_writer_stats(self) -> Dict[str, Any]:
+        return self._write_behind.stats()
+
+    async def complete_test_session(self, session_id: int, total_score: int,
+                                    export_row: Optional[List[Any]] = None) -> bool:
+        """Mark a session completed, optionally enqueueing its export row
+
+        The outbox row and the score rollups are written in the same
+        transaction, so a completed session is never left without its
+        pending export or counted twice. Returns False if the session was
+        already completed (or no longer exists).
+        """
+        # All answers of the session must be stored before it is marked complete
+        await self.flush_user_responses()
+        async with self._write() as db:
+            cursor = await db.execute("""
+                UPDATE test_sessions
                 SET total_score = ?, completed = 1, completed_at = CURRENT_TIMESTAMP
-                WHERE id = ?
+                WHERE id = ? AND completed = 0
             """, (total_score, session_id))
-            await db.commit()
+            if cursor.rowcount != 1:
+                return False
+
+            await self._add_to_score_rollups(db, session_id)
+            if export_row is not None:
+                now = time.time()
+                await db.execute("""
+                    INSERT INTO export_outbox (session_id, payload, next_attempt_at, created_at)
+                    VALUES (?, ?, ?, ?)
+                """, (session_id, json.dumps(export_row, ensure_ascii=False), now, now))
+            return True
 
     async def get_user_test_history(self, user_chat_id: int) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._read() as db:
             async with db.execute("""
-                SELECT ts.*, c.name as category_name 
+                SELECT ts.*, c.name as category_name
                 FROM test_sessions ts
                 JOIN categories c ON ts.category_id = c.id
                 WHERE ts.user_chat_id = ? AND ts.completed = 1
@@ -245,44 +421,459 @@ class Database:
                 return [dict(row) for row in rows]
 
     # Category response operations
-    async def create_category_response(self, category_id: int, min_score: int, max_score: int, 
+    async def create_category_response(self, category_id: int, min_score: int, max_score: int,
                                        title: str, response_text: str) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write(catalog=True) as db:
             cursor = await db.execute("""
                 INSERT INTO category_responses (category_id, min_score, max_score, title, response_text)
                 VALUES (?, ?, ?, ?, ?)
             """, (category_id, min_score, max_score, title, response_text))
-            await db.commit()
             return cursor.lastrowid
 
     async def get_category_responses(self, category_id: int) -> List[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        catalog = await self._get_catalog()
+        return [dict(response) for response in catalog.get_responses(category_id)]
+
+    async def get_response_for_score(self, category_id: int, score: int) -> Optional[Dict]:
+        catalog = await self._get_catalog()
+        response = catalog.get_bands(category_id).lookup(score)
+        return dict(response) if response else None
+
+    async def check_score_range(self, category_id: int, min_score: int, max_score: int) -> Dict:
+        """Report overlaps with existing bands and uncovered score gaps"""
+        catalog = await self._get_catalog()
+        return catalog.get_bands(category_id).check(min_score, max_score)
+
+    async def delete_category_response(self, response_id: int):
+        async with self._write(catalog=True) as db:
+            await db.execute("DELETE FROM category_responses WHERE id = ?", (response_id,))
+
+
+    # Analytics operations
+    async def count_user_responses(self, category_id: int) -> int:
+        async with self._read() as db:
+            async with db.execute(
+                "SELECT COUNT(*) FROM user_responses WHERE category_id = ?", (category_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row[0]
+
+    async def iter_user_responses(self, category_id: int, chunk_size: int = 50000):
+        """Yield a category's responses in id order, chunk_size plain tuples at a time
+
+        Tuples are (id, respondent, question_id, answer_id, value). The
+        respondent is the session id, or the negated chat id for rows
+        saved before responses were linked to sessions.
+        """
+        last_id = 0
+        while True:
+            async with self._read() as db:
+                async with db.execute("""
+                    SELECT id, COALESCE(session_id, -user_chat_id), question_id, answer_id, value
+                    FROM user_responses
+                    WHERE category_id = ? AND id > ?
+                    ORDER BY id
+                    LIMIT ?
+                """, (category_id, last_id, chunk_size)) as cursor:
+                    cursor.row_factory = None
+                    rows = await cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+
+    # Result export
+    async def iter_completed_sessions(self, since: Optional[str] = None, chunk_size: int = 5000):
+        """Yield completed sessions in (completed_at, id) order, chunk_size tuples at a time
+
+        Tuples are (session_id, completed_at, chat_id, first_name, last_name,
+        username, phone_number, category_id, category_name, total_score).
+        since is a 'YYYY-MM-DD HH:MM:SS' lower bound on completed_at.
+        """
+        last_key = (since or "", 0)
+        while True:
+            async with self._read() as db:
+                async with db.execute("""
+                    SELECT ts.id, ts.completed_at, ts.user_chat_id, u.first_name, u.last_name,
+                           u.username, u.phone_number, ts.category_id, c.name, ts.total_score
+                    FROM test_sessions ts
+                    LEFT JOIN users u ON u.chat_id = ts.user_chat_id
+                    LEFT JOIN categories c ON c.id = ts.category_id
+                    WHERE ts.completed = 1 AND (ts.completed_at, ts.id) > (?, ?)
+                    ORDER BY ts.completed_at, ts.id
+                    LIMIT ?
+                """, (*last_key, chunk_size)) as cursor:
+                    cursor.row_factory = None
+                    rows = await cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            last_key = (rows[-1][1], rows[-1][0])
+
+    async def get_session_responses(self, session_ids: List[int]) -> List[tuple]:
+        """Answers of the given sessions as (session_id, question_id, question_text,
+        answer_id, answer_text, value) tuples, ordered by session"""
+        async with self._read() as db:
+            async with db.execute("""
+                SELECT ur.session_id, ur.question_id, q.question_text, ur.answer_id, a.answer_text, ur.value
+                FROM user_responses ur
+                LEFT JOIN questions q ON q.id = ur.question_id
+                LEFT JOIN answers a ON a.id = ur.answer_id
+                WHERE ur.session_id IN (SELECT value FROM json_each(?))
+                ORDER BY ur.session_id, ur.id
+            """, (json.dumps(session_ids),)) as cursor:
+                cursor.row_factory = None
+                return await cursor.fetchall()
+
+    # Statistics
+    async def get_stats_summary(self) -> List[Dict]:
+        """Per-category catalog and session aggregates in a single query"""
+        async with self._read() as db:
             async with db.execute("""
-                SELECT * FROM category_responses 
-                WHERE category_id = ? 
-                ORDER BY min_score
-            """, (category_id,)) as cursor:
+                SELECT
+                    c.id,
+                    c.name,
+                    (SELECT COUNT(*) FROM questions q
+                     WHERE q.category_id = c.id AND q.deleted_at IS NULL) AS questions_count,
+                    (SELECT COUNT(*) FROM answers a JOIN questions q ON a.question_id = q.id
+                     WHERE q.category_id = c.id AND q.deleted_at IS NULL
+                       AND a.deleted_at IS NULL) AS answers_count,
+                    (SELECT COUNT(*) FROM category_responses r WHERE r.category_id = c.id) AS bands_count,
+                    COALESCE(s.completed, 0) AS completed_sessions,
+                    COALESCE(s.abandoned, 0) AS abandoned_sessions,
+                    s.average_score,
+                    COALESCE(s.completed_24h, 0) AS completed_last_24h
+                FROM categories c
+                LEFT JOIN (
+                    SELECT
+                        category_id,
+                        SUM(completed = 1) AS completed,
+                        SUM(completed = 0) AS abandoned,
+                        AVG(CASE WHEN completed = 1 THEN total_score END) AS average_score,
+                        SUM(completed = 1 AND completed_at >= datetime('now', '-1 day')) AS completed_24h
+                    FROM test_sessions
+                    GROUP BY category_id
+                ) s ON s.category_id = c.id
+                WHERE c.deleted_at IS NULL
+                ORDER BY c.created_at, c.id
+            """) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
-    async def get_response_for_score(self, category_id: int, score: int) -> Optional[Dict]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+    # Score rollup operations
+    async def _add_to_score_rollups(self, db: aiosqlite.Connection, session_id: int):
+        """Add one completed session to the hourly rollups (inside the caller's transaction)"""
+        width = self.score_bucket_width
+        await db.execute("""
+            INSERT INTO score_rollup_hourly (category_id, hour, completions, score_sum, score_sq_sum)
+            SELECT category_id, strftime('%Y-%m-%d %H:00:00', completed_at), 1,
+                   total_score, total_score * total_score
+            FROM test_sessions WHERE id = ?
+            ON CONFLICT (category_id, hour) DO UPDATE SET
+                completions = completions + excluded.completions,
+                score_sum = score_sum + excluded.score_sum,
+                score_sq_sum = score_sq_sum + excluded.score_sq_sum
+        """, (session_id,))
+        await db.execute("""
+            INSERT INTO score_rollup_histogram (category_id, hour, bucket, completions)
+            SELECT category_id, strftime('%Y-%m-%d %H:00:00', completed_at),
+                   total_score - ((total_score % ?) + ?) % ?, 1
+            FROM test_sessions WHERE id = ?
+            ON CONFLICT (category_id, hour, bucket) DO UPDATE SET
+                completions = completions + excluded.completions
+        """, (width, width, width, session_id))
+
+    async def rebuild_score_rollups(self) -> int:
+        """Recompute all rollups from test_sessions; returns sessions counted"""
+        width = self.score_bucket_width
+        async with self._write() as db:
+            await db.execute("DELETE FROM score_rollup_hourly")
+            await db.execute("DELETE FROM score_rollup_histogram")
+            await db.execute("""
+                INSERT INTO score_rollup_hourly (category_id, hour, completions, score_sum, score_sq_sum)
+                SELECT category_id, strftime('%Y-%m-%d %H:00:00', completed_at), COUNT(*),
+                       SUM(total_score), SUM(total_score * total_score)
+                FROM test_sessions
+                WHERE completed = 1 AND completed_at IS NOT NULL
+                GROUP BY 1, 2
+            """)
+            await db.execute("""
+                INSERT INTO score_rollup_histogram (category_id, hour, bucket, completions)
+                SELECT category_id, strftime('%Y-%m-%d %H:00:00', completed_at),
+                       total_score - ((total_score % ?) + ?) % ?, COUNT(*)
+                FROM test_sessions
+                WHERE completed = 1 AND completed_at IS NOT NULL
+                GROUP BY 1, 2, 3
+            """, (width, width, width))
+            async with db.execute("SELECT COALESCE(SUM(completions), 0) FROM score_rollup_hourly") as cursor:
+                row = await cursor.fetchone()
+                return row[0]
+
+    async def get_score_rollups(self, category_id: int, since_hour: str) -> Dict[str, List[Dict]]:
+        """Hourly rows and histogram rows for a category from since_hour on"""
+        async with self._read() as db:
+            async with db.execute("""
+                SELECT hour, completions, score_sum, score_sq_sum
+                FROM score_rollup_hourly
+                WHERE category_id = ? AND hour >= ?
+                ORDER BY hour
+            """, (category_id, since_hour)) as cursor:
+                hourly = [dict(row) for row in await cursor.fetchall()]
+            async with db.execute("""
+                SELECT bucket, SUM(completions) AS completions
+                FROM score_rollup_histogram
+                WHERE category_id = ? AND hour >= ?
+                GROUP BY bucket
+                ORDER BY bucket
+            """, (category_id, since_hour)) as cursor:
+                histogram = [dict(row) for row in await cursor.fetchall()]
+        return {"hourly": hourly, "histogram": histogram}
+
+    # Export outbox operations
+    async def claim_due_exports(self, limit: int, lease_seconds: float) -> List[Dict]:
+        """Claim up to limit due rows for lease_seconds; rows claimed by another worker are skipped"""
+        now = time.time()
+        async with self._write() as db:
+            async with db.execute("""
+                UPDATE export_outbox SET claimed_until = ?
+                WHERE id IN (
+                    SELECT id FROM export_outbox
+                    WHERE delivered_at IS NULL AND next_attempt_at <= ?
+                      AND (claimed_until IS NULL OR claimed_until < ?)
+                    ORDER BY next_attempt_at, id
+                    LIMIT ?
+                )
+                RETURNING id, session_id, payload, attempts, next_attempt_at
+            """, (now + lease_seconds, now, now, limit)) as cursor:
+                rows = await cursor.fetchall()
+        result = []
+        for row in sorted(rows, key=lambda r: (r['next_attempt_at'], r['id'])):
+            item = dict(row)
+            del item['next_attempt_at']
+            item['payload'] = json.loads(item['payload'])
+            result.append(item)
+        return result
+
+    async def mark_exports_delivered(self, export_ids: List[int]):
+        async with self._write() as db:
+            await db.executemany("""
+                UPDATE export_outbox SET delivered_at = ?, last_error = NULL, claimed_until = NULL
+                WHERE id = ?
+            """, [(time.time(), export_id) for export_id in export_ids])
+
+    async def mark_exports_failed(self, export_ids: List[int], error: str, retry_in: Dict[int, float]):
+        """Record a failed attempt; retry_in maps export id to seconds until the next try"""
+        now = time.time()
+        async with self._write() as db:
+            await db.executemany("""
+                UPDATE export_outbox
+                SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?, claimed_until = NULL
+                WHERE id = ?
+            """, [(error, now + retry_in[export_id], export_id) for export_id in export_ids])
+
+    async def purge_delivered_exports(self, older_than_seconds: float) -> int:
+        async with self._write() as db:
+            cursor = await db.execute("""
+                DELETE FROM export_outbox
+                WHERE delivered_at IS NOT NULL AND delivered_at < ?
+            """, (time.time() - older_than_seconds,))
+            return cursor.rowcount
+
+    async def get_outbox_stats(self) -> Dict[str, Any]:
+        async with self._read() as db:
             async with db.execute("""
-                SELECT * FROM category_responses 
-                WHERE category_id = ? AND ? BETWEEN min_score AND max_score
-                LIMIT 1
-            """, (category_id, score)) as cursor:
+                SELECT
+                    COUNT(*) AS pending,
+                    SUM(CASE WHEN attempts > 0 THEN 1 ELSE 0 END) AS retrying,
+                    MIN(created_at) AS oldest_created_at,
+                    MAX(attempts) AS max_attempts
+                FROM export_outbox
+                WHERE delivered_at IS NULL
+            """) as cursor:
+                row = dict(await cursor.fetchone())
+        oldest = row.pop('oldest_created_at')
+        row['retrying'] = row['retrying'] or 0
+        row['max_attempts'] = row['max_attempts'] or 0
+        row['oldest_pending_age_seconds'] = round(time.time() - oldest, 1) if oldest else 0.0
+        return row
+
+
+    # Broadcast operations
+    async def create_broadcast(self, text: str, admin_chat_id: int) -> int:
+        """Create a running broadcast addressed to every user not known to be blocked"""
+        async with self._write() as db:
+            async with db.execute("SELECT COUNT(*) FROM users WHERE blocked_at IS NULL") as cursor:
+                total = (await cursor.fetchone())[0]
+            cursor = await db.execute("""
+                INSERT INTO broadcasts (text, admin_chat_id, total, created_at)
+                VALUES (?, ?, ?, ?)
+            """, (text, admin_chat_id, total, time.time()))
+            return cursor.lastrowid
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict]:
+        async with self._read() as db:
+            async with db.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
-    async def delete_category_response(self, response_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("DELETE FROM category_responses WHERE id = ?", (response_id,))
-            await db.commit()
+    async def get_running_broadcasts(self) -> List[Dict]:
+        async with self._read() as db:
+            async with db.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id") as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def claim_broadcast(self, broadcast_id: int, owner: str, lease_seconds: float) -> bool:
+        """Claim or renew a running broadcast for owner; False if it has ended or another worker holds it"""
+        now = time.time()
+        async with self._write() as db:
+            cursor = await db.execute("""
+                UPDATE broadcasts SET claimed_by = ?, claimed_until = ?
+                WHERE id = ? AND status = 'running'
+                  AND (claimed_by IS NULL OR claimed_by = ? OR claimed_until < ?)
+            """, (owner, now + lease_seconds, broadcast_id, owner, now))
+            return cursor.rowcount == 1
+
+    async def release_broadcast(self, broadcast_id: int, owner: str):
+        """Let another worker resume the broadcast right away"""
+        async with self._write() as db:
+            await db.execute("""
+                UPDATE broadcasts SET claimed_by = NULL, claimed_until = NULL
+                WHERE id = ? AND claimed_by = ?
+            """, (broadcast_id, owner))
+
+    async def set_broadcast_status_message(self, broadcast_id: int, message_id: int):
+        async with self._write() as db:
+            await db.execute(
+                "UPDATE broadcasts SET status_message_id = ? WHERE id = ?", (message_id, broadcast_id)
+            )
+
+    async def get_broadcast_recipients(self, after_chat_id: int, limit: int) -> List[int]:
+        """Next page of recipient chat ids in chat_id order (keyset pagination)"""
+        async with self._read() as db:
+            async with db.execute("""
+                SELECT chat_id FROM users
+                WHERE chat_id > ? AND blocked_at IS NULL
+                ORDER BY chat_id
+                LIMIT ?
+            """, (after_chat_id, limit)) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def save_broadcast_progress(self, broadcast_id: int, last_chat_id: int, sent: int,
+                                      failed: int, blocked_chat_ids: List[int]):
+        """Checkpoint a finished page and mark its blocked recipients in one transaction"""
+        now = time.time()
+        async with self._write() as db:
+            await db.executemany(
+                "UPDATE users SET blocked_at = ? WHERE chat_id = ?",
+                [(now, chat_id) for chat_id in blocked_chat_ids]
+            )
+            await db.execute("""
+                UPDATE broadcasts
+                SET last_chat_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+                WHERE id = ?
+            """, (last_chat_id, sent, failed, len(blocked_chat_ids), broadcast_id))
+
+    async def finish_broadcast(self, broadcast_id: int, status: str):
+        """Set the final status ('done' or 'cancelled')"""
+        async with self._write() as db:
+            await db.execute(
+                "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+                (status, time.time(), broadcast_id)
+            )
+
+    # Media cache operations
+    async def get_media_file_id(self, content_hash: str) -> Optional[str]:
+        async with self._read() as db:
+            async with db.execute(
+                "SELECT file_id FROM media_cache WHERE content_hash = ?", (content_hash,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return row['file_id'] if row else None
+
+    async def save_media_file_id(self, content_hash: str, file_id: str):
+        async with self._write() as db:
+            await db.execute("""
+                INSERT OR REPLACE INTO media_cache (content_hash, file_id, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            """, (content_hash, file_id))
+
+    async def delete_media_file_id(self, content_hash: str):
+        async with self._write() as db:
+            await db.execute("DELETE FROM media_cache WHERE content_hash = ?", (content_hash,))
+
+
+    # FSM storage operations
+    async def get_fsm_record(self, key: str, not_before: float) -> Optional[Dict]:
+        """State and serialized data for key, unless idle since before not_before"""
+        queued = self._write_behind.pending(key)
+        if queued is not None:
+            state, data, updated_at = queued
+            if (state is None and data is None) or updated_at < not_before:
+                return None
+            return {"state": state, "data": data, "updated_at": updated_at}
+
+        async with self._read() as db:
+            async with db.execute("""
+                SELECT state, data, updated_at FROM fsm_storage
+                WHERE key = ? AND updated_at >= ?
+            """, (key, not_before)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
 
+    async def save_fsm_record(self, key: str, state: Optional[str], data: Optional[str], updated_at: float):
+        """Replace state and data together, so nothing of an expired record survives"""
+        async with self._write() as db:
+            await db.execute("""
+                INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            """, (key, state, data, updated_at))
+
+    async def queue_fsm_record(self, key: str, state: Optional[str], data: Optional[str], updated_at: float):
+        """Queue a record for the next response batch; the last one per key wins
+
+        A record with neither state nor data deletes the key. get_fsm_record
+        sees queued records at once; other processes only after the flush.
+        """
+        await self._write_behind.put_keyed(key, (state, data, updated_at))
+
+    @staticmethod
+    async def _write_fsm_records(db: aiosqlite.Connection, records: Dict[str, tuple]):
+        saved = [
+            (key, state, data, updated_at) for key, (state, data, updated_at) in records.items()
+            if state is not None or data is not None
+        ]
+        deleted = [
+            (key,) for key, (state, data, _) in records.items() if state is None and data is None
+        ]
+        if saved:
+            await db.executemany("""
+                INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            """, saved)
+        if deleted:
+            await db.executemany("DELETE FROM fsm_storage WHERE key = ?", deleted)
+
+    async def delete_fsm_record(self, key: str):
+        async with self._write() as db:
+            await db.execute("DELETE FROM fsm_storage WHERE key = ?", (key,))
+
+    async def purge_fsm_records(self, idle_before: float) -> int:
+        async with self._write() as db:
+            cursor = await db.execute(
+                "DELETE FROM fsm_storage WHERE updated_at < ?", (idle_before,)
+            )
+            return cursor.rowcount
 
-# Global database instance
-db = Database(settings.DATABASE_PATH)
 
+# Global database instance
+db = Database(
+    settings.DATABASE_PATH,
+    read_pool_size=settings.DB_READ_POOL_SIZE,
+    busy_timeout_ms=settings.DB_BUSY_TIMEOUT_MS,
+    response_flush_rows=settings.RESPONSE_FLUSH_ROWS,
+    response_flush_interval_ms=settings.RESPONSE_FLUSH_INTERVAL_MS,
+    response_queue_size=settings.RESPONSE_QUEUE_SIZE,
+    score_bucket_width=settings.SCORE_BUCKET_WIDTH,
+    catalog_check_seconds=settings.CATALOG_CHECK_SECONDS
+)
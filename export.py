@@ -0,0 +1,182 @@
+import csv
+import io
+import logging
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional
+
+from config import get_settings
+from database import Database, db
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Arrow and Parquet output are optional
+    pa = None
+    pq = None
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+SESSION_COLUMNS = [
+    "session_id", "completed_at", "chat_id", "first_name", "last_name",
+    "username", "phone_number", "category_id", "category_name", "total_score"
+]
+RESPONSE_COLUMNS = ["question_id", "question_text", "answer_id", "answer_text", "value"]
+
+MEDIA_TYPES = {
+    "csv": "text/csv",  # Starlette appends charset=utf-8
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _arrow_schema(with_responses: bool):
+    fields = [
+        ("session_id", pa.int64()), ("completed_at", pa.string()), ("chat_id", pa.int64()),
+        ("first_name", pa.string()), ("last_name", pa.string()), ("username", pa.string()),
+        ("phone_number", pa.string()), ("category_id", pa.int64()), ("category_name", pa.string()),
+        ("total_score", pa.int64()),
+    ]
+    if with_responses:
+        fields += [
+            ("question_id", pa.int64()), ("question_text", pa.string()), ("answer_id", pa.int64()),
+            ("answer_text", pa.string()), ("value", pa.int64()),
+        ]
+    return pa.schema(fields)
+
+
+def parse_since(value: str) -> str:
+    """ISO date or datetime as the UTC 'YYYY-MM-DD HH:MM:SS' stored in completed_at
+
+    Values with an offset are converted to UTC; values without one are
+    taken as UTC already. Raises ValueError for anything else.
+    """
+    since = datetime.fromisoformat(value)
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class _ByteSink:
+    """Write-only file object whose contents are drained after every chunk"""
+
+    closed = False
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # Bytes written so far, drained or not; writers use it for offsets
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class ResultExporter:
+    """Streams completed sessions as CSV, Arrow IPC or Parquet
+
+    Sessions are read with keyset pagination, so memory use is bounded by
+    chunk_size no matter how many results are stored. With responses=True
+    each session is repeated once per stored answer (long format).
+    """
+
+    def __init__(self, database: Database, chunk_size: int = 5000):
+        self.database = database
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def is_available(fmt: str) -> bool:
+        return fmt == "csv" or (fmt in MEDIA_TYPES and pa is not None)
+
+    def columns(self, with_responses: bool) -> List[str]:
+        return SESSION_COLUMNS + RESPONSE_COLUMNS if with_responses else SESSION_COLUMNS
+
+    async def _chunks(self, since: Optional[str], with_responses: bool) -> AsyncIterator[List[tuple]]:
+        async for sessions in self.database.iter_completed_sessions(since, self.chunk_size):
+            if not with_responses:
+                yield sessions
+                continue
+
+            answers = {}
+            for row in await self.database.get_session_responses([s[0] for s in sessions]):
+                answers.setdefault(row[0], []).append(row[1:])
+            # Sessions without linked answers keep one row with empty answer columns
+            empty = [(None,) * len(RESPONSE_COLUMNS)]
+            yield [
+                session + answer
+                for session in sessions
+                for answer in answers.get(session[0], empty)
+            ]
+
+    async def stream(self, fmt: str, since: Optional[str] = None,
+                     with_responses: bool = False) -> AsyncIterator[bytes]:
+        """Encoded export, one piece per database chunk"""
+        if fmt == "csv":
+            encoded = self._csv(since, with_responses)
+        else:
+            encoded = self._arrow(fmt, since, with_responses)
+
+        pieces = 0
+        try:
+            async for piece in encoded:
+                pieces += 1
+                yield piece
+        finally:
+            logger.info(f"Result export ({fmt}, since={since}) ended after {pieces} chunks")
+
+    async def _csv(self, since: Optional[str], with_responses: bool) -> AsyncIterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM so that spreadsheet apps detect UTF-8 (names are often Cyrillic)
+        buffer.write("\ufeff")
+        writer.writerow(self.columns(with_responses))
+        async for rows in self._chunks(since, with_responses):
+            writer.writerows(rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
+    async def _arrow(self, fmt: str, since: Optional[str], with_responses: bool) -> AsyncIterator[bytes]:
+        schema = _arrow_schema(with_responses)
+        sink = _ByteSink()
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(sink, schema)
+            write = writer.write_table
+            to_batch = pa.Table.from_arrays
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+            write = writer.write_batch
+            to_batch = pa.RecordBatch.from_arrays
+
+        try:
+            async for rows in self._chunks(since, with_responses):
+                columns = list(zip(*rows))
+                write(to_batch(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                    schema=schema
+                ))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+
+# Global exporter instance
+result_exporter = ResultExporter(db, chunk_size=settings.EXPORT_CHUNK_ROWS)
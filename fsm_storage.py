@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import get_settings
+from database import Database, db
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    __slots__ = ("state", "data", "payload", "updated_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], payload: Optional[str], updated_at: float):
+        self.state = state
+        self.data = data
+        # data as stored, so a state change does not serialize it again
+        self.payload = payload
+        self.updated_at = updated_at
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage persisted in the bot's SQLite database
+
+    Records are stored in the fsm_storage table as compact JSON and kept
+    in a bounded LRU for fast reads; the LRU is only updated once the write
+    was accepted. With write_behind, saves are queued and written together
+    with the next answer batch (the last save per key wins), so a tap does
+    not pay a commit of its own; otherwise every save commits at once. A
+    record untouched for ttl seconds counts as empty, and a background
+    sweep deletes expired rows and evicts them from the LRU. When several
+    processes share the database, set lru_size=0 (disables the LRU) and
+    write_behind=False, or another worker may read a state that is not
+    flushed yet.
+    """
+
+    def __init__(self, database: Database, ttl: float = 24 * 3600,
+                 lru_size: int = 10000, sweep_interval: float = 600.0, write_behind: bool = True):
+        self.database = database
+        self.ttl = ttl
+        self.write_behind = write_behind
+        self.lru_size = max(0, lru_size)
+        self.sweep_interval = sweep_interval
+        self._lru: "OrderedDict[str, _Record]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"hits": 0, "misses": 0, "expired": 0}
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def _remember(self, key: str, record: _Record):
+        if not self.lru_size:
+            return
+        self._lru[key] = record
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    async def _load(self, key: str) -> _Record:
+        now = time.time()
+        record = self._lru.get(key)
+        if record is not None:
+            if now - record.updated_at < self.ttl:
+                self._stats["hits"] += 1
+                self._lru.move_to_end(key)
+                return record
+            self._stats["expired"] += 1
+            del self._lru[key]
+
+        self._stats["misses"] += 1
+        row = await self.database.get_fsm_record(key, now - self.ttl)
+        if row:
+            data = json.loads(row['data']) if row['data'] else {}
+            record = _Record(row['state'], data, row['data'], row['updated_at'])
+        else:
+            record = _Record(None, {}, None, now)
+        self._remember(key, record)
+        return record
+
+    async def _save(self, key: str, record: _Record):
+        """Write (or queue) the record, then cache it"""
+        if self.write_behind:
+            await self.database.queue_fsm_record(key, record.state, record.payload, record.updated_at)
+        elif record.state is None and not record.data:
+            await self.database.delete_fsm_record(key)
+        else:
+            await self.database.save_fsm_record(key, record.state, record.payload, record.updated_at)
+        self._remember(key, record)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key(key)
+        current = await self._load(storage_key)
+        await self._save(storage_key, _Record(
+            state.state if isinstance(state, State) else state, current.data, current.payload, time.time()
+        ))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._load(self._key(key))
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self._key(key)
+        current = await self._load(storage_key)
+        data = data.copy()
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":")) if data else None
+        await self._save(storage_key, _Record(current.state, data, payload, time.time()))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._load(self._key(key))
+        return record.data.copy()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"FSM storage sweep failed: {e}")
+
+    async def sweep(self) -> int:
+        """Delete records idle for longer than ttl"""
+        idle_before = time.time() - self.ttl
+        for key in [k for k, record in self._lru.items() if record.updated_at < idle_before]:
+            del self._lru[key]
+        return await self.database.purge_fsm_records(idle_before)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"cached": len(self._lru), **self._stats}
+
+
+# Global FSM storage instance
+storage = SQLiteStorage(
+    db,
+    ttl=settings.FSM_TTL_SECONDS,
+    lru_size=settings.FSM_LRU_SIZE,
+    sweep_interval=settings.FSM_SWEEP_SECONDS,
+    write_behind=settings.FSM_WRITE_BEHIND
+)
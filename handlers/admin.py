@@ -1,9 +1,13 @@
 from aiogram import Router, F
 from aiogram.filters import Command, BaseFilter
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from database import db
+from analytics import item_analyzer
+from routing import CallbackAction, callback_routes
+from callback_codec import encode_callback
+from broadcast import broadcaster, format_status, status_keyboard
 from keyboards import (
     get_admin_main_keyboard,
     get_cancel_keyboard,
@@ -27,6 +31,10 @@ class IsAdminFilter(BaseFilter):
         return False
 
 
+# Checked once per message for the whole router; callback routes check admin=True themselves
+admin_router.message.filter(IsAdminFilter())
+
+
 class CategoryStates(StatesGroup):
     waiting_for_category_name = State()
     waiting_for_category_description = State()
@@ -50,13 +58,18 @@ class ResponseStates(StatesGroup):
     waiting_for_response_text = State()
 
 
+class BroadcastStates(StatesGroup):
+    waiting_for_text = State()
+    waiting_for_confirmation = State()
+
+
 def is_admin(chat_id: int) -> bool:
     """Check if user is admin"""
     return chat_id == settings.ADMIN_CHAT_ID
 
 
 # Admin start command
-@admin_router.message(Command("start"), IsAdminFilter())
+@admin_router.message(Command("start"))
 async def admin_start(message: Message, state: FSMContext):
     await state.clear()
     await message.answer(
@@ -67,7 +80,7 @@ async def admin_start(message: Message, state: FSMContext):
 
 
 # Create category
-@admin_router.message(F.text == "➕ Kategoriya qo'shish", IsAdminFilter())
+@admin_router.message(F.text == "➕ Kategoriya qo'shish")
 async def start_create_category(message: Message, state: FSMContext):
     await state.set_state(CategoryStates.waiting_for_category_name)
     await message.answer(
@@ -76,7 +89,7 @@ async def start_create_category(message: Message, state: FSMContext):
     )
 
 
-@admin_router.message(CategoryStates.waiting_for_category_name, IsAdminFilter())
+@admin_router.message(CategoryStates.waiting_for_category_name)
 async def process_category_name(message: Message, state: FSMContext):
     
     if message.text == "❌ Bekor qilish":
@@ -92,7 +105,7 @@ async def process_category_name(message: Message, state: FSMContext):
     )
 
 
-@admin_router.message(CategoryStates.waiting_for_category_description, IsAdminFilter())
+@admin_router.message(CategoryStates.waiting_for_category_description)
 async def process_category_description(message: Message, state: FSMContext):
     
     if message.text == "❌ Bekor qilish":
@@ -115,7 +128,7 @@ async def process_category_description(message: Message, state: FSMContext):
 
 
 # List categories
-@admin_router.message(F.text == "📋 Kategoriyalar ro'yxati", IsAdminFilter())
+@admin_router.message(F.text == "📋 Kategoriyalar ro'yxati")
 async def list_categories(message: Message):
     
     categories = await db.get_all_categories()
@@ -137,7 +150,7 @@ async def list_categories(message: Message):
 
 
 # Delete category
-@admin_router.message(F.text == "🗑 Kategoriya o'chirish", IsAdminFilter())
+@admin_router.message(F.text == "🗑 Kategoriya o'chirish")
 async def start_delete_category(message: Message, state: FSMContext):
     
     categories = await db.get_all_categories()
@@ -153,10 +166,10 @@ async def start_delete_category(message: Message, state: FSMContext):
     )
 
 
-@admin_router.callback_query(F.data.startswith("delete_category_"), IsAdminFilter())
-async def process_delete_category(callback: CallbackQuery, state: FSMContext):
+@callback_routes.route("delete_category", admin=True, args=1)
+async def process_delete_category(callback: CallbackQuery, state: FSMContext, action: CallbackAction):
     
-    category_id = int(callback.data.split("_")[-1])
+    category_id = action.args[0]
     category = await db.get_category(category_id)
     
     if category:
@@ -173,7 +186,7 @@ async def process_delete_category(callback: CallbackQuery, state: FSMContext):
 
 
 # Add question
-@admin_router.message(F.text == "❓ Savol qo'shish", IsAdminFilter())
+@admin_router.message(F.text == "❓ Savol qo'shish")
 async def start_add_question(message: Message, state: FSMContext):
     
     categories = await db.get_all_categories()
@@ -192,10 +205,10 @@ async def start_add_question(message: Message, state: FSMContext):
     )
 
 
-@admin_router.callback_query(F.data.startswith("add_question_category_"), IsAdminFilter())
-async def process_question_category(callback: CallbackQuery, state: FSMContext):
+@callback_routes.route("add_question_category", admin=True, args=1)
+async def process_question_category(callback: CallbackQuery, state: FSMContext, action: CallbackAction):
     
-    category_id = int(callback.data.split("_")[-1])
+    category_id = action.args[0]
     await state.update_data(question_category_id=category_id)
     await state.set_state(QuestionStates.waiting_for_question_text)
     
@@ -207,7 +220,7 @@ async def process_question_category(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@admin_router.message(QuestionStates.waiting_for_question_text, IsAdminFilter())
+@admin_router.message(QuestionStates.waiting_for_question_text)
 async def process_question_text(message: Message, state: FSMContext):
     
     if message.text == "❌ Bekor qilish":
@@ -233,7 +246,7 @@ async def process_question_text(message: Message, state: FSMContext):
     )
 
 
-@admin_router.message(QuestionStates.waiting_for_answers, IsAdminFilter())
+@admin_router.message(QuestionStates.waiting_for_answers)
 async def process_answers(message: Message, state: FSMContext):
     
     if message.text == "❌ Bekor qilish":
@@ -303,7 +316,7 @@ async def process_answers(message: Message, state: FSMContext):
 
 
 # Delete question
-@admin_router.message(F.text == "🗑 Savol o'chirish", IsAdminFilter())
+@admin_router.message(F.text == "🗑 Savol o'chirish")
 async def start_delete_question(message: Message, state: FSMContext):
     
     categories = await db.get_all_categories()
@@ -319,10 +332,10 @@ async def start_delete_question(message: Message, state: FSMContext):
     )
 
 
-@admin_router.callback_query(F.data.startswith("delete_q_category_"), IsAdminFilter())
-async def show_questions_to_delete(callback: CallbackQuery, state: FSMContext):
+@callback_routes.route("delete_q_category", admin=True, args=1)
+async def show_questions_to_delete(callback: CallbackQuery, state: FSMContext, action: CallbackAction):
     
-    category_id = int(callback.data.split("_")[-1])
+    category_id = action.args[0]
     questions = await db.get_questions_by_category(category_id)
     
     if not questions:
@@ -339,10 +352,10 @@ async def show_questions_to_delete(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@admin_router.callback_query(F.data.startswith("delete_question_"), IsAdminFilter())
-async def process_delete_question(callback: CallbackQuery, state: FSMContext):
+@callback_routes.route("delete_question", admin=True, args=1)
+async def process_delete_question(callback: CallbackQuery, state: FSMContext, action: CallbackAction):
     
-    question_id = int(callback.data.split("_")[-1])
+    question_id = action.args[0]
     question = await db.get_question(question_id)
     
     if question:
@@ -358,7 +371,7 @@ async def process_delete_question(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@admin_router.callback_query(F.data == "cancel_action")
+@callback_routes.route("cancel_action")
 async def cancel_action(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text("❌ Bekor qilindi")
@@ -367,7 +380,7 @@ async def cancel_action(callback: CallbackQuery, state: FSMContext):
 
 
 # Add category response
-@admin_router.message(F.text == "💬 Javob qo'shish", IsAdminFilter())
+@admin_router.message(F.text == "💬 Javob qo'shish")
 async def start_add_response(message: Message, state: FSMContext):
     categories = await db.get_all_categories()
     
@@ -385,9 +398,9 @@ async def start_add_response(message: Message, state: FSMContext):
     )
 
 
-@admin_router.callback_query(F.data.startswith("add_response_category_"), IsAdminFilter())
-async def process_response_category(callback: CallbackQuery, state: FSMContext):
-    category_id = int(callback.data.split("_")[-1])
+@callback_routes.route("add_response_category", admin=True, args=1)
+async def process_response_category(callback: CallbackQuery, state: FSMContext, action: CallbackAction):
+    category_id = action.args[0]
     await state.update_data(response_category_id=category_id)
     await state.set_state(ResponseStates.waiting_for_score_range)
     
@@ -404,7 +417,7 @@ async def process_response_category(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@admin_router.message(ResponseStates.waiting_for_score_range, IsAdminFilter())
+@admin_router.message(ResponseStates.waiting_for_score_range)
 async def process_score_range(message: Message, state: FSMContext):
     if message.text == "❌ Bekor qilish":
         await state.clear()
@@ -424,11 +437,28 @@ async def process_score_range(message: Message, state: FSMContext):
             await message.answer("❌ Minimal ball maksimal balldan katta bo'lishi mumkin emas!")
             return
         
+        data = await state.get_data()
+        report = await db.check_score_range(data['response_category_id'], min_score, max_score)
+        
+        warnings = ""
+        if report['overlaps']:
+            overlapping = ", ".join(
+                f"{band['min_score']}-{band['max_score']}" for band in report['overlaps']
+            )
+            warnings += (
+                f"⚠️ Bu oraliq mavjud oraliqlar bilan kesishadi: {overlapping}\n"
+                "Kesishgan ballar uchun avval qo'shilgan javob ko'rsatiladi.\n\n"
+            )
+        if report['gaps']:
+            uncovered = ", ".join(f"{start}-{end}" for start, end in report['gaps'])
+            warnings += f"⚠️ Javobsiz qoladigan ballar: {uncovered}\n\n"
+        
         await state.update_data(min_score=min_score, max_score=max_score)
         await state.set_state(ResponseStates.waiting_for_response_title)
         
         await message.answer(
             f"✅ Ball oraliği: {min_score}-{max_score}\n\n"
+            f"{warnings}"
             "Endi javob sarlavhasini kiriting:\n\n"
             "Masalan:\n"
             "🟢 Natija: Yaxshi (0–7 ball)\n"
@@ -439,7 +469,7 @@ async def process_score_range(message: Message, state: FSMContext):
         await message.answer("❌ Faqat raqamlar kiriting!")
 
 
-@admin_router.message(ResponseStates.waiting_for_response_title, IsAdminFilter())
+@admin_router.message(ResponseStates.waiting_for_response_title)
 async def process_response_title(message: Message, state: FSMContext):
     if message.text == "❌ Bekor qilish":
         await state.clear()
@@ -458,7 +488,7 @@ async def process_response_title(message: Message, state: FSMContext):
     )
 
 
-@admin_router.message(ResponseStates.waiting_for_response_text, IsAdminFilter())
+@admin_router.message(ResponseStates.waiting_for_response_text)
 async def process_response_text(message: Message, state: FSMContext):
     if message.text == "❌ Bekor qilish":
         await state.clear()
@@ -488,7 +518,7 @@ async def process_response_text(message: Message, state: FSMContext):
 
 
 # List category responses
-@admin_router.message(F.text == "📝 Javoblar ro'yxati", IsAdminFilter())
+@admin_router.message(F.text == "📝 Javoblar ro'yxati")
 async def list_responses(message: Message, state: FSMContext):
     categories = await db.get_all_categories()
     
@@ -502,9 +532,9 @@ async def list_responses(message: Message, state: FSMContext):
     )
 
 
-@admin_router.callback_query(F.data.startswith("list_responses_category_"), IsAdminFilter())
-async def show_category_responses(callback: CallbackQuery, state: FSMContext):
-    category_id = int(callback.data.split("_")[-1])
+@callback_routes.route("list_responses_category", admin=True, args=1)
+async def show_category_responses(callback: CallbackQuery, state: FSMContext, action: CallbackAction):
+    category_id = action.args[0]
     category = await db.get_category(category_id)
     responses = await db.get_category_responses(category_id)
     
@@ -524,3 +554,120 @@ async def show_category_responses(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(text)
     await callback.answer()
 
+
+
+# Item analysis of test answers
+@admin_router.message(Command("analysis"))
+async def start_item_analysis(message: Message):
+    categories = await db.get_all_categories()
+    
+    if not categories:
+        await message.answer("❌ Kategoriyalar yo'q")
+        return
+    
+    await message.answer(
+        "Tahlil uchun kategoriyani tanlang:",
+        reply_markup=get_categories_inline_keyboard(categories, prefix="analysis")
+    )
+
+
+def _format_value(value) -> str:
+    return "—" if value is None else f"{value:.2f}"
+
+
+@callback_routes.route("analysis_category", admin=True, args=1)
+async def show_item_analysis(callback: CallbackQuery, action: CallbackAction):
+    category_id = action.args[0]
+    category = await db.get_category(category_id)
+    if not category:
+        await callback.answer("❌ Kategoriya topilmadi", show_alert=True)
+        return
+    
+    await callback.answer("⏳ Hisoblanmoqda...")
+    analysis = await item_analyzer.analyze(category_id)
+    
+    text = (
+        f"📊 '{category['name']}' tahlili\n\n"
+        f"Javob berganlar: {analysis['respondents']} "
+        f"(to'liq: {analysis['complete_respondents']})\n"
+        f"Cronbach alfa: {_format_value(analysis['cronbach_alpha'])}\n"
+    )
+    for index, question in enumerate(analysis['questions'], 1):
+        block = (
+            f"\n{index}. {question['question_text'][:60]}\n"
+            f"   Javoblar: {question['responses']}, o'rtacha: {_format_value(question['mean'])}\n"
+            f"   Savol–jami korrelyatsiya: {_format_value(question['item_total_correlation'])}, "
+            f"o'chirilsa alfa: {_format_value(question['alpha_if_deleted'])}\n"
+        )
+        for item in question['answer_distribution']:
+            block += f"   • {(item['answer_text'] or '?')[:30]}: {item['count']}\n"
+        # Telegram messages are limited to 4096 characters
+        if len(text) + len(block) > 4000:
+            text += "\n… (to'liq natija: /analytics/items API)"
+            break
+        text += block
+    
+    await callback.message.edit_text(text)
+
+
+# Broadcast to all users
+@admin_router.message(F.text == "📣 Xabar yuborish")
+async def start_broadcast(message: Message, state: FSMContext):
+    await state.set_state(BroadcastStates.waiting_for_text)
+    await message.answer(
+        "Barcha foydalanuvchilarga yuboriladigan xabar matnini kiriting:",
+        reply_markup=get_cancel_keyboard()
+    )
+
+
+@admin_router.message(BroadcastStates.waiting_for_text)
+async def process_broadcast_text(message: Message, state: FSMContext):
+    
+    if message.text == "❌ Bekor qilish":
+        await state.clear()
+        await message.answer("Bekor qilindi", reply_markup=get_admin_main_keyboard())
+        return
+    
+    if not message.text:
+        await message.answer("❌ Faqat matnli xabar yuborish mumkin")
+        return
+    
+    await state.update_data(broadcast_text=message.text)
+    await state.set_state(BroadcastStates.waiting_for_confirmation)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Yuborish", callback_data=encode_callback("broadcast_confirm")),
+        InlineKeyboardButton(text="❌ Bekor qilish", callback_data=encode_callback("cancel_action"))
+    ]])
+    await message.answer(f"Xabar:\n\n{message.text}\n\nYuborilsinmi?", reply_markup=keyboard)
+
+
+@callback_routes.route("broadcast_confirm", admin=True)
+async def confirm_broadcast(callback: CallbackQuery, state: FSMContext):
+    # Preview buttons stay tappable after the flow was cancelled or already confirmed
+    if await state.get_state() != BroadcastStates.waiting_for_confirmation.state:
+        await callback.answer("⚠️ Bu xabar allaqachon yuborilgan yoki bekor qilingan", show_alert=True)
+        return
+    data = await state.get_data()
+    await state.clear()
+    
+    broadcast_id = await db.create_broadcast(data['broadcast_text'], callback.message.chat.id)
+    job = await db.get_broadcast(broadcast_id)
+    # The preview message becomes the live status message
+    await callback.message.edit_text(format_status(job), reply_markup=status_keyboard(job))
+    await db.set_broadcast_status_message(broadcast_id, callback.message.message_id)
+    broadcaster.start(callback.bot, broadcast_id)
+    
+    await callback.answer("📣 Yuborish boshlandi")
+    await callback.message.answer("Admin paneli", reply_markup=get_admin_main_keyboard())
+
+
+@callback_routes.route("broadcast_cancel", admin=True, args=1)
+async def cancel_broadcast(callback: CallbackQuery, action: CallbackAction):
+    broadcast_id = action.args[0]
+    if not broadcaster.cancel(broadcast_id):
+        # Not running in this process (e.g. interrupted before a restart)
+        await db.finish_broadcast(broadcast_id, 'cancelled')
+        job = await db.get_broadcast(broadcast_id)
+        if job:
+            await callback.message.edit_text(format_status(job))
+    await callback.answer("⛔️ To'xtatilmoqda...")
@@ -1,9 +1,11 @@
 from aiogram import Router, F
 from aiogram.filters import Command, CommandStart
-from aiogram.types import Message, CallbackQuery, FSInputFile, ReplyKeyboardRemove
+from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from database import db
+from media_cache import media_cache
+from routing import CallbackAction, callback_routes
 from keyboards import (
     get_phone_keyboard,
     get_categories_inline_keyboard,
@@ -16,7 +18,8 @@ import os
 
 settings = get_settings()
 client_router = Router()
-from utils import send_to_sheet
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "logo.jpg")
 
 
 class TestStates(StatesGroup):
@@ -29,12 +32,13 @@ class TestStates(StatesGroup):
 async def client_start(message: Message, state: FSMContext):
     await state.clear()
     
-    # Always send welcome message with logo
-    logo_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "logo.jpg")
-    
     # Check if user already exists
     user = await db.get_user(message.chat.id)
     
+    if user and user.get('blocked_at'):
+        # Writing again means the bot is no longer blocked, so broadcasts reach them again
+        await db.clear_user_blocked(message.chat.id)
+    
     if user and user.get('phone_number'):
         # User already registered - welcome text WITHOUT contact request
         welcome_text = (
@@ -44,13 +48,13 @@ async def client_start(message: Message, state: FSMContext):
             "holatlar haqida aniq, foydali va ishonchli ma'lumotlarni olasiz."
         )
         
-        if os.path.exists(logo_path):
-            photo = FSInputFile(logo_path)
-            await message.answer_photo(
-                photo=photo,
-                caption=welcome_text
-            )
-        else:
+        # Always send welcome message with logo (uploaded once, then sent by file_id)
+        sent = await media_cache.answer_photo(
+            message,
+            LOGO_PATH,
+            caption=welcome_text
+        )
+        if sent is None:
             await message.answer(welcome_text)
         
         # Show categories
@@ -65,14 +69,13 @@ async def client_start(message: Message, state: FSMContext):
             "Botdan to'liq foydalanish uchun kontaktingizni qoldiring👇🏻"
         )
         
-        if os.path.exists(logo_path):
-            photo = FSInputFile(logo_path)
-            await message.answer_photo(
-                photo=photo,
-                caption=welcome_text,
-                reply_markup=get_phone_keyboard()
-            )
-        else:
+        sent = await media_cache.answer_photo(
+            message,
+            LOGO_PATH,
+            caption=welcome_text,
+            reply_markup=get_phone_keyboard()
+        )
+        if sent is None:
             # Fallback to text if logo not found
             await message.answer(
                 welcome_text,
@@ -125,9 +128,9 @@ async def show_categories(message: Message):
     )
 
 
-@client_router.callback_query(F.data.startswith("select_category_"))
-async def show_category_info(callback: CallbackQuery, state: FSMContext):
-    category_id = int(callback.data.split("_")[-1])
+@callback_routes.route("select_category", args=1)
+async def show_category_info(callback: CallbackQuery, state: FSMContext, action: CallbackAction):
+    category_id = action.args[0]
     category = await db.get_category(category_id)
     
     if not category:
@@ -135,7 +138,7 @@ async def show_category_info(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
     
-    questions = await db.get_questions_by_category(category_id)
+    questions = await db.get_test_snapshot(category_id)
     
     if not questions:
         await callback.message.edit_text(
@@ -156,14 +159,15 @@ async def show_category_info(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@client_router.callback_query(F.data.startswith("start_test_"))
-async def start_test(callback: CallbackQuery, state: FSMContext):
-    category_id = int(callback.data.split("_")[-1])
+@callback_routes.route("start_test", args=1)
+async def start_test(callback: CallbackQuery, state: FSMContext, action: CallbackAction):
+    category_id = action.args[0]
     
-    # Get all questions for this category
-    questions = await db.get_questions_by_category(category_id)
+    # Load the whole test once; questions without answers are already dropped
+    category = await db.get_category(category_id)
+    questions = await db.get_test_snapshot(category_id)
     
-    if not questions:
+    if not category or not questions:
         await callback.message.edit_text("❌ Bu testda savollar yo'q")
         await callback.answer()
         return
@@ -175,8 +179,9 @@ async def start_test(callback: CallbackQuery, state: FSMContext):
     await state.set_state(TestStates.taking_test)
     await state.update_data(
         category_id=category_id,
+        category_name=category['name'],
         session_id=session_id,
-        questions=[q['id'] for q in questions],
+        questions=questions,
         current_question_index=0,
         total_score=0
     )
@@ -196,17 +201,13 @@ async def show_question(message: Message, state: FSMContext, callback: CallbackQ
         await complete_test(message, state)
         return
     
-    question_id = questions[current_index]
-    question = await db.get_question(question_id)
-    answers = await db.get_answers_by_question(question_id)
+    question_id, text, answer_rows = questions[current_index]
+    answers = [
+        {'id': answer_id, 'answer_text': answer_text, 'value': value}
+        for answer_id, answer_text, value in answer_rows
+    ]
     
-    if not answers:
-        # Skip questions without answers
-        await state.update_data(current_question_index=current_index + 1)
-        await show_question(message, state)
-        return
-    
-    question_text = f"❓ Savol {current_index + 1}/{len(questions)}\n\n{question['question_text']}"
+    question_text = f"❓ Savol {current_index + 1}/{len(questions)}\n\n{text}"
     
     if callback:
         await callback.message.edit_text(
@@ -220,23 +221,34 @@ async def show_question(message: Message, state: FSMContext, callback: CallbackQ
         )
 
 
-@client_router.callback_query(F.data.startswith("answer_"))
-async def process_answer(callback: CallbackQuery, state: FSMContext):
-    # Parse callback data: answer_{question_id}_{answer_id}_{value}
-    parts = callback.data.split("_")
-    question_id = int(parts[1])
-    answer_id = int(parts[2])
-    value = int(parts[3])
+@callback_routes.route("answer", args=2)
+async def process_answer(callback: CallbackQuery, state: FSMContext, action: CallbackAction):
+    # (question_id, answer_id); the value of legacy buttons is dropped by the codec
+    question_id, answer_id = action.args
     
     data = await state.get_data()
     
+    # A late tap on an already answered question must not count again
+    questions = data.get('questions')
+    current_index = data.get('current_question_index', 0)
+    if not questions or current_index >= len(questions) or questions[current_index][0] != question_id:
+        await callback.answer()
+        return
+    
+    # The score comes from the loaded test, never from the client
+    value = next((value for aid, _, value in questions[current_index][2] if aid == answer_id), None)
+    if value is None:
+        await callback.answer()
+        return
+    
     # Save user response
     await db.save_user_response(
         user_chat_id=callback.message.chat.id,
         category_id=data['category_id'],
         question_id=question_id,
         answer_id=answer_id,
-        value=value
+        value=value,
+        session_id=data['session_id']
     )
     
     # Update score
@@ -254,24 +266,26 @@ async def process_answer(callback: CallbackQuery, state: FSMContext):
 
 async def complete_test(message: Message, state: FSMContext):
     """Complete the test and show results"""
-    from main import get_bot
-    
     data = await state.get_data()
     total_score = data['total_score']
     session_id = data['session_id']
     category_id = data['category_id']
     
-    # Update session as completed
-    await db.complete_test_session(session_id, total_score)
-    
-    category = await db.get_category(category_id)
     user = await db.get_user(message.chat.id)
     
+    # Result row for the sheet export, enqueued together with the completion
+    export_row = None
+    if settings.CHANNEL_CHAT_ID and user:
+        export_row = [user['first_name'], user['phone_number'], total_score, user['username']]
+    
+    # Update session as completed
+    await db.complete_test_session(session_id, total_score, export_row=export_row)
+    
     # Get score-based response
     response = await db.get_response_for_score(category_id, total_score)
     
     result_text = f"✅ Test yakunlandi!\n\n"
-    result_text += f"📊 Test: {category['name']}\n"
+    result_text += f"📊 Test: {data['category_name']}\n"
     result_text += f"Umumiy ball: {total_score}\n\n"
     
     if response:
@@ -286,32 +300,10 @@ async def complete_test(message: Message, state: FSMContext):
     
     await message.edit_text(result_text)
     
-    # Send result to channel if configured
-    if settings.CHANNEL_CHAT_ID:
-        try:
-            bot = get_bot()
-            
-            # Prepare channel message
-            channel_message = f"📊 Yangi test natijasi\n\n"
-            channel_message += f"👤 Foydalanuvchi:\n"
-            
-      
-            
-            send_to_sheet(user['first_name'],user['phone_number'],total_score,user['username'])
-            
-            # await bot.send_message(
-            #     chat_id=settings.CHANNEL_CHAT_ID,
-            #     text=channel_message
-            # )
-        except Exception as e:
-            # Log error but don't fail the test completion
-            import logging
-            logging.error(f"Failed to send result to channel: {e}")
-    
     await state.clear()
 
 
-@client_router.callback_query(F.data == "back_to_categories")
+@callback_routes.route("back_to_categories")
 async def back_to_categories(callback: CallbackQuery, state: FSMContext):
     categories = await db.get_all_categories()
     
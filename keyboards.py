@@ -1,6 +1,8 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from typing import List, Dict
 
+from callback_codec import encode_callback
+
 
 def get_phone_keyboard() -> ReplyKeyboardMarkup:
     """Keyboard for phone number sharing"""
@@ -34,6 +36,9 @@ def get_admin_main_keyboard() -> ReplyKeyboardMarkup:
                 KeyboardButton(text="💬 Javob qo'shish"),
                 KeyboardButton(text="📝 Javoblar ro'yxati")
             ],
+            [
+                KeyboardButton(text="📣 Xabar yuborish")
+            ],
         ],
         resize_keyboard=True
     )
@@ -58,7 +63,7 @@ def get_categories_inline_keyboard(categories: List[Dict], prefix: str = "select
         buttons.append([
             InlineKeyboardButton(
                 text=category['name'],
-                callback_data=f"{prefix}_category_{category['id']}"
+                callback_data=encode_callback(f"{prefix}_category", category['id'])
             )
         ])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -68,7 +73,7 @@ def get_start_test_keyboard(category_id: int) -> InlineKeyboardMarkup:
     """Start test button"""
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Testni boshlash", callback_data=f"start_test_{category_id}")]
+            [InlineKeyboardButton(text="✅ Testni boshlash", callback_data=encode_callback("start_test", category_id))]
         ]
     )
     return keyboard
@@ -81,7 +86,7 @@ def get_answers_keyboard(question_id: int, answers: List[Dict]) -> InlineKeyboar
         buttons.append([
             InlineKeyboardButton(
                 text=f"{answer['answer_text']} - {answer['value']}",
-                callback_data=f"answer_{question_id}_{answer['id']}_{answer['value']}"
+                callback_data=encode_callback("answer", question_id, answer['id'])
             )
         ])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -94,10 +99,10 @@ def get_questions_inline_keyboard(questions: List[Dict]) -> InlineKeyboardMarkup
         buttons.append([
             InlineKeyboardButton(
                 text=f"{idx}. {question['question_text'][:50]}...",
-                callback_data=f"delete_question_{question['id']}"
+                callback_data=encode_callback("delete_question", question['id'])
             )
         ])
-    buttons.append([InlineKeyboardButton(text="❌ Bekor qilish", callback_data="cancel_action")])
+    buttons.append([InlineKeyboardButton(text="❌ Bekor qilish", callback_data=encode_callback("cancel_action"))])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
@@ -105,7 +110,7 @@ def get_back_to_categories_keyboard() -> InlineKeyboardMarkup:
     """Back to categories button"""
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="◀️ Ortga", callback_data="back_to_categories")]
+            [InlineKeyboardButton(text="◀️ Ortga", callback_data=encode_callback("back_to_categories"))]
         ]
     )
     return keyboard
@@ -1,15 +1,38 @@
 import asyncio
+import hashlib
+import hmac
+import json
 import logging
+import math
+import time
 from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from aiogram import Bot, Dispatcher
+from aiogram.types import Update
 from aiogram.enums import ParseMode
-from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.client.telegram import TelegramAPIServer
 
 from config import get_settings
 from database import db
+from utils import sheet_exporter
+from outbox import OutboxWorker
+from media_cache import media_cache
+from webhook import WebhookProcessor
+from fsm_storage import storage
+from analytics import item_analyzer
+from export import MEDIA_TYPES, parse_since, result_exporter
+from metrics import REGISTRY, setup_dispatcher_metrics
+from recorder import UpdateRecorder
+from rate_limiter import RateLimitedSession
+from broadcast import broadcaster
+from throttling import FloodControlMiddleware
+from scheduler import ChatScheduler
+from routing import callback_routes
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 # Configure logging
 logging.basicConfig(
@@ -20,33 +43,71 @@ logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
+# Background exporter of finished results (see outbox.py)
+outbox_worker = OutboxWorker(
+    db,
+    sheet_exporter,
+    batch_size=settings.OUTBOX_BATCH_SIZE,
+    rate_per_second=settings.OUTBOX_RATE_PER_SECOND,
+    poll_interval=settings.OUTBOX_POLL_SECONDS,
+    lease_seconds=settings.OUTBOX_LEASE_SECONDS
+)
+
 # Initialize bot and dispatcher
 bot = None
 dp = None
+webhook_processor = None
+update_recorder = None
+flood_control = FloodControlMiddleware(
+    rate=settings.FLOOD_RATE_PER_SECOND,
+    burst=settings.FLOOD_BURST,
+    dedup_ttl=settings.DEDUP_TTL_SECONDS
+)
+chat_scheduler = ChatScheduler(max_concurrency=settings.MAX_CONCURRENT_UPDATES)
 
 def get_bot():
     """Get or create bot instance"""
     global bot
     if bot is None:
-        # Create session with proxy if configured
+        # Outgoing messages go through the flood-limit aware session, with proxy if configured
+        session = RateLimitedSession(
+            global_rate=settings.BOT_API_GLOBAL_RATE,
+            chat_rate=settings.BOT_API_CHAT_RATE,
+            chat_burst=settings.BOT_API_CHAT_BURST,
+            chat_edit_rate=settings.BOT_API_CHAT_EDIT_RATE,
+            chat_edit_burst=settings.BOT_API_CHAT_EDIT_BURST,
+            group_per_minute=settings.BOT_API_GROUP_PER_MINUTE,
+            max_retries=settings.BOT_API_MAX_RETRIES,
+            proxy=settings.PROXY_URL
+        )
+        bot = Bot(token=settings.BOT_TOKEN, session=session)
         if settings.PROXY_URL:
-            session = AiohttpSession(proxy=settings.PROXY_URL)
-            bot = Bot(token=settings.BOT_TOKEN, session=session)
             logger.info(f"Bot initialized with proxy: {settings.PROXY_URL}")
         else:
-            bot = Bot(token=settings.BOT_TOKEN)
             logger.info("Bot initialized without proxy")
     return bot
 
 def get_dispatcher():
     """Get or create dispatcher with handlers"""
-    global dp
+    global dp, update_recorder
     if dp is None:
-        dp = Dispatcher()
+        dp = Dispatcher(storage=storage)
+        if settings.RECORD_UPDATES_PATH:
+            # Registered first so the recorded duration covers all other middlewares
+            update_recorder = UpdateRecorder(settings.RECORD_UPDATES_PATH, keep_ids=[settings.ADMIN_CHAT_ID])
+            dp.update.outer_middleware(update_recorder)
+            logger.info(f"Recording updates to {settings.RECORD_UPDATES_PATH}")
         from handlers.admin import admin_router
         from handlers.client import client_router
+        # Callback queries of both routers are dispatched by a single table lookup
+        dp.include_router(callback_routes.router)
         dp.include_router(admin_router)
         dp.include_router(client_router)
+        setup_dispatcher_metrics(dp)
+        # After the metrics middleware so dropped updates are still counted as received
+        dp.update.outer_middleware(flood_control)
+        # Last, so dropped updates never wait for their chat's turn
+        dp.update.outer_middleware(chat_scheduler)
         logger.info("Handlers registered")
     return dp
 
@@ -61,18 +122,39 @@ async def lifespan(app: FastAPI):
     await db.init_db()
     logger.info("Database initialized")
     
+    outbox_worker.start()
+    storage.start()
+    
     # Get instances
     bot_instance = get_bot()
     dp_instance = get_dispatcher()
     
-    # Start polling in background
-    asyncio.create_task(start_bot(bot_instance, dp_instance))
+    # Broadcasts interrupted by a shutdown continue from their checkpoint in
+    # whichever worker claims them first
+    broadcaster.watch(bot_instance)
+    
+    if settings.BOT_MODE == "webhook":
+        await start_webhook(bot_instance, dp_instance)
+    else:
+        # Start polling in background
+        asyncio.create_task(start_bot(bot_instance, dp_instance))
     
     yield
     
     # Shutdown
     logger.info("Shutting down bot...")
+    if webhook_processor is not None:
+        # The webhook stays registered for the other workers; remove it with
+        # python -m tools.manage_webhook delete when tearing the deployment down
+        await webhook_processor.close()
+    await broadcaster.close()
     await bot_instance.session.close()
+    if update_recorder is not None:
+        await update_recorder.close()
+    await outbox_worker.close()
+    await storage.close()
+    await db.close()
+    logger.info("Database connections closed")
 
 
 async def start_bot(bot_instance, dp_instance):
@@ -83,6 +165,28 @@ async def start_bot(bot_instance, dp_instance):
         logger.error(f"Error in bot polling: {e}")
 
 
+async def start_webhook(bot_instance, dp_instance):
+    """Register the webhook with Telegram and start accepting updates"""
+    global webhook_processor
+    if not settings.WEBHOOK_BASE_URL:
+        raise RuntimeError("WEBHOOK_BASE_URL is required when BOT_MODE=webhook")
+    if not settings.WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is required when BOT_MODE=webhook")
+    
+    webhook_processor = WebhookProcessor(
+        bot_instance,
+        dp_instance,
+        max_pending=settings.WEBHOOK_MAX_PENDING
+    )
+    url = settings.WEBHOOK_BASE_URL.rstrip("/") + settings.WEBHOOK_PATH
+    await bot_instance.set_webhook(
+        url=url,
+        secret_token=settings.WEBHOOK_SECRET,
+        allowed_updates=dp_instance.resolve_used_update_types()
+    )
+    logger.info(f"Webhook set: {url}")
+
+
 # Create FastAPI app
 app = FastAPI(
     title="Urolog Bot API",
@@ -108,31 +212,201 @@ async def health_check():
     return {"status": "healthy"}
 
 
+# Cached /stats response: (expires_at, etag, body)
+_stats_cache = (0.0, "", b"")
+_stats_lock = asyncio.Lock()
+
+
+async def _build_stats() -> bytes:
+    categories = await db.get_stats_summary()
+    
+    completed = sum(c['completed_sessions'] for c in categories)
+    score_total = sum(
+        (c['average_score'] or 0) * c['completed_sessions'] for c in categories
+    )
+    for category in categories:
+        if category['average_score'] is not None:
+            category['average_score'] = round(category['average_score'], 2)
+    
+    stats = {
+        "total_categories": len(categories),
+        "completed_sessions": completed,
+        "abandoned_sessions": sum(c['abandoned_sessions'] for c in categories),
+        "average_score": round(score_total / completed, 2) if completed else None,
+        "completed_last_24h": sum(c['completed_last_24h'] for c in categories),
+        "categories": categories
+    }
+    return json.dumps(stats, ensure_ascii=False).encode()
+
+
 @app.get("/stats")
-async def get_stats():
-    """Get bot statistics"""
+async def get_stats(request: Request):
+    """Get bot statistics (cached for STATS_CACHE_SECONDS, supports ETag)"""
+    global _stats_cache
     try:
-        categories = await db.get_all_categories()
+        expires_at, etag, body = _stats_cache
+        if time.monotonic() >= expires_at:
+            async with _stats_lock:
+                expires_at, etag, body = _stats_cache
+                if time.monotonic() >= expires_at:
+                    body = await _build_stats()
+                    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                    expires_at = time.monotonic() + settings.STATS_CACHE_SECONDS
+                    _stats_cache = (expires_at, etag, body)
         
-        stats = {
-            "total_categories": len(categories),
-            "categories": []
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"max-age={int(settings.STATS_CACHE_SECONDS)}"
         }
-        
-        for category in categories:
-            questions = await db.get_questions_by_category(category['id'])
-            stats["categories"].append({
-                "id": category['id'],
-                "name": category['name'],
-                "questions_count": len(questions)
-            })
-        
-        return stats
+        if_none_match = request.headers.get("If-None-Match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
         return {"error": str(e)}
 
 
+def _score_summary(rows) -> dict:
+    """Count, mean and standard deviation from rollup sums"""
+    count = sum(row['completions'] for row in rows)
+    if not count:
+        return {"completions": 0, "mean": None, "stddev": None}
+    score_sum = sum(row['score_sum'] for row in rows)
+    score_sq_sum = sum(row['score_sq_sum'] for row in rows)
+    mean = score_sum / count
+    variance = max(score_sq_sum / count - mean * mean, 0.0)
+    return {"completions": count, "mean": round(mean, 2), "stddev": round(math.sqrt(variance), 2)}
+
+
+@app.get("/stats/scores/{category_id}")
+async def get_score_stats(category_id: int, hours: int = 168, granularity: str = "day"):
+    """Score distribution and trend for a category, served from the hourly rollups"""
+    if granularity not in ("hour", "day"):
+        raise HTTPException(status_code=400, detail="granularity must be 'hour' or 'day'")
+    hours = min(max(hours, 1), 24 * 366)
+    since = (datetime.utcnow() - timedelta(hours=hours)).strftime('%Y-%m-%d %H:00:00')
+    
+    rollups = await db.get_score_rollups(category_id, since)
+    
+    # Hour keys look like 'YYYY-MM-DD HH:00:00'; a day is the first 10 characters
+    periods = {}
+    for row in rollups['hourly']:
+        period = row['hour'] if granularity == "hour" else row['hour'][:10]
+        periods.setdefault(period, []).append(row)
+    
+    width = db.score_bucket_width
+    return {
+        "category_id": category_id,
+        "since": since,
+        "summary": _score_summary(rollups['hourly']),
+        "histogram": [
+            {
+                "bucket_start": row['bucket'],
+                "bucket_end": row['bucket'] + width - 1,
+                "completions": row['completions']
+            }
+            for row in rollups['histogram']
+        ],
+        "trend": [
+            {"period": period, **_score_summary(rows)}
+            for period, rows in periods.items()
+        ]
+    }
+
+
+@app.get("/analytics/items/{category_id}")
+async def get_item_analysis(category_id: int):
+    """Per-question answer distributions, item-total correlations and Cronbach's alpha"""
+    if not await db.get_category(category_id):
+        raise HTTPException(status_code=404, detail="Category not found")
+    return await item_analyzer.analyze(category_id)
+
+
+@app.get("/export/results")
+async def export_results(request: Request, format: str = "csv", since: Optional[str] = None,
+                         responses: bool = False):
+    """Stream completed sessions (optionally with their answers) as CSV, Arrow or Parquet"""
+    if not settings.EXPORT_TOKEN:
+        raise HTTPException(status_code=404)
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(token, settings.EXPORT_TOKEN):
+        raise HTTPException(status_code=401)
+    
+    if format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(MEDIA_TYPES)}")
+    if not result_exporter.is_available(format):
+        raise HTTPException(status_code=400, detail=f"{format} output requires pyarrow")
+    if since is not None:
+        try:
+            since = parse_since(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="since must be an ISO date or datetime")
+    
+    filename = f"results.{'arrows' if format == 'arrow' else format}"
+    return StreamingResponse(
+        result_exporter.stream(format, since, responses),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: update and handler counters, latencies, database calls"""
+    return Response(content=generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+@app.get("/stats/runtime")
+async def get_runtime_stats():
+    """In-process pool, cache and storage counters (not cached)"""
+    return {
+        "db_pool": db.pool_stats(),
+        "catalog_cache": db.catalog_stats(),
+        "response_writer": db.response_writer_stats(),
+        "media_cache": media_cache.stats(),
+        "fsm_storage": storage.stats(),
+        "flood_control": flood_control.stats(),
+        "scheduler": chat_scheduler.stats()
+    }
+
+
+@app.post(settings.WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    """Receive updates from Telegram in webhook mode"""
+    if webhook_processor is None:
+        raise HTTPException(status_code=404)
+    
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token, settings.WEBHOOK_SECRET):
+        raise HTTPException(status_code=403)
+    
+    try:
+        update = Update.model_validate(await request.json(), context={"bot": webhook_processor.bot})
+    except ValueError as e:
+        # A 5xx would make Telegram redeliver a body that can never be parsed
+        logger.warning(f"Rejected malformed webhook update: {e}")
+        raise HTTPException(status_code=400)
+    if not webhook_processor.submit(update):
+        # Telegram redelivers the update later
+        raise HTTPException(status_code=503)
+    return {"ok": True}
+
+
+
+@app.get("/stats/outbox")
+async def get_outbox_stats():
+    """Export outbox queue depth and lag"""
+    try:
+        return {
+            **await outbox_worker.stats(),
+            "sheet_exporter": sheet_exporter.stats()
+        }
+    except Exception as e:
+        logger.error(f"Error getting outbox stats: {e}")
+        return {"error": str(e)}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
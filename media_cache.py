@@ -0,0 +1,93 @@
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from database import Database, db
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """Sends local photos by Telegram file_id instead of re-uploading them
+
+    The first send uploads the file and stores the returned file_id in
+    SQLite, keyed by the SHA-256 of the file content. Later sends reuse
+    the file_id. A changed file gets a new hash and is uploaded again, and
+    a file_id rejected by Telegram is dropped and replaced by a fresh upload.
+    """
+
+    def __init__(self, database: Database, recheck_interval: float = 60.0):
+        self.database = database
+        self.recheck_interval = recheck_interval
+        # path -> (checked_at, (mtime_ns, size), content_hash)
+        self._files: Dict[str, Tuple[float, Tuple[int, int], str]] = {}
+        self._file_ids: Dict[str, str] = {}
+        self._stats = {"cached_sends": 0, "uploads": 0, "rejected_ids": 0}
+
+    def _content_hash(self, path: str) -> Optional[str]:
+        """Hash of the file content, or None if the file does not exist"""
+        now = time.monotonic()
+        cached = self._files.get(path)
+        if cached and now - cached[0] < self.recheck_interval:
+            return cached[2]
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._files.pop(path, None)
+            return None
+
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        if cached and cached[1] == stat_key:
+            content_hash = cached[2]
+        else:
+            with open(path, "rb") as f:
+                content_hash = hashlib.sha256(f.read()).hexdigest()
+        self._files[path] = (now, stat_key, content_hash)
+        return content_hash
+
+    async def _get_file_id(self, content_hash: str) -> Optional[str]:
+        file_id = self._file_ids.get(content_hash)
+        if file_id is None:
+            file_id = await self.database.get_media_file_id(content_hash)
+            if file_id:
+                self._file_ids[content_hash] = file_id
+        return file_id
+
+    async def answer_photo(self, message: Message, path: str, **kwargs) -> Optional[Message]:
+        """Reply with a photo; returns None if the file does not exist"""
+        content_hash = self._content_hash(path)
+        if content_hash is None:
+            return None
+
+        file_id = await self._get_file_id(content_hash)
+        if file_id:
+            try:
+                sent = await message.answer_photo(photo=file_id, **kwargs)
+                self._stats["cached_sends"] += 1
+                return sent
+            except TelegramBadRequest as e:
+                logger.warning(f"Cached file_id for {path} rejected, re-uploading: {e}")
+                self._stats["rejected_ids"] += 1
+                self._file_ids.pop(content_hash, None)
+                await self.database.delete_media_file_id(content_hash)
+
+        sent = await message.answer_photo(photo=FSInputFile(path), **kwargs)
+        self._stats["uploads"] += 1
+        if sent.photo:
+            file_id = sent.photo[-1].file_id
+            self._file_ids[content_hash] = file_id
+            await self.database.save_media_file_id(content_hash, file_id)
+        return sent
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+
+# Global media cache instance
+media_cache = MediaCache(db)
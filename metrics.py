@@ -0,0 +1,212 @@
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+# Metrics are kept in their own registry so /metrics only shows the bot's series
+REGISTRY = CollectorRegistry()
+
+UPDATES = Counter(
+    "bot_updates_total", "Updates received, by update type", ["type"], registry=REGISTRY
+)
+UPDATE_ERRORS = Counter(
+    "bot_update_errors_total", "Updates whose processing raised, by update type", ["type"],
+    registry=REGISTRY
+)
+UPDATES_IN_FLIGHT = Gauge(
+    "bot_updates_in_flight", "Updates currently being processed", registry=REGISTRY
+)
+SCHEDULER_QUEUED = Gauge(
+    "bot_scheduler_queued_updates", "Updates waiting for their chat's turn or a free worker slot",
+    registry=REGISTRY
+)
+SCHEDULER_ACTIVE_CHATS = Gauge(
+    "bot_scheduler_active_chats", "Chats with updates running or queued", registry=REGISTRY
+)
+SCHEDULER_WAIT = Histogram(
+    "bot_scheduler_wait_seconds", "Time from arrival until an update starts processing",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    registry=REGISTRY
+)
+UPDATES_DROPPED = Counter(
+    "bot_updates_dropped_total", "Updates dropped by flood control, by reason", ["reason"],
+    registry=REGISTRY
+)
+HANDLER_DURATION = Histogram(
+    "bot_handler_duration_seconds", "Handler run time, by handler function", ["handler"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    registry=REGISTRY
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Handlers that raised, by handler function", ["handler"],
+    registry=REGISTRY
+)
+HANDLER_DB_CALLS = Histogram(
+    "bot_handler_db_calls", "Database method calls made per handler run", ["handler"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34),
+    registry=REGISTRY
+)
+HANDLER_DB_SECONDS = Histogram(
+    "bot_handler_db_seconds", "Time spent in database methods per handler run", ["handler"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+    registry=REGISTRY
+)
+DB_CALL_DURATION = Histogram(
+    "db_call_duration_seconds", "Database method run time, by method name", ["method"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+    registry=REGISTRY
+)
+DB_CALL_ERRORS = Counter(
+    "db_call_errors_total", "Database methods that raised, by method name", ["method"],
+    registry=REGISTRY
+)
+BOT_API_QUEUED = Gauge(
+    "bot_api_queued_requests", "Bot API requests waiting for the rate limiter, by priority", ["priority"],
+    registry=REGISTRY
+)
+BOT_API_WAIT = Histogram(
+    "bot_api_rate_limit_wait_seconds", "Time Bot API requests waited for the rate limiter, by priority",
+    ["priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+    registry=REGISTRY
+)
+BOT_API_FLOOD_WAITS = Counter(
+    "bot_api_flood_waits_total", "429 responses (retry_after) received from the Bot API, by method",
+    ["method"], registry=REGISTRY
+)
+
+
+class DBUsage:
+    """Database calls and time collected by track_db_usage()"""
+
+    __slots__ = ("calls", "seconds", "depth")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.depth = 0
+
+
+_db_usage: ContextVar[Optional[DBUsage]] = ContextVar("db_usage", default=None)
+
+
+@contextmanager
+def track_db_usage() -> Iterator[DBUsage]:
+    """Collect database calls made in this context
+
+    The totals are added to an enclosing tracker as well, so an outer
+    tracker sees the calls of every handler that ran inside it.
+    """
+    usage = DBUsage()
+    parent = _db_usage.get()
+    token = _db_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _db_usage.reset(token)
+        if parent is not None:
+            parent.calls += usage.calls
+            parent.seconds += usage.seconds
+
+
+def _timed_method(name: str, method: Callable[..., Awaitable[Any]]):
+    duration = DB_CALL_DURATION.labels(name)
+    errors = DB_CALL_ERRORS.labels(name)
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        usage = _db_usage.get()
+        if usage is not None:
+            usage.depth += 1
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            duration.observe(elapsed)
+            if usage is not None:
+                usage.depth -= 1
+                # Methods calling other methods are counted once
+                if usage.depth == 0:
+                    usage.calls += 1
+                    usage.seconds += elapsed
+
+    return wrapper
+
+
+def instrument_methods(cls):
+    """Class decorator timing every public coroutine method by its name"""
+    for name, member in list(vars(cls).items()):
+        if not name.startswith("_") and inspect.iscoroutinefunction(member):
+            setattr(cls, name, _timed_method(name, member))
+    return cls
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer update middleware: counts updates and errors, tracks in-flight updates"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        update_type = event.event_type
+        UPDATES.labels(update_type).inc()
+        UPDATES_IN_FLIGHT.inc()
+        try:
+            return await handler(event, data)
+        except Exception:
+            UPDATE_ERRORS.labels(update_type).inc()
+            raise
+        finally:
+            UPDATES_IN_FLIGHT.dec()
+
+
+def handler_name(data: Dict[str, Any]) -> str:
+    """Name of the function handling an event; callback routes (see routing.py) report their own"""
+    route = data.get("callback_route")
+    if route is not None:
+        return route.name
+    return data["handler"].callback.__name__
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner event middleware: latency and database calls per matched handler"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = handler_name(data)
+        with track_db_usage() as usage:
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            except Exception:
+                HANDLER_ERRORS.labels(name).inc()
+                raise
+            finally:
+                HANDLER_DURATION.labels(name).observe(time.perf_counter() - started)
+                HANDLER_DB_CALLS.labels(name).observe(usage.calls)
+                HANDLER_DB_SECONDS.labels(name).observe(usage.seconds)
+
+
+def setup_dispatcher_metrics(dispatcher):
+    """Register the metrics middlewares; inner ones apply to all included routers"""
+    dispatcher.update.outer_middleware(UpdateMetricsMiddleware())
+    handler_middleware = HandlerMetricsMiddleware()
+    for event_name, observer in dispatcher.observers.items():
+        if event_name not in ("update", "error"):
+            observer.middleware(handler_middleware)
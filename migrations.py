@@ -0,0 +1,354 @@
+import logging
+from typing import List, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Ordered schema migrations: (version, description, statements).
+# The applied version is tracked in PRAGMA user_version. Append new steps
+# at the end; never edit a step that has already shipped.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "Initial schema", [
+        # Users table
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            chat_id INTEGER PRIMARY KEY,
+            phone_number TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Categories table
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Questions table
+        """
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_id INTEGER NOT NULL,
+            question_text TEXT NOT NULL,
+            order_num INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (category_id) REFERENCES categories (id) ON DELETE CASCADE
+        )
+        """,
+        # Answers table
+        """
+        CREATE TABLE IF NOT EXISTS answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question_id INTEGER NOT NULL,
+            answer_text TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (question_id) REFERENCES questions (id) ON DELETE CASCADE
+        )
+        """,
+        # User responses table
+        """
+        CREATE TABLE IF NOT EXISTS user_responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_chat_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            answer_id INTEGER NOT NULL,
+            value INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_chat_id) REFERENCES users (chat_id),
+            FOREIGN KEY (category_id) REFERENCES categories (id),
+            FOREIGN KEY (question_id) REFERENCES questions (id),
+            FOREIGN KEY (answer_id) REFERENCES answers (id)
+        )
+        """,
+        # Test sessions table
+        """
+        CREATE TABLE IF NOT EXISTS test_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_chat_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            total_score INTEGER DEFAULT 0,
+            completed BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            FOREIGN KEY (user_chat_id) REFERENCES users (chat_id),
+            FOREIGN KEY (category_id) REFERENCES categories (id)
+        )
+        """,
+        # Category responses table (score-based responses)
+        """
+        CREATE TABLE IF NOT EXISTS category_responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_id INTEGER NOT NULL,
+            min_score INTEGER NOT NULL,
+            max_score INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            response_text TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (category_id) REFERENCES categories (id) ON DELETE CASCADE
+        )
+        """,
+        # Outbox of finished results waiting to be exported
+        """
+        CREATE TABLE IF NOT EXISTS export_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            delivered_at REAL
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_export_outbox_pending
+        ON export_outbox (next_attempt_at) WHERE delivered_at IS NULL
+        """,
+        # Telegram file_id of uploaded media, keyed by file content hash
+        """
+        CREATE TABLE IF NOT EXISTS media_cache (
+            content_hash TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Persistent FSM state (see fsm_storage.py)
+        """
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL NOT NULL
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage (updated_at)
+        """,
+    ]),
+    (2, "Indexes for hot-path lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_questions_category ON questions (category_id, order_num)",
+        "CREATE INDEX IF NOT EXISTS idx_answers_question ON answers (question_id)",
+        "CREATE INDEX IF NOT EXISTS idx_category_responses_category ON category_responses (category_id)",
+        "CREATE INDEX IF NOT EXISTS idx_user_responses_user ON user_responses (user_chat_id)",
+        """
+        CREATE INDEX IF NOT EXISTS idx_test_sessions_user_completed
+        ON test_sessions (user_chat_id, completed, completed_at)
+        """,
+    ]),
+    (3, "Hourly score rollups per category", [
+        """
+        CREATE TABLE IF NOT EXISTS score_rollup_hourly (
+            category_id INTEGER NOT NULL,
+            hour TEXT NOT NULL,
+            completions INTEGER NOT NULL DEFAULT 0,
+            score_sum INTEGER NOT NULL DEFAULT 0,
+            score_sq_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category_id, hour)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS score_rollup_histogram (
+            category_id INTEGER NOT NULL,
+            hour TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            completions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category_id, hour, bucket)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (4, "Link user responses to their session", [
+        "ALTER TABLE user_responses ADD COLUMN session_id INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_user_responses_category ON user_responses (category_id, id)",
+    ]),
+    (5, "Indexes for streaming result export", [
+        "CREATE INDEX IF NOT EXISTS idx_test_sessions_completed_at ON test_sessions (completed, completed_at)",
+        "CREATE INDEX IF NOT EXISTS idx_user_responses_session ON user_responses (session_id)",
+    ]),
+    (6, "Broadcast jobs and blocked users", [
+        # Set when a message to the user fails because they blocked the bot or were deleted
+        "ALTER TABLE users ADD COLUMN blocked_at REAL",
+        # Progress is checkpointed in last_chat_id so a restart resumes the job
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            admin_chat_id INTEGER NOT NULL,
+            status_message_id INTEGER,
+            total INTEGER NOT NULL DEFAULT 0,
+            last_chat_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+        """,
+    ]),
+    (7, "Soft-deleted catalog rows and history lookups", [
+        # Deleted catalog rows stay so that test history keeps its references
+        "ALTER TABLE categories ADD COLUMN deleted_at REAL",
+        "ALTER TABLE questions ADD COLUMN deleted_at REAL",
+        "ALTER TABLE answers ADD COLUMN deleted_at REAL",
+        "CREATE INDEX IF NOT EXISTS idx_user_responses_question ON user_responses (question_id)",
+        "CREATE INDEX IF NOT EXISTS idx_user_responses_answer ON user_responses (answer_id)",
+        "CREATE INDEX IF NOT EXISTS idx_test_sessions_category ON test_sessions (category_id)",
+    ]),
+    (8, "Outbox row claims", [
+        # Lease held by the worker exporting the row, so several workers never export it twice
+        "ALTER TABLE export_outbox ADD COLUMN claimed_until REAL",
+    ]),
+    (9, "Broadcast claims", [
+        # The worker sending a running broadcast and until when; renewed after every page
+        "ALTER TABLE broadcasts ADD COLUMN claimed_by TEXT",
+        "ALTER TABLE broadcasts ADD COLUMN claimed_until REAL",
+    ]),
+    (10, "Shared catalog version", [
+        # Bumped with every catalog write so each worker notices edits made by the others
+        """
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 1)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+SCORE_ROLLUPS_VERSION = 3  # Rollups are backfilled by Database.init_db when crossing this step
+
+# Queries on the request path that must never scan a whole table.
+# Parameters only need the right types; EXPLAIN QUERY PLAN does not run them.
+HOT_QUERIES: List[Tuple[str, str, tuple]] = [
+    ("get_user", "SELECT * FROM users WHERE chat_id = ?", (0,)),
+    ("get_user_test_history", """
+        SELECT ts.*, c.name as category_name
+        FROM test_sessions ts
+        JOIN categories c ON ts.category_id = c.id
+        WHERE ts.user_chat_id = ? AND ts.completed = 1
+        ORDER BY ts.completed_at DESC
+    """, (0,)),
+    ("user_responses_by_user", "SELECT * FROM user_responses WHERE user_chat_id = ?", (0,)),
+    ("iter_user_responses", """
+        SELECT id, COALESCE(session_id, -user_chat_id), question_id, answer_id, value
+        FROM user_responses
+        WHERE category_id = ? AND id > ?
+        ORDER BY id
+        LIMIT ?
+    """, (0, 0, 1)),
+    ("iter_completed_sessions", """
+        SELECT ts.id, ts.completed_at, ts.user_chat_id, u.first_name, u.last_name,
+               u.username, u.phone_number, ts.category_id, c.name, ts.total_score
+        FROM test_sessions ts
+        LEFT JOIN users u ON u.chat_id = ts.user_chat_id
+        LEFT JOIN categories c ON c.id = ts.category_id
+        WHERE ts.completed = 1 AND (ts.completed_at, ts.id) > (?, ?)
+        ORDER BY ts.completed_at, ts.id
+        LIMIT ?
+    """, ("", 0, 1)),
+    ("get_session_responses", """
+        SELECT ur.session_id, ur.question_id, q.question_text, ur.answer_id, a.answer_text, ur.value
+        FROM user_responses ur
+        LEFT JOIN questions q ON q.id = ur.question_id
+        LEFT JOIN answers a ON a.id = ur.answer_id
+        WHERE ur.session_id IN (SELECT value FROM json_each(?))
+        ORDER BY ur.session_id, ur.id
+    """, ("[]",)),
+    ("questions_by_category", """
+        SELECT * FROM questions WHERE category_id = ? ORDER BY order_num, id
+    """, (0,)),
+    ("answers_by_question", "SELECT * FROM answers WHERE question_id = ?", (0,)),
+    ("category_responses_by_category", """
+        SELECT * FROM category_responses WHERE category_id = ?
+    """, (0,)),
+    ("claim_due_exports", """
+        SELECT id FROM export_outbox
+        WHERE delivered_at IS NULL AND next_attempt_at <= ?
+          AND (claimed_until IS NULL OR claimed_until < ?)
+        ORDER BY next_attempt_at, id
+        LIMIT ?
+    """, (0.0, 0.0, 1)),
+    ("get_broadcast_recipients", """
+        SELECT chat_id FROM users
+        WHERE chat_id > ? AND blocked_at IS NULL
+        ORDER BY chat_id
+        LIMIT ?
+    """, (0, 1)),
+    ("catalog_version", "SELECT version FROM catalog_version WHERE id = 1", ()),
+    ("get_media_file_id", "SELECT file_id FROM media_cache WHERE content_hash = ?", ("",)),
+    ("get_fsm_record", """
+        SELECT state, data, updated_at FROM fsm_storage
+        WHERE key = ? AND updated_at >= ?
+    """, ("", 0.0)),
+    ("purge_fsm_records", "SELECT key FROM fsm_storage WHERE updated_at < ?", (0.0,)),
+    ("score_rollup_hourly", """
+        SELECT hour, completions, score_sum, score_sq_sum
+        FROM score_rollup_hourly
+        WHERE category_id = ? AND hour >= ?
+        ORDER BY hour
+    """, (0, "")),
+    ("score_rollup_histogram", """
+        SELECT bucket, SUM(completions) AS completions
+        FROM score_rollup_histogram
+        WHERE category_id = ? AND hour >= ?
+        GROUP BY bucket
+    """, (0, "")),
+]
+
+
+async def get_schema_version(conn: aiosqlite.Connection) -> int:
+    async with conn.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0]
+
+
+async def migrate(conn: aiosqlite.Connection) -> int:
+    """Apply pending migrations in order; returns the resulting version"""
+    version = await get_schema_version(conn)
+    if version > LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than this code supports ({LATEST_VERSION})"
+        )
+
+    for step_version, description, statements in MIGRATIONS:
+        if step_version <= version:
+            continue
+        logger.info(f"Applying migration {step_version}: {description}")
+        # Each step and its version bump commit together
+        await conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                await conn.execute(statement)
+            await conn.execute(f"PRAGMA user_version = {step_version}")
+        except BaseException:
+            await conn.rollback()
+            raise
+        await conn.commit()
+        version = step_version
+
+    return version
+
+
+async def check_query_plans(conn: aiosqlite.Connection):
+    """Raise if any hot query's plan contains a full table scan"""
+    offenders = []
+    for name, query, params in HOT_QUERIES:
+        async with conn.execute(f"EXPLAIN QUERY PLAN {query}", params) as cursor:
+            rows = await cursor.fetchall()
+        for row in rows:
+            detail = row[-1]
+            # Virtual tables such as json_each() only scan their argument
+            if detail.startswith("SCAN ") and " USING " not in detail and "VIRTUAL TABLE" not in detail:
+                offenders.append(f"{name}: {detail}")
+
+    if offenders:
+        raise RuntimeError("Full table scan in hot queries: " + "; ".join(offenders))
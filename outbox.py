@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorker:
+    """Drains the export_outbox table into the sheet exporter
+
+    Due rows are exported in batches of at most batch_size, at no more
+    than rate_per_second rows per second. Failed rows are retried with
+    exponential backoff (capped at max_backoff seconds) and stay in the
+    table across restarts until delivered. Each batch is claimed for
+    lease_seconds first, so workers sharing the database never export the
+    same row twice; a worker that dies mid-batch frees it when the lease ends.
+    """
+
+    def __init__(self, database: Database, exporter, batch_size: int = 100,
+                 rate_per_second: float = 5.0, poll_interval: float = 5.0,
+                 backoff_base: float = 30.0, max_backoff: float = 3600.0,
+                 retention_seconds: float = 7 * 24 * 3600, lease_seconds: float = 300.0):
+        self.database = database
+        self.exporter = exporter
+        self.batch_size = max(1, batch_size)
+        self.rate_per_second = rate_per_second
+        self.poll_interval = poll_interval
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+        self._stats = {"delivered": 0, "failed_attempts": 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                exported = await self.drain_once()
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+                exported = 0
+
+            if exported:
+                # Keep the export rate bounded
+                await asyncio.sleep(exported / self.rate_per_second)
+            else:
+                await asyncio.sleep(self.poll_interval)
+
+            if time.monotonic() - self._last_purge > 3600:
+                self._last_purge = time.monotonic()
+                try:
+                    await self.database.purge_delivered_exports(self.retention_seconds)
+                except Exception as e:
+                    logger.error(f"Failed to purge delivered exports: {e}")
+
+    async def drain_once(self) -> int:
+        """Export one batch of due rows; returns how many were attempted"""
+        items = await self.database.claim_due_exports(self.batch_size, self.lease_seconds)
+        if not items:
+            return 0
+
+        ids = [item['id'] for item in items]
+        try:
+            await self.exporter.append_rows([item['payload'] for item in items])
+        except Exception as e:
+            self._stats["failed_attempts"] += len(items)
+            # The exponent is capped: 2 ** 1024 no longer converts to float after a long outage
+            retry_in = {
+                item['id']: min(self.backoff_base * (2 ** min(item['attempts'], 16)), self.max_backoff)
+                for item in items
+            }
+            await self.database.mark_exports_failed(ids, str(e)[:500], retry_in)
+            logger.warning(f"Export of {len(items)} outbox rows failed: {e}")
+            return len(items)
+
+        await self.database.mark_exports_delivered(ids)
+        self._stats["delivered"] += len(items)
+        return len(items)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {**await self.database.get_outbox_stats(), **self._stats}
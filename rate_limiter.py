@@ -0,0 +1,244 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+from metrics import BOT_API_FLOOD_WAITS, BOT_API_QUEUED, BOT_API_WAIT
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Methods that post or change messages; these count against Telegram's flood limits
+LIMITED_PREFIXES = ("send", "copy", "forward", "edit")
+# Edits of existing messages (every quiz answer edits the question) have their own,
+# looser per-chat bucket in private chats instead of the 1 message/s one
+EDIT_PREFIX = "edit"
+# Per-chat buckets kept before idle (full) ones are dropped
+MAX_CHAT_BUCKETS = 10000
+
+_priority: ContextVar[int] = ContextVar("bot_api_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def bulk_priority() -> Iterator[None]:
+    """Bot API calls made in this context yield to interactive replies"""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second
+
+    Tokens may go negative: reserve() takes a token that has not accrued
+    yet and returns how long the caller has to wait for it, so waiters are
+    served in the order they reserved without a queue of their own.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a whole token is available"""
+        now = time.monotonic()
+        self._refill(now)
+        return max(0.0, self.updated - now) + max(0.0, 1 - self.tokens) / self.rate
+
+    def try_take(self) -> bool:
+        if self.delay() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    def reserve(self) -> float:
+        """Take a token now and return the seconds until it is actually available"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, self.updated - now) + max(0.0, -self.tokens) / self.rate
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for the next seconds (Telegram's retry_after)"""
+        now = time.monotonic()
+        self._refill(now)
+        # One token left for the retried call, none accrues during the pause
+        self.tokens = min(self.tokens, 1.0)
+        self.updated = max(self.updated, now + seconds)
+
+    def is_idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class PriorityGate:
+    """Hands out tokens of a shared bucket, lower priority values first
+
+    Callers that find no waiters and a token available pass immediately;
+    otherwise they queue and a single pump task releases them one token
+    at a time.
+    """
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._waiters: List = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    async def acquire(self, priority: int):
+        if not self._waiters and self.bucket.try_take():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        while self._waiters:
+            delay = self.bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            # Cancelled waiters are skipped without using a token
+            if not future.done():
+                self.bucket.tokens -= 1
+                future.set_result(None)
+
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class RateLimitedSession(AiohttpSession):
+    """Bot session keeping outgoing messages within Telegram's flood limits
+
+    Message-sending methods wait for a per-chat bucket (private chats and
+    groups have separate rates, and edits in private chats a looser one of
+    their own) and then for the global bucket, where
+    interactive replies go ahead of calls made under bulk_priority().
+    A 429 response pauses the chat (or the global bucket for calls without
+    a chat) for retry_after seconds and the call is retried.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: int = 3,
+                 group_per_minute: float = 20.0, max_retries: int = 3,
+                 chat_edit_rate: float = 5.0, chat_edit_burst: int = 10, **kwargs):
+        super().__init__(**kwargs)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_edit_rate = chat_edit_rate
+        self.chat_edit_burst = chat_edit_burst
+        self.group_rate = group_per_minute / 60
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._gate = PriorityGate(self.global_bucket)
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._edit_chats: Dict[int, TokenBucket] = {}
+        self._stats = {"limited_requests": 0, "flood_waits": 0, "wait_seconds_total": 0.0}
+
+    @staticmethod
+    def _is_group(chat_id: Union[int, str]) -> bool:
+        # Group, supergroup and channel ids are negative; channels may be given as @username
+        return isinstance(chat_id, str) or chat_id < 0
+
+    def _chat_bucket(self, chat_id: Union[int, str], edit: bool = False) -> TokenBucket:
+        if edit and not self._is_group(chat_id):
+            chats, rate, burst = self._edit_chats, self.chat_edit_rate, self.chat_edit_burst
+        else:
+            chats, burst = self._chats, self.chat_burst
+            rate = self.group_rate if self._is_group(chat_id) else self.chat_rate
+        bucket = chats.get(chat_id)
+        if bucket is None:
+            if len(chats) >= MAX_CHAT_BUCKETS:
+                idle = [key for key, value in chats.items() if value.is_idle()]
+                for key in idle:
+                    del chats[key]
+            bucket = chats[chat_id] = TokenBucket(rate, burst)
+        return bucket
+
+    async def _acquire(self, chat_id: Optional[Union[int, str]], edit: bool = False):
+        priority = _priority.get()
+        name = PRIORITY_NAMES[priority]
+        queued = BOT_API_QUEUED.labels(name)
+        queued.inc()
+        started = time.perf_counter()
+        try:
+            if chat_id is not None:
+                delay = self._chat_bucket(chat_id, edit).reserve()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self._gate.acquire(priority)
+        finally:
+            queued.dec()
+            waited = time.perf_counter() - started
+            BOT_API_WAIT.labels(name).observe(waited)
+            self._stats["limited_requests"] += 1
+            self._stats["wait_seconds_total"] += waited
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        api_method = method.__api_method__
+        limited = api_method.startswith(LIMITED_PREFIXES)
+        edit = api_method.startswith(EDIT_PREFIX)
+        chat_id = getattr(method, "chat_id", None)
+        attempt = 0
+        while True:
+            if limited:
+                await self._acquire(chat_id, edit)
+            try:
+                return await super().make_request(bot, method, timeout)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self._stats["flood_waits"] += 1
+                BOT_API_FLOOD_WAITS.labels(api_method).inc()
+                logger.warning(f"Flood wait on {api_method} (chat {chat_id}): retry {attempt} in {e.retry_after}s")
+                if not limited:
+                    await asyncio.sleep(e.retry_after)
+                elif chat_id is not None:
+                    self._chat_bucket(chat_id, edit).pause(e.retry_after)
+                else:
+                    self.global_bucket.pause(e.retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "waiting_global": self._gate.waiting(),
+            "chat_buckets": len(self._chats) + len(self._edit_chats),
+        }
+
+    async def close(self):
+        await self._gate.close()
+        await super().close()
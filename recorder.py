@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from write_buffer import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+RECORDING_VERSION = 1
+
+# Objects describing a person or chat; their ids are pseudonymized and names dropped
+_IDENTITY_KEYS = {"from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat", "via_bot"}
+_NAME_FIELDS = {"first_name", "last_name", "username", "title", "bio"}
+_TEXT_FIELDS = {"text", "caption"}
+# Formatting offsets would point into the blanked text
+_DROPPED_FIELDS = {"entities", "caption_entities"}
+
+
+class Anonymizer:
+    """Replaces user-identifying data in raw updates
+
+    Chat and user ids map to stable pseudonyms (keyed by a random salt per
+    recording, so the same person keeps one id within it) and names, phone
+    numbers and free text are blanked. Commands and callback data are kept
+    because replaying depends on them, and chats in keep_ids (the admin)
+    keep their real id and text.
+    """
+
+    def __init__(self, keep_ids: Iterable[int] = (), salt: Optional[bytes] = None):
+        self.keep_ids = set(keep_ids)
+        self.salt = salt or secrets.token_bytes(16)
+
+    def pseudonym(self, value: int) -> int:
+        if value in self.keep_ids:
+            return value
+        digest = hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+        pseudo = int.from_bytes(digest[:5], "big") + 1
+        return -pseudo if value < 0 else pseudo
+
+    def anonymize(self, update: Dict[str, Any]) -> Dict[str, Any]:
+        return self._walk(update, keep_text=self._is_kept(update))
+
+    def _is_kept(self, update: Dict[str, Any]) -> bool:
+        for event in update.values():
+            if isinstance(event, dict):
+                chat = event.get("chat") or (event.get("message") or {}).get("chat") or event.get("from") or {}
+                return chat.get("id") in self.keep_ids
+        return False
+
+    def _walk(self, value: Any, keep_text: bool, key: Optional[str] = None) -> Any:
+        if isinstance(value, list):
+            return [self._walk(item, keep_text, key) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        result = {}
+        for field, item in value.items():
+            if field in _DROPPED_FIELDS and not keep_text:
+                continue
+            if key in _IDENTITY_KEYS and field == "id" and isinstance(item, int):
+                result[field] = self.pseudonym(item)
+            elif key in _IDENTITY_KEYS and field in _NAME_FIELDS:
+                result[field] = "User" if field == "first_name" else None
+            elif key == "contact" and field == "user_id":
+                result[field] = self.pseudonym(item)
+            elif key == "contact" and field == "phone_number":
+                digits = "".join(filter(str.isdigit, item))
+                result[field] = f"+{self.pseudonym(int(digits))}" if digits else None
+            elif key == "contact" and field in _NAME_FIELDS:
+                result[field] = "User" if field == "first_name" else None
+            elif field in _TEXT_FIELDS and isinstance(item, str) and not keep_text and not item.startswith("/"):
+                result[field] = "x" * len(item)
+            else:
+                result[field] = self._walk(item, keep_text, field)
+        return {field: item for field, item in result.items() if item is not None}
+
+
+class UpdateRecorder(BaseMiddleware):
+    """Outer update middleware appending anonymized updates to a JSONL file
+
+    Each line holds the arrival time, processing time and error of one
+    update next to the anonymized update itself. Lines are written in
+    batches from a worker thread (see write_buffer.py), so recording does
+    not block handlers on disk I/O. tools/replay.py plays such files back.
+    """
+
+    def __init__(self, path: str, keep_ids: Iterable[int] = (), flush_interval_ms: int = 1000,
+                 max_pending: int = 10000):
+        self.path = path
+        self.keep_ids = list(keep_ids)
+        self.anonymizer = Anonymizer(keep_ids)
+        self._buffer = WriteBehindBuffer(
+            self._write_lines,
+            flush_rows=500,
+            flush_interval_ms=flush_interval_ms,
+            max_pending=max_pending
+        )
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        arrived = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            try:
+                record = {
+                    "ts": round(arrived, 6),
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                    "error": error,
+                    "update": self.anonymizer.anonymize(event.model_dump(mode="json", by_alias=True, exclude_none=True)),
+                }
+                await self._buffer.put(json.dumps(record, ensure_ascii=False))
+            except Exception as e:
+                logger.error(f"Failed to record update {event.update_id}: {e}")
+
+    def _append(self, lines: List[str]):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", encoding="utf-8") as f:
+            if new_file:
+                header = {"recording": {"version": RECORDING_VERSION, "keep_ids": self.keep_ids}}
+                f.write(json.dumps(header) + "\n")
+            f.write("\n".join(lines) + "\n")
+
+    async def _write_lines(self, lines: List[str]):
+        await asyncio.to_thread(self._append, lines)
+
+    async def close(self):
+        await self._buffer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._buffer.stats()
@@ -0,0 +1,96 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Union
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters import Filter
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery
+
+from callback_codec import CallbackAction, CallbackDataError, decode_callback
+from config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Route:
+    handler: CallableObject
+    admin: bool
+    state: Optional[str]
+    args: int
+
+    @property
+    def name(self) -> str:
+        return self.handler.callback.__name__
+
+
+class _RouteFilter(Filter):
+    """Matches callback queries whose action is in the table and passes the route on"""
+
+    def __init__(self, routes: "CallbackRoutes"):
+        self.routes = routes
+
+    async def __call__(self, callback: CallbackQuery, raw_state: Optional[str] = None) -> Union[bool, Dict[str, Any]]:
+        if not callback.data:
+            return False
+        try:
+            action = decode_callback(callback.data)
+        except CallbackDataError as e:
+            # Tampered data or buttons signed with an old secret: answered as expired
+            logger.warning(f"Rejected callback data from {callback.from_user.id}: {e}")
+            return {"action": None, "callback_route": None}
+        route = self.routes.table.get(action.name)
+        if route is None:
+            return False
+        if len(action.args) != route.args:
+            # Handlers unpack their arguments, so crafted data never reaches them
+            logger.warning(f"Rejected {action.name} callback with {len(action.args)} arguments from {callback.from_user.id}")
+            return {"action": None, "callback_route": None}
+        # The only admin check for this update
+        if route.admin and (callback.message is None or callback.message.chat.id != settings.ADMIN_CHAT_ID):
+            return False
+        if route.state is not None and raw_state != route.state:
+            return False
+        return {"action": action, "callback_route": route}
+
+
+class CallbackRoutes:
+    """Callback query handlers looked up by action name in a dict
+
+    aiogram tries callback handlers one after another, running each
+    handler's filters until one matches, so routing cost grows with the
+    number of handlers. Here a single aiogram handler decodes the callback
+    data once (see callback_codec.py) and finds its handler with one dict
+    lookup; handlers receive the CallbackAction as `action` next to the
+    usual arguments, with exactly the number of arguments the route
+    declares. Data that fails to decode or has another argument count is
+    answered as an expired button.
+    """
+
+    def __init__(self, name: str = "callback_routes"):
+        self.table: Dict[str, Route] = {}
+        self.router = Router(name=name)
+        self.router.callback_query.register(self._dispatch, _RouteFilter(self))
+
+    def route(self, name: str, admin: bool = False, state: Optional[State] = None, args: int = 0) -> Callable:
+        """Register a handler for callback data encoded with encode_callback(name, *args), len(args) == args"""
+        def decorator(handler: Callable) -> Callable:
+            if name in self.table:
+                raise ValueError(f"Callback action {name!r} is already routed to {self.table[name].name}")
+            self.table[name] = Route(CallableObject(handler), admin, state.state if state else None, args)
+            return handler
+        return decorator
+
+    @staticmethod
+    async def _dispatch(callback: CallbackQuery, callback_route: Optional[Route], **kwargs) -> Any:
+        if callback_route is None:
+            await callback.answer("⚠️ Bu tugma eskirgan, menyudan qaytadan tanlang", show_alert=True)
+            return None
+        return await callback_route.handler.call(callback, callback_route=callback_route, **kwargs)
+
+
+# Global table; handler modules register into it at import time
+callback_routes = CallbackRoutes()
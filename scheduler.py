@@ -0,0 +1,116 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from metrics import SCHEDULER_ACTIVE_CHATS, SCHEDULER_QUEUED, SCHEDULER_WAIT
+
+
+class _ChatQueue:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        # asyncio.Lock wakes waiters in arrival order, which keeps the chat's updates in order
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class ChatScheduler(BaseMiddleware):
+    """Outer update middleware: one update per chat at a time, bounded overall
+
+    Updates of the same chat wait in arrival order for the previous one to
+    finish, so handlers doing read-modify-write on FSM data never
+    interleave. A chat takes one of max_concurrency global slots only once
+    it is its turn, so a busy chat cannot hold slots other chats need. The
+    queue of a chat is dropped as soon as it has nothing pending.
+    """
+
+    def __init__(self, max_concurrency: int = 100):
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._chats: Dict[int, _ChatQueue] = {}
+        self._waiting = 0
+        self._running = 0
+        self._stats = {"processed": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+    @staticmethod
+    def _chat_id(event: Update) -> Optional[int]:
+        for item in (event.message, event.edited_message, event.callback_query, event.my_chat_member):
+            if item is None:
+                continue
+            message = getattr(item, "message", None)
+            chat = getattr(item, "chat", None) or (message.chat if message else None)
+            if chat is not None:
+                return chat.id
+            return item.from_user.id
+        return None
+
+    async def _run(self, handler, event: Update, data: Dict[str, Any], started: float) -> Any:
+        self._waiting += 1
+        SCHEDULER_QUEUED.inc()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+            SCHEDULER_QUEUED.dec()
+        try:
+            waited = time.perf_counter() - started
+            SCHEDULER_WAIT.observe(waited)
+            self._stats["processed"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+            self._running += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self._running -= 1
+        finally:
+            self._semaphore.release()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        chat_id = self._chat_id(event)
+        if chat_id is None:
+            return await self._run(handler, event, data, started)
+
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = _ChatQueue()
+            SCHEDULER_ACTIVE_CHATS.inc()
+        queue.pending += 1
+        # Waiting for the chat's turn counts as queued, like waiting for a slot
+        self._waiting += 1
+        SCHEDULER_QUEUED.inc()
+        waiting = True
+        try:
+            async with queue.lock:
+                waiting = False
+                self._waiting -= 1
+                SCHEDULER_QUEUED.dec()
+                return await self._run(handler, event, data, started)
+        finally:
+            if waiting:
+                self._waiting -= 1
+                SCHEDULER_QUEUED.dec()
+            queue.pending -= 1
+            if queue.pending == 0:
+                del self._chats[chat_id]
+                SCHEDULER_ACTIVE_CHATS.dec()
+
+    def stats(self) -> Dict[str, Any]:
+        processed = self._stats["processed"]
+        return {
+            **self._stats,
+            "wait_seconds_avg": self._stats["wait_seconds_total"] / processed if processed else 0.0,
+            "running": self._running,
+            "queued": self._waiting,
+            "active_chats": len(self._chats),
+            "longest_chat_queue": max((queue.pending for queue in self._chats.values()), default=0),
+        }
@@ -0,0 +1,82 @@
+import asyncio
+import os
+
+import pytest
+
+# Settings are read on import; the export only needs them to exist
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("ADMIN_CHAT_ID", "1")
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from database import Database  # noqa: E402
+from export import SESSION_COLUMNS, RESPONSE_COLUMNS, ResultExporter, parse_since  # noqa: E402
+
+COMPLETED_AT = ["2026-01-01 09:00:00", "2026-01-01 10:00:00", "2026-01-01 11:00:00"]
+
+
+async def _seed(database: Database):
+    await database.init_db()
+    await database.add_user(10, "+998900000010", "Ali", None, "ali")
+    category_id = await database.create_category("Test")
+    question_id = await database.create_question(category_id, "Savol")
+    answer_id = await database.create_answer(question_id, "Ha", 3)
+    for completed_at in COMPLETED_AT:
+        session_id = await database.create_test_session(10, category_id)
+        await database.save_user_response(10, category_id, question_id, answer_id, 3, session_id)
+        await database.complete_test_session(session_id, 3)
+        async with database._write() as conn:
+            await conn.execute(
+                "UPDATE test_sessions SET completed_at = ? WHERE id = ?", (completed_at, session_id)
+            )
+
+
+async def _export(path: str, fmt: str, since=None, with_responses=False) -> bytes:
+    database = Database(path)
+    try:
+        await _seed(database)
+        # One session per chunk, so the file is streamed in several pieces
+        exporter = ResultExporter(database, chunk_size=1)
+        return b"".join([piece async for piece in exporter.stream(fmt, since, with_responses)])
+    finally:
+        await database.close()
+
+
+def test_parquet_stream_reads_back(tmp_path):
+    data = asyncio.run(_export(str(tmp_path / "bot.db"), "parquet", with_responses=True))
+
+    table = pq.read_table(pa.BufferReader(data))
+
+    assert table.column_names == SESSION_COLUMNS + RESPONSE_COLUMNS
+    assert table.column("completed_at").to_pylist() == COMPLETED_AT
+    assert table.column("answer_text").to_pylist() == ["Ha"] * 3
+
+
+def test_arrow_stream_reads_back(tmp_path):
+    data = asyncio.run(_export(str(tmp_path / "bot.db"), "arrow"))
+
+    table = pa.ipc.open_stream(data).read_all()
+
+    assert table.column_names == SESSION_COLUMNS
+    assert table.num_rows == 3
+
+
+def test_since_filters_in_utc(tmp_path):
+    # 15:00 in Tashkent (UTC+5) is 10:00 UTC
+    since = parse_since("2026-01-01T15:00:00+05:00")
+    data = asyncio.run(_export(str(tmp_path / "bot.db"), "parquet", since=since))
+
+    table = pq.read_table(pa.BufferReader(data))
+
+    assert since == "2026-01-01 10:00:00"
+    assert table.column("completed_at").to_pylist() == COMPLETED_AT[1:]
+
+
+def test_parse_since():
+    assert parse_since("2026-01-01") == "2026-01-01 00:00:00"
+    assert parse_since("2026-01-01T10:30:00") == "2026-01-01 10:30:00"
+    assert parse_since("2026-01-01T10:30:00Z") == "2026-01-01 10:30:00"
+    assert parse_since("2026-01-01T01:00:00-03:00") == "2026-01-01 04:00:00"
+    with pytest.raises(ValueError):
+        parse_since("yesterday")
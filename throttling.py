@@ -0,0 +1,111 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from metrics import UPDATES_DROPPED
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Per-chat buckets kept before idle (full) ones are dropped
+MAX_CHAT_BUCKETS = 10000
+
+
+class FloodControlMiddleware(BaseMiddleware):
+    """Outer update middleware dropping duplicate taps and floods per chat
+
+    A callback query with the same (chat_id, message_id, callback_data) as
+    one seen in the last dedup_ttl seconds is a double tap: it is answered
+    (so the client stops its spinner) and not processed. Repeated commands
+    such as /start are deduplicated the same way by their text. Each chat
+    also has a token bucket of rate updates per second with the given
+    burst; updates beyond it are dropped, callbacks with a short notice.
+    """
+
+    def __init__(self, rate: float = 2.0, burst: int = 8, dedup_ttl: float = 2.0,
+                 max_dedup_keys: int = 50000):
+        self.rate = rate
+        self.burst = burst
+        self.dedup_ttl = dedup_ttl
+        self.max_dedup_keys = max_dedup_keys
+        self._buckets: Dict[int, TokenBucket] = {}
+        # Same TTL for every key, so insertion order is expiry order
+        self._seen: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._stats = {"passed": 0, "duplicates": 0, "flooded": 0}
+
+    @staticmethod
+    def _chat_id(event: Update) -> Optional[int]:
+        if event.message:
+            return event.message.chat.id
+        if event.callback_query:
+            callback = event.callback_query
+            return callback.message.chat.id if callback.message else callback.from_user.id
+        return None
+
+    def _dedup_key(self, event: Update, chat_id: int) -> Optional[Hashable]:
+        callback = event.callback_query
+        if callback is not None:
+            message_id = callback.message.message_id if callback.message else callback.inline_message_id
+            return chat_id, message_id, callback.data
+        text = event.message.text if event.message else None
+        if text and text.startswith("/"):
+            return chat_id, text
+        return None
+
+    def _is_duplicate(self, key: Hashable) -> bool:
+        now = time.monotonic()
+        while self._seen:
+            oldest, expires = next(iter(self._seen.items()))
+            if expires > now and len(self._seen) < self.max_dedup_keys:
+                break
+            del self._seen[oldest]
+        if key in self._seen:
+            return True
+        self._seen[key] = now + self.dedup_ttl
+        return False
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_CHAT_BUCKETS:
+                self._buckets = {key: value for key, value in self._buckets.items() if not value.is_idle()}
+            bucket = self._buckets[chat_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def _drop(self, event: Update, data: Dict[str, Any], reason: str, notice: Optional[str] = None):
+        self._stats[reason] += 1
+        UPDATES_DROPPED.labels(reason).inc()
+        if event.callback_query:
+            try:
+                await data["bot"].answer_callback_query(event.callback_query.id, text=notice)
+            except Exception as e:
+                logger.debug(f"Failed to answer dropped callback: {e}")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        chat_id = self._chat_id(event)
+        if chat_id is None:
+            return await handler(event, data)
+
+        key = self._dedup_key(event, chat_id)
+        if key is not None and self._is_duplicate(key):
+            await self._drop(event, data, "duplicates")
+            return None
+
+        if not self._bucket(chat_id).try_take():
+            await self._drop(event, data, "flooded", "⏳ Iltimos, biroz sekinroq")
+            return None
+
+        self._stats["passed"] += 1
+        return await handler(event, data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "dedup_keys": len(self._seen), "chat_buckets": len(self._buckets)}
@@ -0,0 +1 @@
+# Maintenance, load-test and benchmark tools (run as `python -m tools.<name>`)
@@ -0,0 +1,63 @@
+"""Encode/decode cost of callback data: the signed codec vs the legacy strings
+
+Usage: python -m tools.bench_codec --iterations 200000
+
+Every answer tap decodes one callback and every question shown encodes
+one per answer button, so both sides are on the hot path. Reported per
+operation for typical answer data with small and large ids, with the
+codec's LRU cache (the usual case: all users see the same buttons) and
+without it (first use of a button).
+"""
+import argparse
+import os
+import time
+from typing import Callable
+
+
+def per_call_ns(func: Callable[[], object], iterations: int) -> float:
+    for _ in range(min(iterations, 1000)):
+        func()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    # The codec derives its key from settings; any token will do here
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+    os.environ.setdefault("ADMIN_CHAT_ID", "1")
+    from callback_codec import decode_callback, decode_signed, encode_callback, parse_legacy
+
+    print(f"{'case':<32}{'bytes':>6}{'encode ns':>12}{'decode ns':>12}")
+    for label, question_id, answer_id, value in (
+        ("small ids", 12, 48, 3),
+        ("large ids", 2_000_000_123, 9_000_000_456, 3),
+    ):
+        encoded = encode_callback("answer", question_id, answer_id)
+        legacy = f"answer_{question_id}_{answer_id}_{value}"
+        assert decode_callback(encoded).args == (question_id, answer_id)
+        rows = (
+            ("codec " + label, encoded,
+             lambda: encode_callback("answer", question_id, answer_id),
+             lambda: decode_callback(encoded)),
+            ("codec uncached " + label, encoded,
+             lambda: encode_callback.__wrapped__("answer", question_id, answer_id),
+             lambda: decode_signed.__wrapped__(encoded)),
+            ("legacy " + label, legacy,
+             lambda: f"answer_{question_id}_{answer_id}_{value}",
+             lambda: parse_legacy(legacy)),
+        )
+        for name, data, encode, decode in rows:
+            print(
+                f"{name:<32}{len(data):>6}"
+                f"{per_call_ns(encode, args.iterations):>12.0f}{per_call_ns(decode, args.iterations):>12.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
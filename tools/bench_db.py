@@ -0,0 +1,424 @@
+"""Time every Database method cold and warm on a generated database
+
+Usage:
+    python -m tools.gen_data bench.db
+    python -m tools.bench_db bench.db --output baseline.json
+    python -m tools.bench_db bench.db --baseline tools/bench_db_baseline.json
+
+tools/bench_db_baseline.json is a reference run on tools.gen_data's
+default data set; compare against it on the same machine only, or make
+a fresh baseline there first.
+
+Each strategy runs on its own copy of the file, so write methods never
+touch the source. For every method a fresh Database is opened; the first
+call is reported as cold (empty SQLite page cache, the OS file cache is
+not dropped) and the following --iterations calls as warm. With
+--baseline the warm p50 of every method is compared and the exit status
+is 1 when one regressed by more than --threshold.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Absolute slack below which a slower warm p50 is not called a regression
+MIN_REGRESSION_MS = 0.05
+
+
+class Sample:
+    """Ids picked from the generated data for method arguments"""
+
+    def __init__(self, path: str, seed: int):
+        self.rng = random.Random(seed)
+        conn = sqlite3.connect(path)
+        try:
+            self.users = [row[0] for row in conn.execute("SELECT chat_id FROM users ORDER BY random() LIMIT 1000")]
+            # The user with the longest history is the worst case for history reads
+            self.heavy_user = conn.execute("""
+                SELECT user_chat_id FROM test_sessions WHERE completed = 1
+                GROUP BY user_chat_id ORDER BY COUNT(*) DESC LIMIT 1
+            """).fetchone()[0]
+            self.categories = [row[0] for row in conn.execute("SELECT id FROM categories")]
+            self.busiest_category = conn.execute("""
+                SELECT category_id FROM test_sessions GROUP BY category_id ORDER BY COUNT(*) DESC LIMIT 1
+            """).fetchone()[0]
+            self.answers = conn.execute("""
+                SELECT q.category_id, q.id, a.id, a.value FROM answers a JOIN questions q ON q.id = a.question_id
+                ORDER BY random() LIMIT 1000
+            """).fetchall()
+            self.max_scores = dict(conn.execute(
+                "SELECT category_id, MAX(max_score) FROM category_responses GROUP BY category_id"
+            ).fetchall())
+            self.sessions = [row[0] for row in conn.execute(
+                "SELECT id FROM test_sessions WHERE completed = 1 ORDER BY id DESC LIMIT 1000"
+            )]
+            self.pending_exports = [row[0] for row in conn.execute(
+                "SELECT id FROM export_outbox WHERE delivered_at IS NULL LIMIT 1000"
+            )]
+            self.fsm_keys = [row[0] for row in conn.execute("SELECT key FROM fsm_storage LIMIT 1000")]
+        finally:
+            conn.close()
+        self._counter = 0
+
+    def unique(self) -> int:
+        self._counter += 1
+        return self._counter
+
+    def user(self) -> int:
+        return self.rng.choice(self.users)
+
+    def category(self) -> int:
+        return self.rng.choice(self.categories)
+
+    def answer(self):
+        return self.rng.choice(self.answers)
+
+
+# A case builds the arguments of one call; the setup runs outside the timing
+Setup = Callable[[Any, Sample], Awaitable[tuple]]
+
+
+class Case(NamedTuple):
+    method: str
+    setup: Setup
+    iterations: Optional[int] = None  # Overrides --iterations for heavy methods
+
+
+def _args(*factories):
+    async def setup(db, sample: Sample) -> tuple:
+        return tuple(factory(sample) if callable(factory) else factory for factory in factories)
+    return setup
+
+
+async def _created_session(db, sample: Sample) -> tuple:
+    session_id = await db.create_test_session(sample.user(), sample.category())
+    return session_id, sample.rng.randint(0, 40)
+
+
+async def _response_args(db, sample: Sample) -> tuple:
+    category_id, question_id, answer_id, value = sample.answer()
+    return sample.user(), category_id, question_id, answer_id, value, sample.rng.choice(sample.sessions)
+
+
+async def _queued_responses(db, sample: Sample) -> tuple:
+    for _ in range(50):
+        await db.save_user_response(*await _response_args(db, sample))
+    return ()
+
+
+async def _new_category(db, sample: Sample) -> tuple:
+    return (await db.create_category(f"Bench {sample.unique()}"),)
+
+
+async def _new_question(db, sample: Sample) -> tuple:
+    return (await db.create_question(sample.category(), f"Bench {sample.unique()}"),)
+
+
+async def _new_answer(db, sample: Sample) -> tuple:
+    _, question_id, _, _ = sample.answer()
+    return (await db.create_answer(question_id, f"Bench {sample.unique()}", 0),)
+
+
+async def _new_band(db, sample: Sample) -> tuple:
+    return (await db.create_category_response(sample.category(), 1000, 1001, "Bench", "Bench"),)
+
+
+async def _saved_media(db, sample: Sample) -> tuple:
+    content_hash = f"bench-{sample.unique()}"
+    await db.save_media_file_id(content_hash, "file-id")
+    return (content_hash,)
+
+
+async def _saved_fsm(db, sample: Sample) -> tuple:
+    key = f"1:{sample.unique()}:0:None:bench"
+    await db.save_fsm_record(key, "Bench:state", None, time.time())
+    return (key,)
+
+
+def _broadcast_args(*factories):
+    """Arguments after the id of a freshly created running broadcast"""
+    async def setup(db, sample: Sample) -> tuple:
+        broadcast_id = await db.create_broadcast("Bench broadcast", 1)
+        return (broadcast_id,) + await _args(*factories)(db, sample)
+    return setup
+
+
+def _pending_exports(sample: Sample) -> List[int]:
+    return sample.rng.sample(sample.pending_exports, min(100, len(sample.pending_exports)))
+
+
+
+async def _failed_exports(db, sample: Sample) -> tuple:
+    export_ids = _pending_exports(sample)
+    return export_ids, "Bench error", {export_id: 60.0 for export_id in export_ids}
+
+
+CASES: List[Case] = [
+    # Users
+    Case("add_user", _args(Sample.user, "+998900000000", "Bench", None, "bench")),
+    Case("get_user", _args(Sample.user)),
+    # Catalog reads (served from the in-memory snapshot)
+    Case("get_all_categories", _args()),
+    Case("get_category", _args(Sample.category)),
+    Case("get_questions_by_category", _args(Sample.category)),
+    Case("get_question", _args(lambda s: s.answer()[1])),
+    Case("get_test_snapshot", _args(Sample.category)),
+    Case("get_answers_by_question", _args(lambda s: s.answer()[1])),
+    Case("get_category_responses", _args(Sample.category)),
+    Case("get_response_for_score", _args(
+        lambda s: s.busiest_category, lambda s: s.rng.randint(0, s.max_scores.get(s.busiest_category, 0))
+    )),
+    Case("check_score_range", _args(Sample.category, 0, 10)),
+    Case("get_catalog_version", _args()),
+    # Catalog writes (each rebuilds the snapshot)
+    Case("create_category", _args("Bench category", None)),
+    Case("create_question", _args(Sample.category, "Bench question", 0)),
+    Case("create_answer", _args(lambda s: s.answer()[1], "Bench answer", 1)),
+    Case("create_category_response", _args(Sample.category, 1000, 1001, "Bench", "Bench")),
+    Case("delete_category", _new_category),
+    Case("delete_question", _new_question),
+    Case("delete_answer", _new_answer),
+    Case("delete_category_response", _new_band),
+    # Test sessions and responses
+    Case("create_test_session", _args(Sample.user, Sample.category)),
+    Case("save_user_response", _response_args),
+    Case("flush_user_responses", _queued_responses),
+    Case("complete_test_session", _created_session),
+    Case("get_user_test_history", _args(lambda s: s.heavy_user)),
+    # Analytics, export and statistics
+    Case("count_user_responses", _args(lambda s: s.busiest_category)),
+    Case("iter_user_responses", _args(lambda s: s.busiest_category), iterations=3),
+    Case("iter_completed_sessions", _args(
+        lambda s: time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - 86400))
+    )),
+    Case("get_session_responses", _args(lambda s: s.rng.sample(s.sessions, min(100, len(s.sessions))))),
+    Case("get_stats_summary", _args(), iterations=5),
+    Case("get_score_rollups", _args(
+        Sample.category, lambda s: time.strftime('%Y-%m-%d %H:00:00', time.gmtime(time.time() - 7 * 86400))
+    )),
+    Case("rebuild_score_rollups", _args(), iterations=1),
+    # Export outbox
+    Case("claim_due_exports", _args(100, 300.0)),
+    Case("mark_exports_failed", _failed_exports),
+    Case("mark_exports_delivered", _args(_pending_exports)),
+    Case("purge_delivered_exports", _args(7 * 86400)),
+    Case("get_outbox_stats", _args()),
+    # Broadcasts
+    Case("clear_user_blocked", _args(Sample.user)),
+    Case("create_broadcast", _args("Bench broadcast", 1)),
+    Case("get_broadcast", _broadcast_args()),
+    Case("get_running_broadcasts", _args()),
+    Case("set_broadcast_status_message", _broadcast_args(1)),
+    Case("get_broadcast_recipients", _args(lambda s: s.rng.choice(s.users), 200)),
+    Case("claim_broadcast", _broadcast_args("bench", 120.0)),
+    Case("release_broadcast", _broadcast_args("bench")),
+    Case("save_broadcast_progress", _broadcast_args(
+        Sample.user, 195, 3, lambda s: s.rng.sample(s.users, 2)
+    )),
+    Case("finish_broadcast", _broadcast_args("done")),
+    # Media cache and FSM storage
+    Case("get_media_file_id", _args("bench-missing")),
+    Case("save_media_file_id", _args(lambda s: f"bench-{s.unique()}", "file-id")),
+    Case("delete_media_file_id", _saved_media),
+    Case("get_fsm_record", _args(lambda s: s.rng.choice(s.fsm_keys), 0.0)),
+    Case("save_fsm_record", _args(
+        lambda s: s.rng.choice(s.fsm_keys), "Bench:state", '{"bench": 1}', lambda s: time.time()
+    )),
+    Case("queue_fsm_record", _args(
+        lambda s: s.rng.choice(s.fsm_keys), "Bench:state", '{"bench": 1}', lambda s: time.time()
+    )),
+    Case("delete_fsm_record", _saved_fsm),
+    Case("purge_fsm_records", _args(lambda s: time.time() - 86400)),
+]
+
+
+def _strategies():
+    from database import Database
+
+    class ConnectPerCallDatabase(Database):
+        """Reads open and close their own connection, as before the pool existed"""
+
+        @asynccontextmanager
+        async def _read(self):
+            conn = await self._connect()
+            try:
+                yield conn
+            finally:
+                await conn.close()
+
+    return {
+        "pooled": lambda path: Database(path),
+        "single_reader": lambda path: Database(path, read_pool_size=1),
+        "connect_per_call": lambda path: ConnectPerCallDatabase(path),
+    }
+
+
+async def _call(db, case: Case, args: tuple) -> float:
+    method = getattr(db, case.method)
+    started = time.perf_counter()
+    if case.method.startswith("iter_"):
+        async for _ in method(*args):
+            pass
+    else:
+        await method(*args)
+    return time.perf_counter() - started
+
+
+def _summary(cold: float, warm: List[float]) -> Dict[str, Any]:
+    result = {"cold_ms": round(cold * 1000, 4)}
+    if warm:
+        ms = np.array(warm) * 1000
+        p50, p95 = np.percentile(ms, [50, 95])
+        result.update({
+            "warm_p50_ms": round(float(p50), 4),
+            "warm_p95_ms": round(float(p95), 4),
+            "warm_mean_ms": round(float(ms.mean()), 4),
+            "warm_min_ms": round(float(ms.min()), 4),
+            "iterations": len(warm),
+        })
+    return result
+
+
+async def bench_strategy(factory, path: str, cases: List[Case], iterations: int, seed: int) -> Dict[str, Any]:
+    sample = Sample(path, seed)
+    results: Dict[str, Any] = {}
+    startup = []
+    for case in cases:
+        db = factory(path)
+        started = time.perf_counter()
+        await db.init_db()
+        startup.append(time.perf_counter() - started)
+        try:
+            cold = await _call(db, case, await case.setup(db, sample))
+            warm = []
+            for _ in range(case.iterations or iterations):
+                warm.append(await _call(db, case, await case.setup(db, sample)))
+            results[case.method] = _summary(cold, warm)
+        except Exception as e:
+            logger.error(f"{case.method} failed: {e}")
+            results[case.method] = {"error": str(e)}
+        finally:
+            await db.close()
+    results["init_db"] = _summary(startup[0], startup[1:])
+    return results
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Methods whose warm p50 is more than threshold times the baseline's"""
+    regressions = []
+    for strategy, methods in current["results"].items():
+        for method, result in methods.items():
+            old = baseline.get("results", {}).get(strategy, {}).get(method, {})
+            new_p50 = result.get("warm_p50_ms")
+            old_p50 = old.get("warm_p50_ms")
+            if new_p50 is None or old_p50 is None:
+                continue
+            if new_p50 > old_p50 * threshold and new_p50 - old_p50 > MIN_REGRESSION_MS:
+                regressions.append(
+                    f"{strategy}.{method}: warm p50 {old_p50} ms -> {new_p50} ms ({new_p50 / old_p50:.2f}x)"
+                )
+    return regressions
+
+
+def _row_counts(path: str) -> Dict[str, int]:
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("categories", "questions", "answers", "users", "test_sessions", "user_responses")
+        }
+    finally:
+        conn.close()
+
+
+async def run(args) -> Dict[str, Any]:
+    strategies = _strategies()
+    selected = args.strategies.split(",") if args.strategies else list(strategies)
+    methods = set(args.methods.split(",")) if args.methods else None
+    cases = [case for case in CASES if methods is None or case.method in methods]
+    if methods is None:
+        from database import Database
+
+        covered = {case.method for case in CASES} | {"open", "close", "init_db"}
+        missing = sorted(
+            name for name, member in vars(Database).items()
+            if not name.startswith("_") and asyncio.iscoroutinefunction(member) and name not in covered
+        )
+        if missing:
+            logger.warning(f"Database methods without a benchmark case: {', '.join(missing)}")
+
+    report = {
+        "meta": {
+            "database": os.path.abspath(args.path),
+            "rows": _row_counts(args.path),
+            "iterations": args.iterations,
+            "seed": args.seed,
+            "sqlite": sqlite3.sqlite_version,
+            "python": platform.python_version(),
+            "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in selected:
+            copy = os.path.join(tmp, f"{name}.db")
+            shutil.copyfile(args.path, copy)
+            logger.info(f"Benchmarking {name} on a copy of {args.path}")
+            report["results"][name] = await bench_strategy(
+                strategies[name], copy, cases, args.iterations, args.seed
+            )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="database created by tools.gen_data")
+    parser.add_argument("--iterations", type=int, default=50, help="warm calls per method")
+    parser.add_argument("--strategies", help="comma-separated subset of pooled,single_reader,connect_per_call")
+    parser.add_argument("--methods", help="comma-separated subset of Database methods")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON report to compare warm p50 timings against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="allowed slowdown ratio")
+    parser.add_argument("--verbose", action="store_true", help="keep INFO logging from the database")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+    os.environ.setdefault("ADMIN_CHAT_ID", "1")
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
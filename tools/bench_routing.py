@@ -0,0 +1,137 @@
+"""Per-update callback routing cost: chained aiogram filters vs the routing table
+
+Usage: python -m tools.bench_routing --handlers 10 50 200 1000 --updates 5000
+
+For each handler count two dispatchers are built with that many no-op
+callback handlers. "filters" registers them the way aiogram routers are
+usually written (F.data.startswith plus an admin filter on half of them),
+"table" registers them in a routing.CallbackRoutes. Callback updates with
+random actions are then fed through dp.feed_update and the mean time per
+update is reported. With filters the cost grows with the number of
+handlers in front of the matching one; with the table it stays flat.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.filters import BaseFilter
+from aiogram.types import Update
+
+from tools.fake_telegram import FakeTelegramSession
+
+ADMIN_CHAT_ID = 1
+USER_CHAT_ID = 2
+
+
+class _IsAdmin(BaseFilter):
+    async def __call__(self, event) -> bool:
+        return event.message.chat.id == ADMIN_CHAT_ID
+
+
+async def _noop(callback):
+    return None
+
+
+def filter_dispatcher(handlers: int) -> Dispatcher:
+    dp = Dispatcher()
+    router = Router()
+    for i in range(handlers):
+        filters = [F.data.startswith(f"action{i}_")]
+        if i % 2:
+            filters.append(_IsAdmin())
+        router.callback_query.register(_noop, *filters)
+    dp.include_router(router)
+    return dp
+
+
+def table_dispatcher(handlers: int) -> Dispatcher:
+    from routing import CallbackRoutes
+
+    dp = Dispatcher()
+    routes = CallbackRoutes(name=f"bench_{handlers}")
+    for i in range(handlers):
+        routes.route(f"action{i}", admin=bool(i % 2), args=2)(_noop)
+    dp.include_router(routes.router)
+    return dp
+
+
+def make_updates(bot: Bot, handlers: int, count: int, seed: int) -> List[Update]:
+    rng = random.Random(seed)
+    updates = []
+    for update_id in range(count):
+        action = rng.randrange(handlers)
+        # Admin-only actions are pressed by the admin so that every update is handled
+        chat_id = ADMIN_CHAT_ID if action % 2 else USER_CHAT_ID
+        user = {"id": chat_id, "is_bot": False, "first_name": "User"}
+        updates.append(Update.model_validate({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": user,
+                "chat_instance": str(chat_id),
+                "message": {
+                    "message_id": 1,
+                    "date": 0,
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": "x",
+                },
+                "data": f"action{action}_{rng.randrange(1000)}_{rng.randrange(1000)}",
+            }
+        }, context={"bot": bot}))
+    return updates
+
+
+async def measure(dp: Dispatcher, bot: Bot, updates: List[Update], warmup: int) -> float:
+    """Mean microseconds per update"""
+    for update in updates[:warmup]:
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for update in updates:
+        handled = await dp.feed_update(bot, update)
+        if handled is not None:
+            raise RuntimeError(f"Update {update.update_id} was not routed")
+    return (time.perf_counter() - started) / len(updates) * 1e6
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=FakeTelegramSession(latency_ms=0, jitter_ms=0))
+    results = []
+    for handlers in args.handlers:
+        updates = make_updates(bot, handlers, args.updates, args.seed)
+        row = {"handlers": handlers}
+        for name, build in (("filters", filter_dispatcher), ("table", table_dispatcher)):
+            row[f"{name}_us"] = round(await measure(build(handlers), bot, updates, args.warmup), 2)
+        results.append(row)
+        print(f"{handlers:>10}{row['filters_us']:>14}{row['table_us']:>12}", flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", type=int, nargs="+", default=[10, 50, 200, 1000])
+    parser.add_argument("--updates", type=int, default=5000, help="updates fed per dispatcher")
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # routing reads settings on import; only the admin id is used
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+    os.environ["ADMIN_CHAT_ID"] = str(ADMIN_CHAT_ID)
+    # The benchmark's made-up actions use the unsigned "<name>_<int>_..." format
+    os.environ["CALLBACK_LEGACY_UNTIL"] = "2999-01-01T00:00:00Z"
+
+    print(f"{'handlers':>10}{'filters µs':>14}{'table µs':>12}")
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
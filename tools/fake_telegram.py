@@ -0,0 +1,98 @@
+"""Offline stand-in for the Telegram Bot API, shared by the load-test and replay tools"""
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response
+from aiogram.types import InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+from callback_codec import decode_callback
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Urolog Bot", "username": "urolog_bot"}
+
+
+class FakeTelegramSession(AiohttpSession):
+    """Answers Bot API calls locally after a simulated network latency
+
+    Nothing is sent over the network. Sent and edited messages are
+    remembered per chat so that simulated users can press the buttons
+    of the last keyboard they were shown.
+    """
+
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 20.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls: Counter = Counter()
+        self.last_message: Dict[int, Dict[str, Any]] = {}
+        self.last_markup: Dict[int, Any] = {}
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        self.calls[method.__api_method__] += 1
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        result = self._result(method)
+        response = Response[method.__returning__].model_validate(
+            {"ok": True, "result": result}, context={"bot": bot}
+        )
+        return response.result
+
+    def _result(self, method: TelegramMethod) -> Any:
+        api_method = method.__api_method__
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method not in ("sendMessage", "sendPhoto", "editMessageText", "editMessageCaption"):
+            # answerCallbackQuery, setWebhook, deleteMessage and the like
+            return True
+
+        chat_id = method.chat_id
+        if api_method.startswith("edit"):
+            message_id = method.message_id
+        else:
+            message_id = next(self._message_ids)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if api_method == "sendPhoto":
+            file_id = f"fake-photo-{next(self._file_ids)}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}]
+            message["caption"] = method.caption
+        else:
+            message["text"] = getattr(method, "text", None) or getattr(method, "caption", None)
+
+        markup = getattr(method, "reply_markup", None)
+        if isinstance(markup, InlineKeyboardMarkup):
+            message["reply_markup"] = markup.model_dump(exclude_none=True)
+        self.last_message[chat_id] = message
+        # An edit without a keyboard removes the previous inline keyboard
+        if isinstance(markup, (InlineKeyboardMarkup, ReplyKeyboardMarkup)) or api_method.startswith("edit"):
+            self.last_markup[chat_id] = markup
+        return message
+
+    def callback_buttons(self, chat_id: int, action: Optional[str] = None) -> list:
+        """callback_data of the inline buttons last shown in a chat, optionally of one action"""
+        markup = self.last_markup.get(chat_id)
+        if not isinstance(markup, InlineKeyboardMarkup):
+            return []
+        return [
+            button.callback_data
+            for row in markup.inline_keyboard
+            for button in row
+            if button.callback_data and (action is None or decode_callback(button.callback_data).name == action)
+        ]
+
+    async def close(self):
+        pass
@@ -0,0 +1,212 @@
+"""Fill a new SQLite file with realistic volumes of synthetic data
+
+Usage: python -m tools.gen_data bench.db --categories 200 --sessions 200000
+
+The schema comes from the regular migrations; rows are bulk-inserted with
+the standard sqlite3 module. Users and categories are skewed so that a few
+heavy users and popular categories hold most of the history, and answers
+of a session are correlated like real questionnaires.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+BATCH_SESSIONS = 10000
+
+
+async def create_schema(path: str):
+    """Create tables and indexes through the regular migrations"""
+    from database import Database
+
+    database = Database(path)
+    await database.init_db()
+    await database.close()
+
+
+async def rebuild_rollups(path: str) -> int:
+    from database import Database
+
+    database = Database(path)
+    await database.init_db()
+    try:
+        return await database.rebuild_score_rollups()
+    finally:
+        await database.close()
+
+
+def _timestamp(moment: datetime) -> str:
+    return moment.strftime(TIME_FORMAT)
+
+
+def generate(path: str, args):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(path)
+    # Bulk load only: the file is thrown away if generation fails
+    conn.execute("PRAGMA synchronous=OFF")
+
+    # Catalog with explicit ids so sessions can reference it directly
+    questions = {}  # category_id -> [(question_id, [(answer_id, value), ...]), ...]
+    question_id = answer_id = 0
+    with conn:
+        for category_id in range(1, args.categories + 1):
+            conn.execute(
+                "INSERT INTO categories (id, name, description) VALUES (?, ?, ?)",
+                (category_id, f"Test {category_id}", f"Synthetic category {category_id}")
+            )
+            count = max(1, int(rng.gauss(args.questions, args.questions / 4)))
+            questions[category_id] = []
+            for order in range(count):
+                question_id += 1
+                conn.execute(
+                    "INSERT INTO questions (id, category_id, question_text, order_num) VALUES (?, ?, ?, ?)",
+                    (question_id, category_id, f"Savol {order + 1} ({category_id})", order)
+                )
+                answers = []
+                for value in range(args.answers):
+                    answer_id += 1
+                    answers.append((answer_id, value))
+                conn.executemany(
+                    "INSERT INTO answers (id, question_id, answer_text, value) VALUES (?, ?, ?, ?)",
+                    [(aid, question_id, f"Javob {value}", value) for aid, value in answers]
+                )
+                questions[category_id].append((question_id, answers))
+
+            # Three score bands covering the whole range
+            max_score = count * (args.answers - 1)
+            step = max_score // 3 + 1
+            conn.executemany("""
+                INSERT INTO category_responses (category_id, min_score, max_score, title, response_text)
+                VALUES (?, ?, ?, ?, ?)
+            """, [
+                (category_id, low, min(low + step - 1, max_score), f"Band {low}", "Synthetic result")
+                for low in range(0, max_score + 1, step)
+            ])
+    logger.info(f"Catalog: {args.categories} categories, {question_id} questions, {answer_id} answers")
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (chat_id, phone_number, first_name, last_name, username, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (chat_id, f"+99890{chat_id:07d}", f"User{chat_id}", None, f"user{chat_id}",
+                 _timestamp(now - timedelta(days=rng.uniform(0, args.days))))
+                for chat_id in range(1, args.users + 1)
+            )
+        )
+    logger.info(f"Users: {args.users}")
+
+    responses = 0
+    session_id = 0
+    while session_id < args.sessions:
+        batch = min(BATCH_SESSIONS, args.sessions - session_id)
+        session_rows = []
+        response_rows = []
+        for _ in range(batch):
+            session_id += 1
+            # Skewed: low chat ids and category ids get most of the traffic
+            chat_id = int(args.users * rng.random() ** 3) + 1
+            category_id = int(args.categories * rng.random() ** 2) + 1
+            created = now - timedelta(days=rng.uniform(0, args.days))
+            completed = rng.random() < args.completion_rate
+            items = questions[category_id]
+            answered = items if completed else items[:rng.randrange(len(items))]
+            trait = rng.random() * (args.answers - 1)
+
+            score = 0
+            for qid, answers in answered:
+                value = min(args.answers - 1, max(0, round(trait + rng.gauss(0, 0.8))))
+                aid = answers[value][0]
+                score += value
+                response_rows.append((chat_id, category_id, qid, aid, value, session_id, _timestamp(created)))
+
+            completed_at = _timestamp(created + timedelta(seconds=rng.uniform(30, 600))) if completed else None
+            session_rows.append((
+                session_id, chat_id, category_id, score if completed else 0,
+                int(completed), _timestamp(created), completed_at
+            ))
+
+        with conn:
+            conn.executemany("""
+                INSERT INTO test_sessions (id, user_chat_id, category_id, total_score, completed, created_at, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, session_rows)
+            conn.executemany("""
+                INSERT INTO user_responses (user_chat_id, category_id, question_id, answer_id, value, session_id, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, response_rows)
+        responses += len(response_rows)
+        logger.info(f"Sessions: {session_id}/{args.sessions}, responses: {responses}")
+
+    # Some export and FSM state so that the outbox and storage queries have data
+    epoch = time.time()
+    with conn:
+        conn.executemany("""
+            INSERT INTO export_outbox (session_id, payload, attempts, next_attempt_at, created_at, delivered_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (
+            (sid, '["User", "+998900000000", 10, "user"]', 1, epoch - 60, epoch - 3600,
+             None if sid % 10 == 0 else epoch - 1800)
+            for sid in range(1, min(args.sessions, 20000) + 1)
+        ))
+        conn.executemany(
+            "INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+            (
+                (f"1:{chat_id}:{chat_id}:None:default", "TestStates:taking_test",
+                 '{"current_question_index": 3, "total_score": 5}', epoch - rng.uniform(0, 2 * 86400))
+                for chat_id in range(1, min(args.users, args.fsm_records) + 1)
+            )
+        )
+
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="SQLite file to create")
+    parser.add_argument("--categories", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=20, help="average questions per category")
+    parser.add_argument("--answers", type=int, default=4, help="answers per question")
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--sessions", type=int, default=200000)
+    parser.add_argument("--completion-rate", type=float, default=0.85)
+    parser.add_argument("--days", type=int, default=365, help="history spread over this many days")
+    parser.add_argument("--fsm-records", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--force", action="store_true", help="overwrite an existing file")
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        if not args.force:
+            parser.error(f"{args.path} exists; pass --force to overwrite it")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+
+    # Database reads settings on import; only the path given here is used
+    os.environ.setdefault("BOT_TOKEN", "123456:GENDATA")
+    os.environ.setdefault("ADMIN_CHAT_ID", "1")
+
+    started = time.perf_counter()
+    asyncio.run(create_schema(args.path))
+    responses = generate(args.path, args)
+    counted = asyncio.run(rebuild_rollups(args.path))
+    logger.info(
+        f"Generated {args.sessions} sessions ({counted} completed) and {responses} responses "
+        f"in {time.perf_counter() - started:.1f}s: {args.path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
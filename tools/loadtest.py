@@ -0,0 +1,252 @@
+"""Offline load test: virtual users take tests through the real dispatcher
+
+Usage: python -m tools.loadtest --users 2000 --concurrency 200 --latency-ms 50
+
+Each virtual user sends /start, shares a contact, picks a category, starts
+the test and presses answer buttons until the result is shown. Bot API
+calls are answered by tools.fake_telegram.FakeTelegramSession and the
+database is a fresh temporary SQLite file, so nothing leaves the machine.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List
+
+import numpy as np
+from aiogram import Bot
+from aiogram.types import Update
+
+from metrics import track_db_usage
+from tools.fake_telegram import FakeTelegramSession
+
+STEPS = ("start", "contact", "select_category", "start_test", "answer")
+FIRST_CHAT_ID = 10_000_000
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, Any]:
+    if not seconds:
+        return {"count": 0}
+    ms = np.array(seconds) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": len(seconds),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+class LoadTest:
+    """Drives virtual users through the dispatcher and records per-step timings"""
+
+    def __init__(self, bot: Bot, dispatcher, session: FakeTelegramSession, think_ms: float = 0.0):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.session = session
+        self.think_ms = think_ms
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.db_seconds: Dict[str, List[float]] = defaultdict(list)
+        self.db_calls: Dict[str, List[int]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.completed = 0
+        self._ids = itertools.count(1)
+
+    async def _feed(self, step: str, payload: Dict[str, Any]):
+        payload["update_id"] = next(self._ids)
+        update = Update.model_validate(payload, context={"bot": self.bot})
+        with track_db_usage() as usage:
+            started = time.perf_counter()
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+            except Exception as e:
+                self.errors[f"{step}: {type(e).__name__}: {e}"] += 1
+            finally:
+                self.latencies[step].append(time.perf_counter() - started)
+                self.db_seconds[step].append(usage.seconds)
+                self.db_calls[step].append(usage.calls)
+
+        if self.think_ms:
+            await asyncio.sleep(random.uniform(0, 2 * self.think_ms) / 1000)
+
+    @staticmethod
+    def _user(chat_id: int) -> Dict[str, Any]:
+        return {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"}
+
+    async def _send(self, chat_id: int, step: str, **fields):
+        await self._feed(step, {"message": {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._user(chat_id),
+            **fields
+        }})
+
+    async def _press(self, chat_id: int, step: str, callback_data: str):
+        await self._feed(step, {"callback_query": {
+            "id": str(next(self._ids)),
+            "from": self._user(chat_id),
+            "chat_instance": str(chat_id),
+            "message": self.session.last_message[chat_id],
+            "data": callback_data
+        }})
+
+    async def run_user(self, chat_id: int):
+        await self._send(chat_id, "start", text="/start")
+        await self._send(chat_id, "contact", contact={
+            "phone_number": f"+998{chat_id}", "first_name": f"User {chat_id}", "user_id": chat_id
+        })
+
+        categories = self.session.callback_buttons(chat_id, "select_category")
+        if not categories:
+            self.errors["no category keyboard"] += 1
+            return
+        await self._press(chat_id, "select_category", random.choice(categories))
+
+        start_buttons = self.session.callback_buttons(chat_id, "start_test")
+        if not start_buttons:
+            self.errors["no start button"] += 1
+            return
+        await self._press(chat_id, "start_test", start_buttons[0])
+
+        while True:
+            answers = self.session.callback_buttons(chat_id, "answer")
+            if not answers:
+                break
+            await self._press(chat_id, "answer", random.choice(answers))
+        self.completed += 1
+
+    def report(self, users: int, elapsed: float) -> Dict[str, Any]:
+        all_latencies = [value for step in STEPS for value in self.latencies[step]]
+        all_db = [value for step in STEPS for value in self.db_seconds[step]]
+        return {
+            "users": users,
+            "completed_tests": self.completed,
+            "elapsed_s": round(elapsed, 2),
+            "updates_per_s": round(len(all_latencies) / elapsed, 1) if elapsed else None,
+            "tests_per_s": round(self.completed / elapsed, 1) if elapsed else None,
+            "latency": {"all": latency_summary(all_latencies), **{
+                step: latency_summary(self.latencies[step]) for step in STEPS
+            }},
+            "db_time": {"all": latency_summary(all_db), **{
+                step: latency_summary(self.db_seconds[step]) for step in STEPS
+            }},
+            "db_calls_per_update": {
+                step: round(sum(self.db_calls[step]) / len(self.db_calls[step]), 2)
+                for step in STEPS if self.db_calls[step]
+            },
+            "bot_api_calls": dict(self.session.calls),
+            "errors": dict(self.errors.most_common(10)),
+        }
+
+
+async def seed_catalog(db, categories: int, questions: int, answers: int):
+    """Create test categories with scored answers and result bands"""
+    for c in range(categories):
+        category_id = await db.create_category(f"Test {c + 1}", "Load test category")
+        for q in range(questions):
+            question_id = await db.create_question(category_id, f"Savol {q + 1}", q)
+            for value in range(answers):
+                await db.create_answer(question_id, f"Javob {value}", value)
+        max_score = questions * (answers - 1)
+        middle = max_score // 2
+        await db.create_category_response(category_id, 0, middle, "Past", "Natija past")
+        await db.create_category_response(category_id, middle + 1, max_score, "Yuqori", "Natija yuqori")
+
+
+def print_report(report: Dict[str, Any]):
+    print(
+        f"Users: {report['users']}, completed tests: {report['completed_tests']} "
+        f"in {report['elapsed_s']}s ({report['tests_per_s']} tests/s, "
+        f"{report['updates_per_s']} updates/s)"
+    )
+    for title, key in (("Update latency", "latency"), ("DB time per update", "db_time")):
+        print(f"\n{title} (ms)")
+        print(f"{'step':<16}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+        for step, summary in report[key].items():
+            if summary["count"]:
+                print(
+                    f"{step:<16}{summary['count']:>8}{summary['p50_ms']:>10}"
+                    f"{summary['p95_ms']:>10}{summary['p99_ms']:>10}{summary['max_ms']:>10}"
+                )
+    print(f"\nDB calls per update: {report['db_calls_per_update']}")
+    print(f"Bot API calls: {report['bot_api_calls']}")
+    if report["errors"]:
+        print(f"Errors: {report['errors']}")
+
+
+async def run(args) -> Dict[str, Any]:
+    # Settings are read when these modules are imported, so the
+    # environment has to point at the temporary database first
+    from database import db
+    from fsm_storage import storage
+    from main import get_dispatcher
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    await db.init_db()
+    try:
+        await seed_catalog(db, args.categories, args.questions, args.answers)
+        session = FakeTelegramSession(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+        bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+        test = LoadTest(bot, get_dispatcher(), session, think_ms=args.think_ms)
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def virtual_user(chat_id: int):
+            async with semaphore:
+                await test.run_user(chat_id)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(virtual_user(FIRST_CHAT_ID + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+
+        report = test.report(args.users, elapsed)
+        report["db_pool"] = db.pool_stats()
+        report["response_writer"] = db.response_writer_stats()
+        return report
+    finally:
+        await storage.close()
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="virtual users, each takes one test")
+    parser.add_argument("--concurrency", type=int, default=100, help="users active at the same time")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="simulated Bot API latency")
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--think-ms", type=float, default=0.0, help="average pause between a user's steps")
+    parser.add_argument("--categories", type=int, default=3)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--answers", type=int, default=4)
+    parser.add_argument("--db", help="database file to use instead of a temporary one")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep INFO logging")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_PATH"] = args.db or os.path.join(tmp, "loadtest.db")
+        os.environ.setdefault("BOT_TOKEN", "123456:LOADTEST")
+        os.environ.setdefault("ADMIN_CHAT_ID", "1")
+        # Virtual users tap as fast as the bot answers; keep flood control out of the measurement
+        os.environ.setdefault("FLOOD_RATE_PER_SECOND", "1000")
+        os.environ.setdefault("FLOOD_BURST", "1000")
+        report = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Show or remove the bot's webhook registration
+
+Usage: python -m tools.manage_webhook info
+       python -m tools.manage_webhook delete [--drop-pending]
+
+In webhook mode every worker registers the webhook on startup, but none
+removes it on shutdown: restarting one worker must not cut off the
+others. Run "delete" as a teardown step when switching back to polling
+(getUpdates is refused while a webhook is set) or retiring the deployment.
+"""
+import argparse
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+
+from config import get_settings
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+async def run(args):
+    settings = get_settings()
+    bot = Bot(token=settings.BOT_TOKEN, session=AiohttpSession(proxy=settings.PROXY_URL))
+    try:
+        if args.command == "delete":
+            await bot.delete_webhook(drop_pending_updates=args.drop_pending)
+            logger.info("Webhook removed")
+        info = await bot.get_webhook_info()
+        logger.info(
+            f"Webhook url: {info.url or '-'}, pending updates: {info.pending_update_count}, "
+            f"last error: {info.last_error_message or '-'}"
+        )
+    finally:
+        await bot.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["info", "delete"])
+    parser.add_argument("--drop-pending", action="store_true", help="discard updates Telegram still holds")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""Recompute the hourly score rollups from test_sessions
+
+Usage: python -m tools.rebuild_score_rollups
+"""
+import asyncio
+import logging
+
+from database import db
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    await db.init_db()
+    try:
+        counted = await db.rebuild_score_rollups()
+        logger.info(f"Score rollups rebuilt from {counted} completed sessions")
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,303 @@
+"""Replay recorded updates through the real dispatcher against a fake Bot API
+
+Usage: python -m tools.replay updates.jsonl --speed 10 --db snapshot.db --output new.json
+       python -m tools.replay updates.jsonl --speed 0 --compare new.json
+
+Recordings come from recorder.UpdateRecorder (RECORD_UPDATES_PATH). Updates
+of one chat are fed in their recorded order; different chats run
+concurrently. --speed 1 keeps the original timing, N plays N times faster
+and 0 sends every update as soon as its chat is free.
+
+The database is a copy of --db (a production snapshot keeps categories and
+FSM state meaningful) or an empty temporary file. Flows that started before
+the recording lack their FSM state and show up as errors or early returns
+in both runs, so compare reports made from the same recording and snapshot.
+Inline buttons are signed (see callback_codec.py): export the production
+CALLBACK_SECRET, or BOT_TOKEN when it is unset, so recorded taps verify.
+At any speed other than 1 the per-chat flood limits are lifted (as in
+tools.loadtest) and the dedup window is scaled to the replay pace; at
+--speed 0 it is off, so recorded double taps reach the handlers.
+Nothing is sent to Telegram either way.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import TelegramObject, Update
+
+from metrics import handler_name
+from tools.fake_telegram import FakeTelegramSession
+from tools.loadtest import latency_summary
+
+logger = logging.getLogger(__name__)
+
+
+def load_recording(path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Header and records of a recording, oldest first"""
+    header = {}
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "recording" in item:
+                header = item["recording"]
+            else:
+                records.append(item)
+    records.sort(key=lambda record: record["ts"])
+    return header, records
+
+
+def chat_key(update: Dict[str, Any]) -> Optional[int]:
+    """Chat an update belongs to; updates without one are replayed in their own task"""
+    for event in update.values():
+        if isinstance(event, dict):
+            chat = event.get("chat") or (event.get("message") or {}).get("chat") or event.get("from")
+            if chat:
+                return chat.get("id")
+    return None
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Inner event middleware collecting raw handler durations for the report"""
+
+    def __init__(self):
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.durations[handler_name(data)].append(time.perf_counter() - started)
+
+
+class Replayer:
+    """Feeds recorded updates to the dispatcher with the requested pacing"""
+
+    def __init__(self, bot: Bot, dispatcher, session: FakeTelegramSession, speed: float):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.session = session
+        self.speed = speed
+        self.timing = HandlerTimingMiddleware()
+        self.latencies: List[float] = []
+        self.recorded: List[float] = []
+        self.lag: List[float] = []
+        self.errors: Counter = Counter()
+
+        for event_name, observer in dispatcher.observers.items():
+            if event_name not in ("update", "error"):
+                observer.middleware(self.timing)
+
+    async def _feed(self, record: Dict[str, Any]):
+        update = Update.model_validate(record["update"], context={"bot": self.bot})
+        started = time.perf_counter()
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors[f"{type(e).__name__}: {e}"] += 1
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+            if record.get("duration_ms") is not None:
+                self.recorded.append(record["duration_ms"] / 1000)
+
+    async def _replay_chat(self, records: List[Dict[str, Any]], first_ts: float, started: float):
+        for record in records:
+            if self.speed:
+                due = started + (record["ts"] - first_ts) / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                # How far behind schedule the update was sent
+                self.lag.append(max(0.0, -delay))
+            await self._feed(record)
+
+    async def run(self, records: List[Dict[str, Any]]) -> float:
+        chats: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
+        for index, record in enumerate(records):
+            key = chat_key(record["update"])
+            chats[key if key is not None else f"update-{index}"].append(record)
+
+        first_ts = records[0]["ts"]
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self._replay_chat(chat_records, first_ts, started) for chat_records in chats.values()
+        ))
+        return time.perf_counter() - started
+
+    def report(self, records: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+        span = records[-1]["ts"] - records[0]["ts"]
+        return {
+            "updates": len(records),
+            "chats": len({chat_key(record["update"]) for record in records}),
+            "recorded_span_s": round(span, 2),
+            "speed": self.speed,
+            "elapsed_s": round(elapsed, 2),
+            "updates_per_s": round(len(records) / elapsed, 1) if elapsed else None,
+            "latency": latency_summary(self.latencies),
+            "recorded_latency": latency_summary(self.recorded),
+            "schedule_lag": latency_summary(self.lag),
+            "handlers": {
+                name: latency_summary(durations)
+                for name, durations in sorted(self.timing.durations.items())
+            },
+            "bot_api_calls": dict(self.session.calls),
+            "errors": dict(self.errors.most_common(10)),
+        }
+
+
+def copy_database(source: str, target: str):
+    """Consistent copy of a live SQLite file, WAL included"""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _ratio(current: Optional[float], baseline: Optional[float]) -> str:
+    if current is None or baseline is None:
+        return "-"
+    if not baseline:
+        return "-" if not current else "new"
+    return f"{current / baseline:.2f}x"
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    print(
+        f"Replayed {report['updates']} updates from {report['chats']} chats "
+        f"({report['recorded_span_s']}s recorded) in {report['elapsed_s']}s, "
+        f"{report['updates_per_s']} updates/s"
+    )
+
+    rows = [("update", report["latency"], (baseline or {}).get("latency", {}))]
+    base_handlers = (baseline or {}).get("handlers", {})
+    for name in sorted(set(report["handlers"]) | set(base_handlers)):
+        rows.append((name, report["handlers"].get(name, {}), base_handlers.get(name, {})))
+
+    print("\nLatency (ms)")
+    header = f"{'handler':<32}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}"
+    if baseline:
+        header += f"{'base p50':>10}{'base p95':>10}{'p95 ratio':>11}"
+    print(header)
+    for name, summary, base in rows:
+        line = (
+            f"{name:<32}{summary.get('count', 0):>8}{summary.get('p50_ms', '-'):>10}"
+            f"{summary.get('p95_ms', '-'):>10}{summary.get('p99_ms', '-'):>10}"
+        )
+        if baseline:
+            line += (
+                f"{base.get('p50_ms', '-'):>10}{base.get('p95_ms', '-'):>10}"
+                f"{_ratio(summary.get('p95_ms'), base.get('p95_ms')):>11}"
+            )
+        print(line)
+
+    print("\nBot API calls")
+    base_calls = (baseline or {}).get("bot_api_calls", {})
+    for method in sorted(set(report["bot_api_calls"]) | set(base_calls)):
+        count = report["bot_api_calls"].get(method, 0)
+        if baseline:
+            base_count = base_calls.get(method, 0)
+            print(f"{method:<32}{count:>8}{base_count:>10}{count - base_count:>+10}")
+        else:
+            print(f"{method:<32}{count:>8}")
+
+    if report["speed"]:
+        print(f"\nSchedule lag (ms): {report['schedule_lag']}")
+    if report["errors"]:
+        print(f"Errors: {report['errors']}")
+
+
+async def run(args, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Settings are read when these modules are imported, so the
+    # environment has to point at the replay database first
+    from database import db
+    from fsm_storage import storage
+    from main import get_dispatcher
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    await db.init_db()
+    try:
+        session = FakeTelegramSession(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+        bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+        replayer = Replayer(bot, get_dispatcher(), session, args.speed)
+        elapsed = await replayer.run(records)
+        return replayer.report(records, elapsed)
+    finally:
+        await storage.close()
+        await db.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="JSONL file written by the update recorder")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = recorded pace, N = N times faster, 0 = max")
+    parser.add_argument("--db", help="database snapshot to replay against (copied, never modified)")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="simulated Bot API latency")
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--compare", help="JSON report of a previous run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="keep INFO logging")
+    args = parser.parse_args()
+    if args.speed < 0:
+        parser.error("--speed must not be negative")
+
+    header, records = load_recording(args.recording)
+    if not records:
+        parser.error(f"{args.recording} contains no updates")
+    if header.get("version", 1) != 1:
+        parser.error(f"Unsupported recording version {header.get('version')}")
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "replay.db")
+        if args.db:
+            copy_database(args.db, path)
+        else:
+            logger.warning("No --db snapshot given: replaying against an empty database")
+        os.environ["DATABASE_PATH"] = path
+        os.environ["RECORD_UPDATES_PATH"] = ""
+        os.environ.setdefault("BOT_TOKEN", "123456:REPLAY")
+        # The admin keeps its real id in recordings, so admin commands replay as admin
+        keep_ids = header.get("keep_ids") or [1]
+        os.environ["ADMIN_CHAT_ID"] = str(keep_ids[0])
+        if args.speed != 1:
+            # Flood limits count wall-clock seconds; a faster pace would drop taps production accepted
+            from config import Settings
+            os.environ.setdefault("FLOOD_RATE_PER_SECOND", "1000")
+            os.environ.setdefault("FLOOD_BURST", "1000")
+            dedup_ttl = float(os.environ.get("DEDUP_TTL_SECONDS", Settings.model_fields["DEDUP_TTL_SECONDS"].default))
+            os.environ["DEDUP_TTL_SECONDS"] = str(dedup_ttl / args.speed if args.speed else 0)
+        report = asyncio.run(run(args, records))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print_report(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,124 @@
+import asyncio
+import logging
+import random
+from typing import Any, Dict, List, Optional
+
 import gspread
+from gspread.exceptions import APIError
 from google.oauth2.service_account import Credentials
+from config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
 
 # Google Sheets setup
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"  # required to search by title
+]
 
+# Quota exhaustion and transient server errors are worth retrying
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
 
 
-def send_to_sheet(name,phone,score,username):
-    SCOPES = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive"  # required to search by title
-    ]
-    CREDS = Credentials.from_service_account_file("abulaziz-7b85d06b6813.json", scopes=SCOPES)
-    client = gspread.authorize(CREDS)
-    sheet = client.open("Urolog").worksheet("Sheet1")
+def is_retryable_sheet_error(error: Exception) -> bool:
+    if isinstance(error, APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class GspreadSheetBackend:
+    """Appends rows to a worksheet through gspread
+
+    The authorized client and worksheet handle are created once and reused.
+    Methods are blocking and meant to run in a worker thread.
+    """
+
+    def __init__(self, credentials_file: str, spreadsheet: str, worksheet: str):
+        self.credentials_file = credentials_file
+        self.spreadsheet = spreadsheet
+        self.worksheet = worksheet
+        self._worksheet = None
+
+    def _get_worksheet(self):
+        if self._worksheet is None:
+            creds = Credentials.from_service_account_file(self.credentials_file, scopes=SCOPES)
+            client = gspread.authorize(creds)
+            self._worksheet = client.open(self.spreadsheet).worksheet(self.worksheet)
+        return self._worksheet
+
+    def append_rows(self, rows: List[List[Any]]):
+        try:
+            self._get_worksheet().append_rows(rows)
+        except Exception as e:
+            if not is_retryable_sheet_error(e):
+                # Re-authorize and reopen the sheet on the next attempt
+                self._worksheet = None
+            raise
+
+
+class FakeSheetBackend:
+    """In-memory sheet backend for offline tests
+
+    fail_times makes the first N append calls raise a retryable error.
+    """
+
+    def __init__(self, fail_times: int = 0, error: Optional[Exception] = None):
+        self.rows: List[List[Any]] = []
+        self.calls = 0
+        self.fail_times = fail_times
+        self.error = error or TimeoutError("Simulated sheet timeout")
+
+    def append_rows(self, rows: List[List[Any]]):
+        self.calls += 1
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise self.error
+        self.rows.extend(rows)
+
+
+class SheetExporter:
+    """Appends result rows to a sheet off the event loop
+
+    Each append_rows call runs the blocking backend in a worker thread and
+    retries retryable errors with exponential backoff. Batching and
+    durability are handled by the export outbox (see outbox.py).
+    """
+
+    def __init__(self, backend, max_retries: int = 3, backoff_base: float = 1.0):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._stats = {"exported": 0, "batches": 0, "retries": 0}
+
+    async def append_rows(self, rows: List[List[Any]]):
+        """Append rows in a worker thread, retrying retryable errors"""
+        attempt = 0
+        while True:
+            try:
+                await asyncio.to_thread(self.backend.append_rows, rows)
+                break
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_sheet_error(e):
+                    raise
+                delay = self.backoff_base * (2 ** attempt) * (1 + random.random())
+                attempt += 1
+                self._stats["retries"] += 1
+                logger.warning(f"Sheet export failed ({e}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+        self._stats["batches"] += 1
+        self._stats["exported"] += len(rows)
 
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats)
 
-    sheet.append_row([name,phone,score,username])
-    return True
 
+# Global exporter instance
+sheet_exporter = SheetExporter(
+    GspreadSheetBackend(
+        settings.GOOGLE_CREDENTIALS_FILE,
+        settings.GOOGLE_SPREADSHEET_NAME,
+        settings.GOOGLE_WORKSHEET_NAME
+    )
+)
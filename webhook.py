@@ -0,0 +1,51 @@
+import asyncio
+import logging
+from typing import Any, Dict, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookProcessor:
+    """Feeds webhook updates to the dispatcher in background tasks
+
+    The HTTP handler only validates and submits the update, so Telegram
+    gets its response immediately. How many run at once, and in which
+    order per chat, is up to the dispatcher's ChatScheduler (see
+    scheduler.py). submit() refuses new updates once max_pending are
+    queued or running, and Telegram then redelivers them later.
+    """
+
+    def __init__(self, bot: Bot, dispatcher: Dispatcher, max_pending: int = 1000):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.max_pending = max_pending
+        self._tasks: Set[asyncio.Task] = set()
+        self._stats = {"received": 0, "rejected": 0, "failed": 0}
+
+    def submit(self, update: Update) -> bool:
+        if len(self._tasks) >= self.max_pending:
+            self._stats["rejected"] += 1
+            return False
+        self._stats["received"] += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _process(self, update: Update):
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.error(f"Error processing update {update.update_id}: {e}")
+
+    async def close(self):
+        """Wait for updates that are still being processed"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": len(self._tasks), **self._stats}
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Bounded write-behind queue flushed in batches
+
+    Rows are queued by put() and written by write_batch in a single call
+    every flush_interval_ms or as soon as flush_rows rows are waiting,
+    whichever comes first. When max_pending rows are queued, put() waits
+    until a flush makes room (backpressure). flush() writes everything
+    queued so far and returns once it is stored.
+
+    put_keyed() queues a row that replaces any unwritten row with the same
+    key, so only the last write per key reaches write_batch, as its second
+    argument (a dict). pending() returns that row until it is stored.
+    """
+
+    def __init__(self, write_batch: Callable[[List[Any], Dict[Hashable, Any]], Awaitable[None]],
+                 flush_rows: int = 50, flush_interval_ms: int = 200, max_pending: int = 1000):
+        self._write_batch = write_batch
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max(self.flush_rows, max_pending)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_pending)
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        # Rows of a failed batch, retried first; never more than max_pending
+        self._carry: List[Any] = []
+        # Keyed rows waiting for a flush, and those being written (or carried
+        # after a failed write); newer rows for a key win over older ones
+        self._keyed: Dict[Hashable, Any] = {}
+        self._writing: Dict[Hashable, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        self._stats = {
+            "batches": 0,
+            "rows": 0,
+            "batch_max": 0,
+            "flush_seconds_total": 0.0,
+            "flush_seconds_max": 0.0,
+            "failures": 0,
+        }
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the background flusher and write whatever is still queued"""
+        if self._task is not None:
+            # Stopped by a flag rather than cancel(): wait_for may swallow a
+            # cancellation that races with the wakeup event (Python 3.11)
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def put(self, row: Any):
+        self.start()
+        await self._queue.put(row)
+        if self._queue.qsize() + len(self._keyed) >= self.flush_rows:
+            self._wakeup.set()
+
+    async def put_keyed(self, key: Hashable, row: Any):
+        self.start()
+        if key not in self._keyed and len(self._keyed) >= self.max_pending:
+            # Backpressure: write the queued keys before taking a new one
+            await self.flush()
+        self._keyed[key] = row
+        if self._queue.qsize() + len(self._keyed) >= self.flush_rows:
+            self._wakeup.set()
+
+    def pending(self, key: Hashable) -> Optional[Any]:
+        """Latest keyed row for key that is not stored yet"""
+        row = self._keyed.get(key)
+        return row if row is not None else self._writing.get(key)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._closing:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+
+    async def flush(self):
+        """Write all queued rows, in batches of at most max_pending rows"""
+        async with self._flush_lock:
+            # Rows queued from now on go with a later flush, so a steady
+            # stream of puts cannot keep the caller waiting here
+            remaining = self._queue.qsize()
+            while True:
+                batch = self._carry
+                self._carry = []
+                # A failed batch stays bounded: the rest waits in the queue,
+                # where put() applies backpressure
+                while len(batch) < self.max_pending and remaining:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except asyncio.QueueEmpty:
+                        break
+                    remaining -= 1
+                self._writing.update(self._keyed)
+                self._keyed = {}
+                if not batch and not self._writing:
+                    return
+
+                size = len(batch) + len(self._writing)
+                started = time.perf_counter()
+                try:
+                    await self._write_batch(batch, self._writing.copy())
+                except Exception:
+                    # Keep the rows for the next flush instead of dropping them
+                    self._carry = batch
+                    self._stats["failures"] += 1
+                    raise
+                self._writing = {}
+                elapsed = time.perf_counter() - started
+
+                stats = self._stats
+                stats["batches"] += 1
+                stats["rows"] += size
+                stats["batch_max"] = max(stats["batch_max"], size)
+                stats["flush_seconds_total"] += elapsed
+                stats["flush_seconds_max"] = max(stats["flush_seconds_max"], elapsed)
+                if not remaining:
+                    return
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch size and flush latency statistics"""
+        stats = self._stats
+        batches = stats["batches"]
+        return {
+            "pending": self._queue.qsize() + len(self._carry) + len(self._keyed) + len(self._writing),
+            "batches": batches,
+            "rows": stats["rows"],
+            "batch_avg": round(stats["rows"] / batches, 2) if batches else 0.0,
+            "batch_max": stats["batch_max"],
+            "flush_avg_ms": round(stats["flush_seconds_total"] / batches * 1000, 3) if batches else 0.0,
+            "flush_max_ms": round(stats["flush_seconds_max"] * 1000, 3),
+            "failures": stats["failures"],
+        }